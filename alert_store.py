@@ -0,0 +1,198 @@
+import json
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    device_id TEXT NOT NULL,
+    alert_type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    score REAL,
+    details TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts (ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_device_ts ON alerts (device_id, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_type_ts ON alerts (alert_type, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_severity_ts ON alerts (severity, ts);
+"""
+
+Cursor = Tuple[float, int]
+
+
+class AlertStore:
+    """基于SQLite的警报存储
+
+    警报先进入内存队列，由后台写线程按批在一个事务中写入（WAL模式，读写互不阻塞）。
+    时间、设备、类型、严重程度都有索引；查询使用 (时间, id) 游标分页，
+    翻页成本与历史警报总量无关。
+    """
+
+    def __init__(self, path: str = "alerts.db", batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._closed = False
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="alert-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, alert: Dict):
+        """加入一条警报（不阻塞调用方）"""
+        if not self._closed:
+            self._queue.put(alert)
+
+    @staticmethod
+    def _to_row(alert: Dict) -> tuple:
+        """警报字典转换为数据库行"""
+        timestamp = alert.get("timestamp")
+        if isinstance(timestamp, str):
+            ts = datetime.fromisoformat(timestamp).timestamp()
+        elif isinstance(timestamp, datetime):
+            ts = timestamp.timestamp()
+        else:
+            ts = float(timestamp or datetime.now().timestamp())
+        return (ts, alert["device_id"], alert["alert_type"], alert["severity"],
+                alert.get("anomaly_score"), json.dumps(alert, ensure_ascii=False, default=str))
+
+    def _write_loop(self):
+        """后台批量写入：每次取出队列中已有的全部警报（最多 batch_size 条）放在一个事务中"""
+        conn = self._connection()
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.batch_size and items[-1] is not None:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = items[-1] is None
+            batch = items[:-1] if stop else items
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO alerts (ts, device_id, alert_type, severity, score, details) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            [self._to_row(alert) for alert in batch])
+                except (sqlite3.Error, KeyError, ValueError) as e:
+                    print(f"⚠️ 警报写入失败: {e}")
+
+            for _ in items:
+                self._queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    def flush(self):
+        """等待队列中的警报全部写入"""
+        if self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """写完剩余警报后关闭"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._writer.join()
+
+    @staticmethod
+    def _where(device_id: str = None, alert_type: str = None, severity: str = None,
+               start: float = None, end: float = None) -> Tuple[List[str], List]:
+        """构造查询条件"""
+        clauses, params = [], []
+        if device_id is not None:
+            clauses.append("device_id = ?")
+            params.append(device_id)
+        if alert_type is not None:
+            clauses.append("alert_type = ?")
+            params.append(alert_type)
+        if severity is not None:
+            clauses.append("severity = ?")
+            params.append(severity)
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        return clauses, params
+
+    def query(self, device_id: str = None, alert_type: str = None, severity: str = None,
+              start: float = None, end: float = None, limit: int = 100,
+              cursor: Cursor = None) -> Tuple[List[Dict], Optional[Cursor]]:
+        """按条件查询警报（按时间倒序）
+
+        返回 (警报列表, 下一页游标)；把游标传回即可继续翻页，没有更多数据时游标为 None。
+        """
+        clauses, params = self._where(device_id, alert_type, severity, start, end)
+        if cursor is not None:
+            clauses.append("(ts < ? OR (ts = ? AND id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+
+        sql = "SELECT id, ts, details FROM alerts"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        alerts = [json.loads(details) for _, _, details in rows]
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return alerts, next_cursor
+
+    def iter_alerts(self, page_size: int = 1000, **filters) -> Iterator[Dict]:
+        """逐页遍历符合条件的警报"""
+        cursor = None
+        while True:
+            alerts, cursor = self.query(limit=page_size, cursor=cursor, **filters)
+            yield from alerts
+            if cursor is None:
+                break
+
+    def summary(self, start: float = None, end: float = None, device_id: str = None) -> Dict:
+        """按严重程度和类型汇总警报数量"""
+        clauses, params = self._where(device_id=device_id, start=start, end=end)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        conn = self._connection()
+
+        by_severity = dict(conn.execute(
+            f"SELECT severity, COUNT(*) FROM alerts{where} GROUP BY severity", params).fetchall())
+        by_type = dict(conn.execute(
+            f"SELECT alert_type, COUNT(*) FROM alerts{where} GROUP BY alert_type", params).fetchall())
+
+        return {
+            "total_alerts": sum(by_severity.values()),
+            "high_severity": by_severity.get("high", 0),
+            "medium_severity": by_severity.get("medium", 0),
+            "by_severity": by_severity,
+            "by_type": by_type
+        }
+
+    def export_jsonl(self, filename: str, **filters) -> int:
+        """把符合条件的警报逐条写入JSON Lines文件，返回条数"""
+        count = 0
+        with open(filename, "w", encoding="utf-8") as f:
+            for alert in self.iter_alerts(**filters):
+                f.write(json.dumps(alert, ensure_ascii=False) + "\n")
+                count += 1
+        return count
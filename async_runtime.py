@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+
+class AsyncRuntime:
+    """基于asyncio的统一调度运行时
+
+    在单独的后台线程中运行一个事件循环，窗口关闭、异常评分、警报分发、
+    数据导出和面板刷新都以周期任务的形式挂在这个循环上，停止时统一取消。
+    抓包线程通过 submit() 把数据包交给事件循环（线程安全的桥接队列）。
+    """
+
+    def __init__(self, queue_size: int = 100000, batch_size: int = 512):
+        self.queue_size = queue_size
+        self.batch_size = batch_size  # 每批处理多少个数据包后让出事件循环
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.running = False
+        self.dropped_items = 0
+        self._thread = None
+        self._started = threading.Event()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pending = deque()
+        self._wakeup_scheduled = False
+        self._wakeup_event: Optional[asyncio.Event] = None
+        self._item_handler: Optional[Callable] = None
+
+    def start(self):
+        """启动事件循环线程"""
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run_loop, name="iot-async-runtime", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        self.running = True
+
+    def _run_loop(self):
+        """事件循环线程入口"""
+        asyncio.set_event_loop(self.loop)
+        self._wakeup_event = asyncio.Event()
+        self._tasks["runtime.bridge"] = self.loop.create_task(self._drain_bridge())
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def stop(self, timeout: float = 5.0):
+        """取消所有任务并停止事件循环"""
+        if not self.running:
+            return
+        self.running = False
+        future = asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            print(f"运行时停止异常: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    async def _cancel_all(self):
+        """取消全部任务（包括未注册的连接处理等任务）"""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def call_soon(self, func: Callable, *args):
+        """在事件循环线程中执行函数（线程安全）"""
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def run_blocking(self, name: str, func: Callable, *args):
+        """在线程池中执行一次阻塞函数（线程安全），出错时打印"""
+        self.loop.call_soon_threadsafe(self._start_blocking, name, func, args)
+
+    def _start_blocking(self, name, func, args):
+        """在事件循环线程中把函数提交到线程池"""
+        future = self.loop.run_in_executor(None, func, *args)
+        future.add_done_callback(lambda f: self._report_blocking(name, f))
+
+    @staticmethod
+    def _report_blocking(name, future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"后台任务 {name} 执行错误: {future.exception()}")
+
+    def run_coroutine(self, coro):
+        """在事件循环中运行协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def schedule_periodic(self, name: str, interval: float, func: Callable,
+                          blocking: bool = False, run_immediately: bool = False):
+        """注册周期任务
+
+        func 可以是普通函数或协程函数；blocking=True 时普通函数会放到线程池中执行，
+        避免阻塞事件循环。同名任务会被替换。
+        """
+        self.loop.call_soon_threadsafe(self._add_periodic, name, interval, func, blocking, run_immediately)
+
+    def _add_periodic(self, name, interval, func, blocking, run_immediately):
+        """在事件循环线程中创建周期任务"""
+        self._add_task(name, self._periodic(name, interval, func, blocking, run_immediately))
+
+    def start_task(self, name: str, coro):
+        """启动一个长期运行的协程任务（线程安全），停止时统一取消"""
+        self.loop.call_soon_threadsafe(self._add_task, name, coro)
+
+    def _add_task(self, name: str, coro):
+        """在事件循环线程中创建任务，同名任务会被替换"""
+        old_task = self._tasks.pop(name, None)
+        if old_task:
+            old_task.cancel()
+        self._tasks[name] = self.loop.create_task(coro, name=name)
+
+    async def _periodic(self, name, interval, func, blocking, run_immediately):
+        """按固定节拍执行任务，使用单调时钟避免漂移"""
+        next_run = self.loop.time() + (0 if run_immediately else interval)
+        while True:
+            await asyncio.sleep(max(0.0, next_run - self.loop.time()))
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func()
+                elif blocking:
+                    await self.loop.run_in_executor(None, func)
+                else:
+                    func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"周期任务 {name} 执行错误: {e}")
+            next_run += interval
+            # 任务执行时间超过周期时直接跳到下一个节拍，而不是连续补跑
+            now = self.loop.time()
+            if next_run < now:
+                next_run = now + interval - ((now - next_run) % interval)
+
+    def cancel(self, name: str):
+        """取消指定任务"""
+        if self.loop and self.running:
+            self.loop.call_soon_threadsafe(self._cancel_task, name)
+
+    def _cancel_task(self, name: str):
+        task = self._tasks.pop(name, None)
+        if task:
+            task.cancel()
+
+    def set_item_handler(self, handler: Callable[[Any], None]):
+        """设置桥接队列的消费函数（在事件循环线程中调用）"""
+        self._item_handler = handler
+
+    def submit(self, item: Any):
+        """从任意线程提交数据（例如抓包线程提交的数据包）"""
+        if len(self._pending) >= self.queue_size:
+            self.dropped_items += 1
+            return
+        self._pending.append(item)
+        if not self._wakeup_scheduled and self.running:
+            self._wakeup_scheduled = True
+            self.loop.call_soon_threadsafe(self._wakeup_event.set)
+
+    async def _drain_bridge(self):
+        """消费桥接队列，按批处理并定期让出事件循环"""
+        while True:
+            await self._wakeup_event.wait()
+            self._wakeup_event.clear()
+            self._wakeup_scheduled = False
+
+            processed = 0
+            while self._pending:
+                item = self._pending.popleft()
+                if self._item_handler:
+                    try:
+                        self._item_handler(item)
+                    except Exception as e:
+                        print(f"数据处理错误: {e}")
+                processed += 1
+                if processed % self.batch_size == 0:
+                    await asyncio.sleep(0)
+
+    def get_status(self) -> Dict:
+        """获取运行时状态"""
+        return {
+            "running": self.running,
+            "tasks": sorted(self._tasks.keys()),
+            "pending_items": len(self._pending),
+            "dropped_items": self.dropped_items,
+            "timestamp": time.time()
+        }
@@ -0,0 +1,230 @@
+import csv
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+from iot_traffic_monitor import FEATURE_NAMES
+
+# 设备历史：(窗口结束时间, 特征矩阵)，按时间排序
+DeviceHistory = Tuple[np.ndarray, np.ndarray]
+
+
+def _to_epoch(value) -> float:
+    """时间戳统一转换为浮点epoch秒（导出文件中是ISO字符串）"""
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def load_exports(paths: Iterable[str]) -> Dict[str, DeviceHistory]:
+    """读取一个或多个流量导出文件（save_traffic_export 的格式）
+
+    定时导出的文件之间会有重叠，按 (设备, 时间戳) 去重后拼接成完整历史。
+    """
+    rows: Dict[str, Dict[float, List[float]]] = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for device_id, records in data.items():
+            device_rows = rows.setdefault(device_id, {})
+            for record in records:
+                device_rows[_to_epoch(record["timestamp"])] = [float(record.get(name, 0.0))
+                                                               for name in FEATURE_NAMES]
+
+    histories = {}
+    for device_id, device_rows in rows.items():
+        timestamps = np.array(sorted(device_rows), dtype=float)
+        features = np.array([device_rows[ts] for ts in timestamps.tolist()], dtype=float)
+        histories[device_id] = (timestamps, features.reshape(-1, len(FEATURE_NAMES)))
+    return histories
+
+
+def load_checkpoint_history(directory: str) -> Dict[str, DeviceHistory]:
+    """从最新检查点读取各设备的历史窗口（不加载模型）"""
+    from checkpoint import CheckpointManager
+
+    state = CheckpointManager(directory).read_latest(include_models=False)
+    if state is None:
+        return {}
+
+    columns = list(state["columns"])
+    feature_columns = [columns.index(name) if name in columns else None for name in FEATURE_NAMES]
+    values = np.asarray(state["values"])
+    offsets = state["offsets"]
+
+    histories = {}
+    for i, device_id in enumerate(state["device_ids"]):
+        rows = values[offsets[i]:offsets[i + 1]]
+        features = np.zeros((len(rows), len(FEATURE_NAMES)))
+        for j, column in enumerate(feature_columns):
+            if column is not None:
+                features[:, j] = rows[:, column]
+        histories[device_id] = (rows[:, columns.index("timestamp")].astype(float), features)
+    return histories
+
+
+def load_incidents(path: str) -> Dict[str, List[Tuple[float, float]]]:
+    """读取标注的安全事件（JSON 列表或带表头的 CSV：device_id, start, end）"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = json.load(f)
+
+    incidents: Dict[str, List[Tuple[float, float]]] = {}
+    for record in records:
+        incidents.setdefault(record["device_id"], []).append(
+            (_to_epoch(record["start"]), _to_epoch(record["end"])))
+    return incidents
+
+
+def _score_device(timestamps: np.ndarray, features: np.ndarray, contamination: float,
+                  n_estimators: int, train_windows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """按监控的逻辑对单个设备回放：前 train_windows 个窗口到齐时建模（该窗口不评分），
+    之后的窗口用同一个模型一次性批量评分。返回 (窗口时间, 异常分数)。"""
+    if len(features) <= train_windows:
+        return timestamps[:0], features[:0, 0]
+
+    from sklearn.ensemble import IsolationForest
+    model = IsolationForest(contamination=contamination, n_estimators=n_estimators, random_state=42)
+    model.fit(features[:train_windows])
+    return timestamps[train_windows:], np.abs(model.decision_function(features[train_windows:]))
+
+
+def _score_batch(jobs: List[Tuple]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """进程池任务：对一批设备评分"""
+    return [_score_device(*job) for job in jobs]
+
+
+class Backtester:
+    """告警阈值和检测参数回测
+
+    在模拟时钟上全速回放历史窗口：每组检测参数下每个设备只训练一次模型，
+    所有窗口批量评分；阈值扫描只是对排好序的分数做二分查找，
+    因此增加阈值几乎没有额外成本。结果按参数组合给出告警数、
+    命中标注事件的精确率和事件召回率。
+    """
+
+    def __init__(self, histories: Dict[str, DeviceHistory],
+                 incidents: Dict[str, List[Tuple[float, float]]] = None,
+                 tolerance: float = 0.0):
+        self.histories = histories
+        self.incidents = incidents or {}
+        self.tolerance = tolerance  # 事件结束后多久内的告警仍算命中
+        self.incident_count = sum(len(v) for v in self.incidents.values())
+
+    def _label(self, device_id: str, timestamps: np.ndarray, first_incident: int) -> np.ndarray:
+        """为每个窗口标注所属事件编号（-1 表示不在任何事件内）"""
+        labels = np.full(len(timestamps), -1, dtype=np.int64)
+        for offset, (start, end) in enumerate(self.incidents.get(device_id, [])):
+            inside = (timestamps >= start) & (timestamps <= end + self.tolerance) & (labels < 0)
+            labels[inside] = first_incident + offset
+        return labels
+
+    def score(self, contamination: float = 0.1, n_estimators: int = 100,
+              train_windows: int = 50, workers: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """用一组检测参数为所有窗口评分，返回 (分数, 事件编号)"""
+        device_ids = list(self.histories)
+        jobs = [(*self.histories[d], contamination, n_estimators, train_windows) for d in device_ids]
+
+        if workers > 1 and len(jobs) > 1:
+            chunk_size = max(1, len(jobs) // (workers * 4))
+            chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = [result for batch in pool.map(_score_batch, chunks) for result in batch]
+        else:
+            results = _score_batch(jobs)
+
+        scores, labels = [], []
+        first_incident = 0
+        for device_id, (timestamps, device_scores) in zip(device_ids, results):
+            scores.append(device_scores)
+            labels.append(self._label(device_id, timestamps, first_incident))
+            first_incident += len(self.incidents.get(device_id, []))
+
+        if not scores:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        return np.concatenate(scores), np.concatenate(labels)
+
+    def evaluate(self, scores: np.ndarray, labels: np.ndarray,
+                 thresholds: Sequence[float]) -> List[Dict]:
+        """对一组分数一次性计算所有阈值下的告警数、精确率和召回率"""
+        order = np.argsort(-scores, kind="stable")
+        sorted_scores = scores[order]
+        true_positive_cum = np.cumsum(labels[order] >= 0)
+
+        # 每个事件内的最高分：阈值低于它时该事件被检出；
+        # 没有历史数据的设备的事件保持 -inf，仍计入召回率的分母
+        incident_max = np.full(self.incident_count, -np.inf)
+        hits = labels >= 0
+        np.maximum.at(incident_max, labels[hits], scores[hits])
+        incident_max.sort()
+
+        results = []
+        ascending = sorted_scores[::-1]
+        for threshold in thresholds:
+            alerts = int(len(ascending) - np.searchsorted(ascending, threshold, side="right"))
+            true_positives = int(true_positive_cum[alerts - 1]) if alerts else 0
+            detected = int(len(incident_max) - np.searchsorted(incident_max, threshold, side="right"))
+
+            precision = true_positives / alerts if alerts else None
+            recall = detected / self.incident_count if self.incident_count else None
+            f1 = (2 * precision * recall / (precision + recall)
+                  if precision and recall else None)
+            results.append({
+                "threshold": float(threshold),
+                "alerts": alerts,
+                "true_positives": true_positives,
+                "precision": precision,
+                "incidents_detected": detected,
+                "recall": recall,
+                "f1": f1
+            })
+        return results
+
+    def sweep(self, thresholds: Sequence[float], contamination: Sequence[float] = (0.1,),
+              n_estimators: Sequence[int] = (100,), train_windows: Sequence[int] = (50,),
+              workers: int = 1) -> List[Dict]:
+        """扫描检测参数和阈值的所有组合"""
+        rows = []
+        for c, n, w in itertools.product(contamination, n_estimators, train_windows):
+            scores, labels = self.score(c, n, w, workers)
+            for result in self.evaluate(scores, labels, sorted(thresholds)):
+                rows.append({"contamination": c, "n_estimators": n, "train_windows": w,
+                             "windows_scored": len(scores), **result})
+        return rows
+
+
+def parse_values(text: str, cast=float) -> List:
+    """解析参数列表："0.05,0.1,0.2" 或 "起点:终点:步长"（包含终点）"""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [cast(round(start + i * step, 10)) for i in range(count)]
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+
+def best_setting(rows: List[Dict]) -> Dict:
+    """F1 最高的参数组合（没有标注事件时为 None）"""
+    scored = [row for row in rows if row["f1"] is not None]
+    return max(scored, key=lambda row: row["f1"]) if scored else None
+
+
+def format_results(rows: List[Dict]) -> str:
+    """格式化为文本表格"""
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    lines = [f"{'污染率':>6} {'树数':>5} {'训练窗口':>6} {'阈值':>7} {'告警数':>7} "
+             f"{'命中':>6} {'精确率':>7} {'检出事件':>6} {'召回率':>7} {'F1':>6}"]
+    for row in rows:
+        lines.append(f"{row['contamination']:>8.3f} {row['n_estimators']:>7} {row['train_windows']:>10} "
+                     f"{row['threshold']:>9.3f} {row['alerts']:>10} {row['true_positives']:>8} "
+                     f"{fmt(row['precision']):>10} {row['incidents_detected']:>10} "
+                     f"{fmt(row['recall']):>10} {fmt(row['f1']):>6}")
+    return "\n".join(lines)
@@ -0,0 +1,160 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointManager:
+    """监控状态检查点
+
+    每个检查点是一个目录：窗口数值矩阵和偏移量保存为 .npy（加载时内存映射），
+    模型和报告汇总保存为 pickle，其余元数据保存为 manifest.json。先写入临时目录并 fsync，
+    再原子重命名并更新 LATEST 指针，进程在任何时刻崩溃都不会留下半个检查点。
+    快照在调用线程中完成，序列化和写盘在后台线程中进行。
+    """
+
+    def __init__(self, directory: str = "checkpoints", keep: int = 2):
+        self.directory = directory
+        self.keep = keep
+        self.last_checkpoint = None
+        self._writer: Optional[threading.Thread] = None
+
+    def save(self, monitor, wait: bool = False) -> bool:
+        """保存检查点；上一次写入尚未完成时跳过"""
+        if self._writer and self._writer.is_alive():
+            if not wait:
+                return False
+            self._writer.join()
+
+        state = monitor.snapshot_state()
+        self._writer = threading.Thread(target=self._write, args=(state,),
+                                        name="checkpoint-writer", daemon=True)
+        self._writer.start()
+        if wait:
+            self._writer.join()
+        return True
+
+    def _write(self, state: Dict):
+        """把快照写入磁盘"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"ckpt_{int(state['timestamp'] * 1000)}"
+            tmp_dir = os.path.join(self.directory, name + ".tmp")
+            final_dir = os.path.join(self.directory, name)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            self._write_file(os.path.join(tmp_dir, "values.npy"),
+                             lambda f: np.save(f, state["values"]))
+            self._write_file(os.path.join(tmp_dir, "offsets.npy"),
+                             lambda f: np.save(f, state["offsets"]))
+            models = {"baseline_models": state["baseline_models"], "cohorts": state["cohorts"]}
+            self._write_file(os.path.join(tmp_dir, "models.pkl"),
+                             lambda f: pickle.dump(models, f, protocol=pickle.HIGHEST_PROTOCOL))
+            if state.get("reports") is not None:
+                self._write_file(os.path.join(tmp_dir, "reports.pkl"),
+                                 lambda f: pickle.dump(state["reports"], f, protocol=pickle.HIGHEST_PROTOCOL))
+
+            manifest = {
+                "version": CHECKPOINT_VERSION,
+                "timestamp": state["timestamp"],
+                "columns": state["columns"],
+                "device_ids": state["device_ids"],
+                "registry": state["registry"],
+                "model_mode": state["model_mode"]
+            }
+            self._write_file(os.path.join(tmp_dir, "manifest.json"),
+                             lambda f: f.write(json.dumps(manifest, ensure_ascii=False).encode("utf-8")))
+
+            os.replace(tmp_dir, final_dir)
+
+            # 原子更新指针
+            pointer_tmp = os.path.join(self.directory, "LATEST.tmp")
+            self._write_file(pointer_tmp, lambda f: f.write(name.encode("utf-8")))
+            os.replace(pointer_tmp, os.path.join(self.directory, "LATEST"))
+
+            self.last_checkpoint = final_dir
+            self._cleanup(name)
+        except Exception as e:
+            print(f"⚠️ 检查点写入失败: {e}")
+
+    @staticmethod
+    def _write_file(path: str, writer):
+        """写文件并刷到磁盘"""
+        with open(path, "wb") as f:
+            writer(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _cleanup(self, current: str):
+        """只保留最近的若干个检查点"""
+        checkpoints = sorted(d for d in os.listdir(self.directory)
+                             if d.startswith("ckpt_") and not d.endswith(".tmp"))
+        for name in checkpoints[:-self.keep]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def read_latest(self, include_models: bool = True) -> Optional[Dict]:
+        """读取最新检查点，返回 restore_state 所需的状态；没有检查点时返回 None
+
+        include_models=False 时不反序列化模型（也就不会导入 sklearn），
+        适合只需要历史窗口的场景（报告、回测）。
+        """
+        pointer = os.path.join(self.directory, "LATEST")
+        if not os.path.exists(pointer):
+            return None
+
+        with open(pointer, "r", encoding="utf-8") as f:
+            path = os.path.join(self.directory, f.read().strip())
+
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"检查点版本不兼容: {manifest.get('version')}")
+
+        models = {"baseline_models": {}, "cohorts": None}
+        if include_models:
+            with open(os.path.join(path, "models.pkl"), "rb") as f:
+                models = pickle.load(f)
+
+        # 较早的检查点没有报告汇总
+        reports = None
+        reports_path = os.path.join(path, "reports.pkl")
+        if os.path.exists(reports_path):
+            with open(reports_path, "rb") as f:
+                reports = pickle.load(f)
+
+        return {
+            "path": path,
+            "columns": manifest["columns"],
+            "device_ids": manifest["device_ids"],
+            "registry": manifest["registry"],
+            "model_mode": manifest["model_mode"],
+            "values": np.load(os.path.join(path, "values.npy"), mmap_mode="r"),
+            "offsets": np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"),
+            "baseline_models": models["baseline_models"],
+            "cohorts": models["cohorts"],
+            "reports": reports
+        }
+
+    def load(self, monitor, include_models: bool = True) -> bool:
+        """加载最新检查点到监控实例"""
+        try:
+            start = time.time()
+            state = self.read_latest(include_models)
+            if state is None:
+                return False
+
+            monitor.restore_state(state)
+            self.last_checkpoint = state["path"]
+            print(f"♻️ 已从检查点恢复 {len(state['device_ids'])} 个设备 ({time.time() - start:.2f}s)")
+            return True
+        except Exception as e:
+            print(f"⚠️ 检查点加载失败: {e}")
+            return False
@@ -0,0 +1,172 @@
+from typing import TYPE_CHECKING, Dict, Optional
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.ensemble import IsolationForest
+
+
+class CohortModelManager:
+    """按设备群组共享异常检测模型
+
+    每个设备只保存自身特征的均值/标准差（用于归一化），同类设备共享一个
+    IsolationForest。群组可以由显式的设备类型决定，否则按设备特征分布
+    （对数均值和对数标准差）做KMeans聚类。模型数量等于群组数量，
+    不随设备数量线性增长。
+    """
+
+    def __init__(self, n_cohorts: int = 8, max_samples_per_cohort: int = 20000,
+                 contamination: float = 0.1, random_state: int = 42):
+        self.n_cohorts = n_cohorts
+        self.max_samples_per_cohort = max_samples_per_cohort
+        self.contamination = contamination
+        self.random_state = random_state
+
+        self.device_types: Dict[str, str] = {}
+        self.device_profiles: Dict[str, tuple] = {}  # 设备ID -> (均值, 标准差)
+        self.device_cohort: Dict[str, str] = {}
+        self.cohort_models: Dict[str, "IsolationForest"] = {}
+        self.centroids: Optional[np.ndarray] = None
+        self.centroid_keys = []
+        self.last_trained = None
+        self.trained_devices = 0  # 上次训练时参与的设备数
+
+    @property
+    def trained(self) -> bool:
+        return bool(self.cohort_models)
+
+    def set_device_type(self, device_id: str, device_type: str):
+        """显式指定设备类型，同类型设备归入同一群组"""
+        self.device_types[device_id] = device_type
+
+    @staticmethod
+    def _profile(history: np.ndarray) -> tuple:
+        """计算设备归一化参数"""
+        mean = history.mean(axis=0)
+        std = history.std(axis=0)
+        std[std < 1e-6] = 1.0
+        return mean, std
+
+    @staticmethod
+    def _signature(profile: tuple) -> np.ndarray:
+        """设备行为签名，用于聚类"""
+        mean, std = profile
+        return np.concatenate([np.log1p(np.abs(mean)), np.log1p(std)])
+
+    def fit(self, histories: Dict[str, np.ndarray], timestamp: float = None):
+        """用所有设备的历史数据训练群组模型"""
+        if not histories:
+            return
+
+        self.device_profiles = {device_id: self._profile(history)
+                                for device_id, history in histories.items()}
+        self.device_cohort = {}
+
+        # 有显式类型的设备按类型分组，其余按行为聚类
+        untyped = [d for d in histories if d not in self.device_types]
+        for device_id in histories:
+            if device_id in self.device_types:
+                self.device_cohort[device_id] = f"type:{self.device_types[device_id]}"
+
+        # sklearn 加载较慢，只在第一次训练时导入
+        from sklearn.cluster import KMeans
+        from sklearn.ensemble import IsolationForest
+
+        self.centroids = None
+        self.centroid_keys = []
+        if untyped:
+            signatures = np.array([self._signature(self.device_profiles[d]) for d in untyped])
+            n_clusters = min(self.n_cohorts, len(untyped))
+            kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=self.random_state)
+            labels = kmeans.fit_predict(signatures)
+            self.centroids = kmeans.cluster_centers_
+            self.centroid_keys = [f"behavior:{i}" for i in range(n_clusters)]
+            for device_id, label in zip(untyped, labels):
+                self.device_cohort[device_id] = self.centroid_keys[label]
+
+        # 每个群组用归一化后的合并数据训练一个模型
+        pooled: Dict[str, list] = {}
+        for device_id, history in histories.items():
+            mean, std = self.device_profiles[device_id]
+            pooled.setdefault(self.device_cohort[device_id], []).append((history - mean) / std)
+
+        rng = np.random.default_rng(self.random_state)
+        self.cohort_models = {}
+        for cohort, parts in pooled.items():
+            X = np.vstack(parts)
+            if len(X) > self.max_samples_per_cohort:
+                X = X[rng.choice(len(X), self.max_samples_per_cohort, replace=False)]
+            model = IsolationForest(contamination=self.contamination, random_state=self.random_state)
+            model.fit(X)
+            self.cohort_models[cohort] = model
+
+        self.last_trained = timestamp
+        self.trained_devices = len(histories)
+
+    def should_retrain(self) -> bool:
+        """已分配设备数比上次训练时翻倍后重新训练（摊还后每设备O(1)）"""
+        return len(self.device_cohort) >= 2 * max(self.trained_devices, 1)
+
+    def assign(self, device_id: str, history: np.ndarray) -> Optional[str]:
+        """把训练后新出现的设备分配到已有群组（不重新训练）"""
+        profile = self._profile(history)
+
+        if device_id in self.device_types:
+            cohort = f"type:{self.device_types[device_id]}"
+            if cohort not in self.cohort_models:
+                return None
+        elif self.centroids is not None:
+            distances = np.linalg.norm(self.centroids - self._signature(profile), axis=1)
+            cohort = self.centroid_keys[int(np.argmin(distances))]
+        else:
+            return None
+
+        self.device_profiles[device_id] = profile
+        self.device_cohort[device_id] = cohort
+        return cohort
+
+    def has_model(self, device_id: str) -> bool:
+        """设备是否已分配到有模型的群组"""
+        return self.device_cohort.get(device_id) in self.cohort_models
+
+    def score(self, device_id: str, features: np.ndarray) -> float:
+        """用群组模型计算设备窗口的异常分数"""
+        mean, std = self.device_profiles[device_id]
+        model = self.cohort_models[self.device_cohort[device_id]]
+        normalized = ((features - mean) / std).reshape(1, -1)
+        return abs(model.decision_function(normalized)[0])
+
+    def remove(self, device_id: str):
+        """删除设备的群组信息"""
+        self.device_profiles.pop(device_id, None)
+        self.device_cohort.pop(device_id, None)
+        self.device_types.pop(device_id, None)
+
+    def get_state(self) -> Dict:
+        """导出可序列化的状态（模型对象训练后不再修改，浅拷贝即可）"""
+        return {
+            "device_types": dict(self.device_types),
+            "device_profiles": dict(self.device_profiles),
+            "device_cohort": dict(self.device_cohort),
+            "cohort_models": dict(self.cohort_models),
+            "centroids": self.centroids,
+            "centroid_keys": list(self.centroid_keys),
+            "last_trained": self.last_trained,
+            "trained_devices": self.trained_devices
+        }
+
+    def set_state(self, state: Dict):
+        """从导出的状态恢复"""
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def get_status(self) -> Dict:
+        """获取群组模型状态"""
+        sizes: Dict[str, int] = {}
+        for cohort in self.device_cohort.values():
+            sizes[cohort] = sizes.get(cohort, 0) + 1
+        return {
+            "cohort_models": len(self.cohort_models),
+            "assigned_devices": len(self.device_cohort),
+            "cohort_sizes": sizes,
+            "last_trained": self.last_trained
+        }
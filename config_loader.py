@@ -0,0 +1,150 @@
+import copy
+import json
+import os
+from typing import Dict
+
+DEFAULT_CONFIG = {
+    "monitoring": {
+        "window_size": 300,
+        "alert_threshold": 0.1,
+        "check_interval": 60,
+        "window_length": None,
+        "window_slide": None,
+        "allowed_lateness": 2.0,
+        "max_devices": 50000,
+        "device_timeout": 3600,
+        "model_mode": "device",
+        "n_cohorts": 8,
+        "cohort_retrain_interval": 3600,
+        "top_k": 20,
+        "memory_budget_mb": 0,
+        "prefilter_mad": 0,
+        "spill_dir": None
+    },
+    "gui": {
+        "window_width": 1200,
+        "window_height": 800,
+        "theme": "default",
+        "update_interval": 5,
+        "chart_update_interval": 10
+    },
+    "capture": {
+        "interface": None,
+        "filter": "ip",
+        "max_packets": 10000,
+        "ring_enabled": True,
+        "ring_bytes": 262144,
+        "ring_total_mb": 32,
+        "ring_retention": 120.0,
+        "snaplen": 1514,
+        "pcap_dir": "evidence"
+    },
+    "security": {
+        "auto_response": True,
+        "isolation_threshold": 0.5,
+        "log_file": "security_events.log",
+        "alert_db": "alerts.db",
+        "response_backend": "log",
+        "response_url": "http://127.0.0.1:8099",
+        "response_workers": 4,
+        "response_timeout": 5.0,
+        "response_retries": 3,
+        "isolation_duration": 1800,
+        "isolation_state_file": "isolation_state.json"
+    },
+    "scan_detection": {
+        "enabled": True,
+        "window": 10.0,
+        "slots": 5,
+        "port_threshold": 100,
+        "host_threshold": 50,
+        "internal_host_threshold": 20,
+        "cooldown": 60.0,
+        "max_sources": 10000
+    },
+    "tls_inspection": {
+        "enabled": True,
+        "max_packets_per_flow": 4,
+        "max_flows": 65536,
+        "fingerprints_per_device": 16,
+        "learning_period": 3600
+    },
+    "dns": {
+        "enabled": True,
+        "blocklist": None,
+        "allowlist": None,
+        "domains_per_device": 256,
+        "learning_period": 3600,
+        "dga_threshold": 0.6,
+        "cache_size": 65536,
+        "recent_new_domains": 1000
+    },
+    "visualization": {
+        "update_interval": 30,
+        "max_display_devices": 10,
+        "chart_colors": ["#3498db", "#2ecc71", "#e74c3c", "#f39c12", "#9b59b6"],
+        "headless": False,
+        "output_dir": "charts",
+        "image_format": "png",
+        "render_workers": 0
+    },
+    "reports": {
+        "enabled": True,
+        "output_dir": "reports",
+        "history_hours": 48,
+        "history_days": 31
+    },
+    "checkpoint": {
+        "enabled": True,
+        "directory": "checkpoints",
+        "interval": 300,
+        "keep": 2
+    },
+    "distributed": {
+        "aggregator_host": "127.0.0.1",
+        "aggregator_port": 9555,
+        "listen_host": "127.0.0.1",
+        "listen_port": 9555,
+        "collector_id": None,
+        "batch_size": 500,
+        "flush_interval": 1.0,
+        "max_buffer": 100000
+    },
+    "web": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 8080,
+        "refresh_interval": 2,
+        "max_devices": 500
+    },
+    "export": {
+        "auto_export": False,
+        "export_interval": 3600,
+        "export_format": "json"
+    }
+}
+
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """递归合并配置字典"""
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def load_config(path: str = "config.json") -> Dict:
+    """加载配置文件，缺失的项使用默认值"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if not os.path.exists(path):
+        return config
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            _merge(config, json.load(f))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ 配置文件加载失败，使用默认配置: {e}")
+
+    return config
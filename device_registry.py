@@ -0,0 +1,228 @@
+import sys
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class DeviceRecord:
+    """注册表中的单个设备"""
+
+    __slots__ = ("device_id", "mac", "ips", "first_seen", "last_seen",
+                 "packets", "bytes", "version")
+
+    def __init__(self, device_id: str, mac: str = None, timestamp: float = 0.0):
+        self.device_id = device_id
+        self.mac = mac
+        self.ips = set()
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets = 0
+        self.bytes = 0
+        self.version = 0
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            "device_id": self.device_id,
+            "mac": self.mac,
+            "ips": sorted(self.ips),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "version": self.version
+        }
+
+
+class DeviceRegistry:
+    """基于抓包结果的设备注册表
+
+    设备以MAC（无MAC时以IP）为键，另外维护 IP→设备 索引。内部的 OrderedDict
+    按最近更新排序：每次更新把设备移到末尾并分配递增的版本号，因此它同时是
+    LRU 顺序和版本顺序。淘汰不活跃设备只需从头部弹出，"版本N之后有哪些变化"
+    只需从尾部倒序遍历到版本N为止，都不需要全量扫描。
+    """
+
+    def __init__(self, max_devices: int = 50000, inactive_timeout: float = 3600,
+                 max_tombstones: int = 10000,
+                 on_evict: Callable[[str, List[str]], None] = None):
+        self.max_devices = max_devices
+        self.inactive_timeout = inactive_timeout
+        self.on_evict = on_evict
+        self.version = 0
+        self.latest_timestamp = 0.0
+
+        self._devices: "OrderedDict[str, DeviceRecord]" = OrderedDict()
+        self._ip_index: Dict[str, str] = {}
+        self._removed = deque(maxlen=max_tombstones)  # (版本号, 设备ID)
+        self._tombstone_floor = 0  # 早于此版本的删除记录已被丢弃
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._devices
+
+    def observe(self, ip: str = None, mac: str = None, timestamp: float = 0.0,
+                length: int = 0) -> Optional[str]:
+        """根据抓包中的MAC/IP记录一次设备活动，返回设备ID"""
+        device_id = mac or self._ip_index.get(ip) or ip
+        if device_id is None:
+            return None
+        return self.touch(device_id, timestamp, length, ip=ip, mac=mac)
+
+    def touch(self, device_id: str, timestamp: float = 0.0, length: int = 0,
+              ip: str = None, mac: str = None) -> str:
+        """记录一次设备活动（设备不存在时自动注册）"""
+        record = self._devices.get(device_id)
+        if record is None:
+            record = DeviceRecord(device_id, mac, timestamp)
+            self._devices[device_id] = record
+        else:
+            self._devices.move_to_end(device_id)
+
+        if ip and ip not in record.ips:
+            self._bind_ip(record, ip)
+
+        self.version += 1
+        record.version = self.version
+        record.packets += 1
+        record.bytes += length
+        if timestamp > record.last_seen:
+            record.last_seen = timestamp
+        if timestamp > self.latest_timestamp:
+            self.latest_timestamp = timestamp
+
+        if len(self._devices) > self.max_devices:
+            self._evict(next(iter(self._devices)))
+
+        return device_id
+
+    def _bind_ip(self, record: DeviceRecord, ip: str):
+        """将IP绑定到设备（处理DHCP地址被重新分配的情况）"""
+        previous_owner = self._ip_index.get(ip)
+        if previous_owner and previous_owner != record.device_id:
+            previous = self._devices.get(previous_owner)
+            if previous:
+                previous.ips.discard(ip)
+        self._ip_index[ip] = record.device_id
+        record.ips.add(ip)
+
+    def resolve_ip(self, ip: str) -> Optional[str]:
+        """通过IP查找设备ID"""
+        return self._ip_index.get(ip)
+
+    def get(self, device_id: str) -> Optional[Dict]:
+        """获取设备信息"""
+        record = self._devices.get(device_id)
+        return record.to_dict() if record else None
+
+    def device_ids(self, limit: int = None) -> List[str]:
+        """按最近活跃顺序返回设备ID"""
+        if limit is None:
+            return list(reversed(self._devices))
+
+        result = []
+        for device_id in reversed(self._devices):
+            if len(result) >= limit:
+                break
+            result.append(device_id)
+        return result
+
+    def changes_since(self, version: int) -> Dict:
+        """返回版本号之后发生变化和被删除的设备
+
+        full_resync 为 True 表示删除记录已被截断，调用方需要全量刷新。
+        """
+        changed = []
+        for record in reversed(self._devices.values()):
+            if record.version <= version:
+                break
+            changed.append(record.device_id)
+
+        removed = []
+        for removed_version, device_id in reversed(self._removed):
+            if removed_version <= version:
+                break
+            if device_id not in self._devices:
+                removed.append(device_id)
+
+        return {
+            "version": self.version,
+            "changed": changed,
+            "removed": removed,
+            "full_resync": version < self._tombstone_floor
+        }
+
+    def expire(self, now: float = None) -> List[str]:
+        """淘汰超过不活跃时间的设备"""
+        if now is None:
+            now = self.latest_timestamp
+        cutoff = now - self.inactive_timeout
+
+        expired = []
+        while self._devices:
+            device_id, record = next(iter(self._devices.items()))
+            if record.last_seen >= cutoff:
+                break
+            self._evict(device_id)
+            expired.append(device_id)
+        return expired
+
+    def remove(self, device_id: str):
+        """手动删除设备"""
+        if device_id in self._devices:
+            self._evict(device_id)
+
+    def _evict(self, device_id: str):
+        """删除设备并记录删除版本"""
+        record = self._devices.pop(device_id)
+        for ip in record.ips:
+            if self._ip_index.get(ip) == device_id:
+                del self._ip_index[ip]
+
+        self.version += 1
+        if len(self._removed) == self._removed.maxlen:
+            self._tombstone_floor = self._removed[0][0]
+        self._removed.append((self.version, device_id))
+
+        if self.on_evict:
+            self.on_evict(device_id, sorted(record.ips))
+
+    def snapshot(self) -> List[Dict]:
+        """按LRU顺序导出全部设备（用于检查点）"""
+        return [record.to_dict() for record in self._devices.values()]
+
+    def restore(self, records: List[Dict]):
+        """从检查点恢复设备"""
+        for item in records:
+            record = DeviceRecord(item["device_id"], item.get("mac"), item["first_seen"])
+            record.last_seen = item["last_seen"]
+            record.packets = item.get("packets", 0)
+            record.bytes = item.get("bytes", 0)
+            self._devices[record.device_id] = record
+            self._devices.move_to_end(record.device_id)
+            for ip in item.get("ips", []):
+                self._bind_ip(record, ip)
+            self.version += 1
+            record.version = self.version
+            self.latest_timestamp = max(self.latest_timestamp, record.last_seen)
+
+    def iter_lru(self) -> Iterator[str]:
+        """按最久未活跃在前的顺序遍历设备ID（遍历期间不能修改注册表）"""
+        return iter(self._devices)
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数（每个设备记录、IP集合和索引项按固定开销估计）"""
+        return (sys.getsizeof(self._devices) + sys.getsizeof(self._ip_index)
+                + len(self._devices) * 420 + len(self._ip_index) * 120)
+
+    def get_status(self) -> Dict:
+        """获取注册表状态"""
+        return {
+            "devices": len(self._devices),
+            "indexed_ips": len(self._ip_index),
+            "version": self.version,
+            "max_devices": self.max_devices,
+            "inactive_timeout": self.inactive_timeout
+        }
@@ -0,0 +1,313 @@
+import asyncio
+import random
+import socket
+import struct
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 二进制协议：每帧 = 4字节长度前缀 + 负载
+# 负载 = 头部(魔数, 版本, 特征数, 摘要数) + 采集器ID + 特征名表 + 摘要列表
+# 每条摘要 = 设备ID(1字节长度+UTF-8) + 窗口结束时间(float64) + 特征值(float32 * 特征数)
+# 版本2在末尾增加流量草图（4字节长度 + TrafficSketches 序列化数据，长度为0表示没有）
+# 版本3在头部之后增加批次编号（会话ID uint32 + 序号 uint64），汇聚节点据此识别重发的批次
+MAGIC = b"IOTW"
+PROTOCOL_VERSION = 3
+_FRAME = struct.Struct(">I")
+_HEADER = struct.Struct(">4sBHI")
+_BATCH_ID = struct.Struct(">IQ")
+_WINDOW_END = struct.Struct(">d")
+_ACK = struct.Struct(">I")
+_SKETCH_LENGTH = struct.Struct(">I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+WindowSummary = Tuple[str, float, Dict[str, float]]
+BatchId = Tuple[int, int]  # (会话ID, 序号)
+
+
+def _pack_str(value: str) -> bytes:
+    data = value.encode("utf-8")[:255]
+    return bytes([len(data)]) + data
+
+
+def _unpack_str(payload: memoryview, offset: int) -> Tuple[str, int]:
+    length = payload[offset]
+    start = offset + 1
+    return bytes(payload[start:start + length]).decode("utf-8"), start + length
+
+
+def encode_batch(collector_id: str, feature_names: List[str],
+                 summaries: List[WindowSummary], sketches: bytes = None,
+                 batch_id: BatchId = (0, 0)) -> bytes:
+    """把一批窗口摘要编码为一帧"""
+    values = struct.Struct(f">{len(feature_names)}f")
+    parts = [_HEADER.pack(MAGIC, PROTOCOL_VERSION, len(feature_names), len(summaries)),
+             _BATCH_ID.pack(*batch_id),
+             _pack_str(collector_id)]
+    parts.extend(_pack_str(name) for name in feature_names)
+    for device_id, window_end, stats in summaries:
+        parts.append(_pack_str(device_id))
+        parts.append(_WINDOW_END.pack(window_end))
+        parts.append(values.pack(*[float(stats.get(name, 0.0)) for name in feature_names]))
+    parts.append(_SKETCH_LENGTH.pack(len(sketches or b"")))
+    if sketches:
+        parts.append(sketches)
+
+    payload = b"".join(parts)
+    return _FRAME.pack(len(payload)) + payload
+
+
+def decode_batch(payload: bytes) -> Tuple[str, List[WindowSummary], Optional[bytes], Optional[BatchId]]:
+    """解码一帧负载（不含长度前缀），返回 (采集器ID, 摘要列表, 流量草图, 批次编号)
+
+    版本3之前的帧没有批次编号，返回 None。
+    """
+    view = memoryview(payload)
+    magic, version, n_features, count = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version not in (1, 2, PROTOCOL_VERSION):
+        raise ValueError(f"不支持的协议: {bytes(magic)!r} v{version}")
+
+    offset = _HEADER.size
+    batch_id = None
+    if version >= 3:
+        batch_id = _BATCH_ID.unpack_from(view, offset)
+        offset += _BATCH_ID.size
+    collector_id, offset = _unpack_str(view, offset)
+    feature_names = []
+    for _ in range(n_features):
+        name, offset = _unpack_str(view, offset)
+        feature_names.append(name)
+
+    values = struct.Struct(f">{n_features}f")
+    summaries = []
+    for _ in range(count):
+        device_id, offset = _unpack_str(view, offset)
+        (window_end,) = _WINDOW_END.unpack_from(view, offset)
+        offset += _WINDOW_END.size
+        stats = dict(zip(feature_names, values.unpack_from(view, offset)))
+        offset += values.size
+        summaries.append((device_id, window_end, stats))
+
+    sketches = None
+    if version >= 2:
+        (length,) = _SKETCH_LENGTH.unpack_from(view, offset)
+        offset += _SKETCH_LENGTH.size
+        if length:
+            sketches = bytes(view[offset:offset + length])
+
+    return collector_id, summaries, sketches, batch_id
+
+
+class CollectorClient:
+    """采集器端：缓存本地窗口摘要，批量发送到汇聚节点
+
+    摘要先进入有界缓冲区（满时丢弃最旧的数据并计数），发送协程按批量大小或
+    刷新间隔取出一批放入发送中列表，发送一帧并等待汇聚节点确认，确认后才丢弃；
+    发送中的摘要不受缓冲区溢出影响。连接失败时按指数退避重连，
+    未确认的批次在重连后以相同的批次编号重发（汇聚节点据此去重），
+    断线期间的新数据留在缓冲区中。
+    sketch_source 返回自上次调用以来的流量草图，随下一帧发送，确认前会一直重发。
+    """
+
+    def __init__(self, host: str, port: int, feature_names: List[str],
+                 collector_id: str = None, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_buffer: int = 100000,
+                 ack_timeout: float = 10.0,
+                 sketch_source: Callable[[], Optional[bytes]] = None):
+        self.host = host
+        self.port = port
+        self.collector_id = collector_id or socket.gethostname()
+        self.feature_names = list(feature_names)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ack_timeout = ack_timeout
+        self.buffer = deque(maxlen=max_buffer)
+        self.in_flight: List[WindowSummary] = []  # 已取出、等待确认的批次
+        self.sketch_source = sketch_source
+        self._pending_sketches: Optional[bytes] = None
+        self._session = random.getrandbits(32)  # 进程重启后序号从头开始，用会话ID区分
+        self._sequence = 0  # 当前发送中批次的序号
+        self._unacked = False  # 当前批次已编号、尚未确认
+        self.dropped = 0
+        self.sent = 0
+        self.connected = False
+
+    def start(self, runtime):
+        """在运行时上启动发送任务"""
+        runtime.start_task("collector.sender", self._sender())
+
+    def enqueue(self, window_end: float, window_stats: Dict[str, Dict]):
+        """加入一批已关闭的窗口（可作为监控的 window_sink）"""
+        for device_id, stats in window_stats.items():
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append((device_id, window_end, stats))
+
+    async def _sender(self):
+        """连接、发送、重连循环"""
+        backoff = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                print(f"⚠️ 无法连接汇聚节点 {self.host}:{self.port}: {e}，{backoff:.0f}s 后重试")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            self.connected = True
+            backoff = 1.0
+            print(f"🔗 已连接汇聚节点 {self.host}:{self.port}")
+            try:
+                await self._send_loop(reader, writer)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                print(f"⚠️ 与汇聚节点的连接中断: {e}")
+            finally:
+                self.connected = False
+                writer.close()
+
+    async def _send_loop(self, reader, writer):
+        """按批发送并等待确认"""
+        while True:
+            if not self._unacked:
+                if len(self.buffer) < self.batch_size:
+                    await asyncio.sleep(self.flush_interval)
+                if self._pending_sketches is None and self.sketch_source is not None:
+                    self._pending_sketches = self.sketch_source()
+                # 取出一批移到发送中列表并分配新序号，之后缓冲区溢出只会丢弃尚未发送的数据；
+                # 确认之前批次内容（包括草图）不再变化，重发时汇聚节点按序号去重
+                for _ in range(min(self.batch_size, len(self.buffer))):
+                    self.in_flight.append(self.buffer.popleft())
+                if not self.in_flight and self._pending_sketches is None:
+                    continue
+                self._sequence += 1
+                self._unacked = True
+
+            writer.write(encode_batch(self.collector_id, self.feature_names, self.in_flight,
+                                      self._pending_sketches, (self._session, self._sequence)))
+            await writer.drain()
+
+            await asyncio.wait_for(reader.readexactly(_ACK.size), self.ack_timeout)
+            self.sent += len(self.in_flight)
+            self.in_flight.clear()
+            self._pending_sketches = None
+            self._unacked = False
+
+    def get_status(self) -> Dict:
+        """获取采集器状态"""
+        return {
+            "collector_id": self.collector_id,
+            "aggregator": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "buffered": len(self.buffer),
+            "in_flight": len(self.in_flight),
+            "sent": self.sent,
+            "dropped": self.dropped
+        }
+
+
+class AggregatorServer:
+    """汇聚节点：接收各采集器的窗口摘要并合并到一个监控实例中检测
+
+    协议没有认证，默认只监听本机；接收其他主机的采集器时应只监听内部网段的地址，
+    并用防火墙限制来源。
+
+    每个采集器记录最后处理的批次编号：确认丢失后重发的批次直接确认，不重复检测。
+    同一采集器的批次串行处理，旧连接仍在处理时新连接的重发会等它完成后再判断。
+    """
+
+    def __init__(self, monitor, host: str = "127.0.0.1", port: int = 9555,
+                 namespace_devices: bool = True):
+        self.monitor = monitor
+        self.host = host
+        self.port = port
+        self.namespace_devices = namespace_devices  # 不同网段可能使用相同的内网IP
+        self.collectors: Dict[str, int] = {}
+        self.duplicates = 0
+        self._last_batch: Dict[str, BatchId] = {}  # 采集器ID -> 最后处理的 (会话ID, 序号)
+        self._collector_locks: Dict[str, asyncio.Lock] = {}
+        self._connections = set()  # 当前连接的 writer
+        self.server = None
+        self.runtime = None
+
+    def start(self, runtime):
+        """在运行时上启动TCP服务"""
+        self.runtime = runtime
+        runtime.run_coroutine(self._serve()).result()
+
+    async def _serve(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        sockname = self.server.sockets[0].getsockname()
+        self.port = sockname[1]
+        print(f"📡 汇聚节点监听 {sockname[0]}:{sockname[1]}")
+
+    async def _handle(self, reader, writer):
+        """处理一个采集器连接"""
+        peer = writer.get_extra_info("peername")
+        loop = asyncio.get_running_loop()
+        self._connections.add(writer)
+        try:
+            while True:
+                (length,) = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+                if length > MAX_FRAME_SIZE:
+                    raise ValueError(f"帧过大: {length}")
+                collector_id, summaries, sketches, batch_id = decode_batch(await reader.readexactly(length))
+                lock = self._collector_locks.setdefault(collector_id, asyncio.Lock())
+                async with lock:
+                    if self._is_duplicate(collector_id, batch_id):
+                        self.duplicates += 1
+                    else:
+                        await self._ingest(loop, collector_id, summaries, sketches)
+                        if batch_id is not None:
+                            self._last_batch[collector_id] = batch_id
+
+                writer.write(_ACK.pack(len(summaries)))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            # 采集器断开
+            pass
+        except asyncio.CancelledError:
+            # 服务停止：finally 中关闭连接，取消继续向上传递
+            raise
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            print(f"⚠️ 采集器 {peer} 连接错误: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def _is_duplicate(self, collector_id: str, batch_id: Optional[BatchId]) -> bool:
+        """同一会话中序号不大于已处理序号的批次是重发的"""
+        last = self._last_batch.get(collector_id)
+        return (batch_id is not None and last is not None
+                and batch_id[0] == last[0] and batch_id[1] <= last[1])
+
+    async def _ingest(self, loop, collector_id: str, summaries: List[WindowSummary], sketches: Optional[bytes]):
+        """把一批摘要和草图合并到监控实例"""
+        prefix = f"{collector_id}/" if self.namespace_devices else ""
+        if self.namespace_devices:
+            summaries = [(f"{collector_id}/{device_id}", window_end, stats)
+                         for device_id, window_end, stats in summaries]
+
+        # 异常评分放到线程池中，避免阻塞其他连接
+        await loop.run_in_executor(None, self.monitor.ingest_window_summaries, summaries)
+        if sketches:
+            await loop.run_in_executor(None, self.monitor.merge_sketches, sketches, prefix)
+        self.collectors[collector_id] = self.collectors.get(collector_id, 0) + len(summaries)
+
+    def stop(self):
+        """关闭监听端口和现有连接（需在运行时停止之前调用）"""
+        if self.server and self.runtime.running:
+            self.runtime.call_soon(self._close)
+
+    def _close(self):
+        """在事件循环线程中关闭监听端口和连接，连接处理协程随之正常结束"""
+        self.server.close()
+        for writer in list(self._connections):
+            writer.close()
+
+    def get_status(self) -> Dict:
+        """获取汇聚节点状态"""
+        return {
+            "listen": f"{self.host}:{self.port}",
+            "collectors": dict(self.collectors),
+            "duplicates": self.duplicates
+        }
@@ -0,0 +1,316 @@
+import math
+import socket
+import struct
+import sys
+from collections import Counter, OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from frame_decoder import UDP, transport_payload
+
+_HEADER = struct.Struct(">HHHHHH")
+_QUESTION_TAIL = struct.Struct(">HH")
+_ANSWER = struct.Struct(">HHIH")
+_TYPE_A = 1
+_TYPE_AAAA = 28
+_VOWELS = frozenset("aeiou")
+# 计算DGA评分时跳过的常见二级后缀
+_SECOND_LEVEL = frozenset(["co", "com", "net", "org", "gov", "edu", "ac"])
+
+BLOCKED = "blocked"
+ALLOWED = "allowed"
+
+
+def _read_qname(view: memoryview, offset: int) -> Tuple[int, int]:
+    """跳过问题部分的域名（不解压缩），返回 (域名结束位置, 下一个字段位置)；遇到压缩指针时报错"""
+    while True:
+        length = view[offset]
+        if length == 0:
+            return offset + 1, offset + 1
+        if length & 0xC0:
+            raise ValueError("问题部分不应使用压缩指针")
+        offset += 1 + length
+
+
+def _skip_name(view: memoryview, offset: int) -> int:
+    """跳过资源记录中的域名（可能以压缩指针结尾）"""
+    while True:
+        length = view[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+
+
+def wire_to_domain(wire: bytes) -> str:
+    """线路格式的域名转换为小写点分字符串"""
+    labels = []
+    offset = 0
+    while offset < len(wire) and wire[offset]:
+        length = wire[offset]
+        labels.append(wire[offset + 1:offset + 1 + length].decode("ascii", "replace"))
+        offset += 1 + length
+    return ".".join(labels).lower()
+
+
+def dga_score(domain: str) -> float:
+    """DGA（算法生成域名）可疑度 0-1
+
+    取主标签（去掉顶级域和常见二级后缀后最后一个标签），按长度、字符熵、
+    数字比例和最长辅音串打分。短标签和字典词组成的域名得分很低。
+    """
+    labels = domain.split(".")
+    if len(labels) < 2:
+        return 0.0
+    labels = labels[:-1]
+    if len(labels) > 1 and labels[-1] in _SECOND_LEVEL:
+        labels = labels[:-1]
+    label = labels[-1].replace("-", "")
+    n = len(label)
+    if n < 8:
+        return 0.0
+
+    entropy = -sum(c / n * math.log2(c / n) for c in Counter(label).values())
+    digits = sum(ch.isdigit() for ch in label) / n
+    run = longest = 0
+    for ch in label:
+        run = run + 1 if ch.isalpha() and ch not in _VOWELS else 0
+        longest = max(longest, run)
+
+    score = (0.5 * min(1.0, max(0.0, (entropy - 2.5) / 1.5))
+             + 0.2 * min(1.0, digits * 3)
+             + 0.2 * min(1.0, max(0.0, (longest - 3) / 4))
+             + 0.1 * min(1.0, max(0.0, (n - 10) / 10)))
+    return round(score, 3)
+
+
+class DomainIndex:
+    """域名黑白名单索引
+
+    名单在加载时预先放入哈希集合，查询时依次检查域名本身和各级父域
+    （a.b.example.com → b.example.com → example.com → com），每级一次集合查找，
+    名单中的域名同时匹配其所有子域名。白名单优先。
+    """
+
+    def __init__(self, blocklist: Iterable[str] = (), allowlist: Iterable[str] = ()):
+        self.blocked: Set[str] = {d.lower().strip(".") for d in blocklist}
+        self.allowed: Set[str] = {d.lower().strip(".") for d in allowlist}
+
+    @staticmethod
+    def load_file(path: Optional[str]) -> Set[str]:
+        """读取名单文件：每行一个域名，支持 # 注释和 hosts 格式（"0.0.0.0 域名"）"""
+        domains = set()
+        if not path:
+            return domains
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                if fields:
+                    domains.add(fields[-1].lower().strip("."))
+        return domains
+
+    @classmethod
+    def from_files(cls, blocklist_path: str = None, allowlist_path: str = None) -> "DomainIndex":
+        return cls(cls.load_file(blocklist_path), cls.load_file(allowlist_path))
+
+    def lookup(self, domain: str) -> Optional[str]:
+        """返回 ALLOWED、BLOCKED 或 None"""
+        if not self.blocked and not self.allowed:
+            return None
+        verdict = None
+        suffix = domain
+        while suffix:
+            if suffix in self.allowed:
+                return ALLOWED
+            if verdict is None and suffix in self.blocked:
+                verdict = BLOCKED
+            dot = suffix.find(".")
+            suffix = suffix[dot + 1:] if dot >= 0 else ""
+        return verdict
+
+    def __len__(self) -> int:
+        return len(self.blocked) + len(self.allowed)
+
+
+class DNSAnalyzer:
+    """DNS 查询/响应分析
+
+    直接在UDP负载的 memoryview 上解析报文。查询的域名以线路格式的字节切片为键
+    查结果缓存（bytes 与 memoryview 可以直接比较和哈希），命中时不创建任何字符串；
+    未命中时才解码域名、查询黑白名单并计算DGA评分，结果放入LRU缓存。
+
+    每个设备保存最近查询过的域名（LRU，最多 domains_per_device 个）；
+    响应中的 A/AAAA 记录建立 IP → 域名映射（LRU，最多 max_ip_mappings 条），
+    用于给流量目标地址补充域名。
+
+    学习期之后出现的新域名只计数并记入最近事件列表（低严重度，不产生警报）：
+    设备域名集合有上限，被挤出的常用域名再次出现时也会被当作新域名。
+    """
+
+    def __init__(self, index: DomainIndex = None, domains_per_device: int = 256,
+                 learning_period: float = 3600.0, dga_threshold: float = 0.6,
+                 cache_size: int = 65536, max_ip_mappings: int = 65536,
+                 max_devices: int = 50000, recent_new_domains: int = 1000):
+        self.index = index or DomainIndex()
+        self.domains_per_device = domains_per_device
+        self.learning_period = learning_period
+        self.dga_threshold = dga_threshold
+        self.cache_size = cache_size
+        self.max_ip_mappings = max_ip_mappings
+        self.max_devices = max_devices
+        self._cache: "OrderedDict[bytes, Tuple[str, Optional[str], float]]" = OrderedDict()
+        self._devices: "OrderedDict[str, Dict]" = OrderedDict()
+        self._ip_domains: "OrderedDict[str, str]" = OrderedDict()
+        self.queries = 0
+        self.responses = 0
+        self.cache_hits = 0
+        self.malformed = 0
+        self.new_domains = 0
+        self.recent_new_domains = deque(maxlen=recent_new_domains)  # 最近的新域名事件
+
+    def observe(self, packet_info: Dict, src_device: Optional[str]) -> Optional[Dict]:
+        """处理一个数据包，返回需要告警的发现结果（黑名单优先于DGA）"""
+        if packet_info.get("protocol") != UDP or 53 not in (packet_info.get("dst_port"), packet_info.get("src_port")):
+            return None
+        payload = transport_payload(packet_info.get("raw") or b"", UDP)
+        if payload is None or len(payload) < _HEADER.size:
+            return None
+
+        try:
+            _, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(payload, 0)
+            if qdcount != 1:
+                return None
+            name_end, offset = _read_qname(payload, _HEADER.size)
+            wire = payload[_HEADER.size:name_end]
+            domain, verdict, score = self._classify(wire)
+            if flags & 0x8000:
+                self.responses += 1
+                self._record_answers(payload, offset + _QUESTION_TAIL.size, ancount, domain)
+                return None
+        except (IndexError, ValueError, struct.error):
+            self.malformed += 1
+            return None
+
+        self.queries += 1
+        if src_device is None or verdict == ALLOWED:
+            return None
+        return self._record_query(src_device, domain, verdict, score, packet_info["timestamp"])
+
+    def _classify(self, wire: memoryview) -> Tuple[str, Optional[str], float]:
+        """查询缓存，未命中时解码域名并分类"""
+        # 只读视图（来自 bytes 的帧）可以直接哈希，可写视图先复制
+        lookup = wire if wire.readonly else bytes(wire)
+        cached = self._cache.get(lookup)
+        if cached is not None:
+            self._cache.move_to_end(lookup)
+            self.cache_hits += 1
+            return cached
+
+        key = bytes(wire)
+        domain = wire_to_domain(key)
+        result = (domain, self.index.lookup(domain), dga_score(domain))
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _record_answers(self, payload: memoryview, offset: int, count: int, domain: str):
+        """响应中的 A/AAAA 记录建立 IP → 域名映射（CNAME 链统一归到查询的域名）"""
+        for _ in range(count):
+            offset = _skip_name(payload, offset)
+            rtype, _, _, length = _ANSWER.unpack_from(payload, offset)
+            offset += _ANSWER.size
+            if rtype == _TYPE_A and length == 4:
+                ip = socket.inet_ntop(socket.AF_INET, payload[offset:offset + 4])
+            elif rtype == _TYPE_AAAA and length == 16:
+                ip = socket.inet_ntop(socket.AF_INET6, payload[offset:offset + 16])
+            else:
+                ip = None
+            offset += length
+            if ip is not None:
+                self._ip_domains[ip] = domain
+                self._ip_domains.move_to_end(ip)
+                if len(self._ip_domains) > self.max_ip_mappings:
+                    self._ip_domains.popitem(last=False)
+
+    def _record_query(self, device_id: str, domain: str, verdict: Optional[str],
+                      score: float, timestamp: float) -> Optional[Dict]:
+        """更新设备域名集合，判断是否需要告警；学习期之后的新域名只计数"""
+        device = self._devices.get(device_id)
+        if device is None:
+            device = self._devices[device_id] = {"first_seen": timestamp, "domains": OrderedDict(),
+                                                 "new_domains": 0}
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+
+        domains = device["domains"]
+        is_new = domain not in domains
+        domains[domain] = timestamp
+        domains.move_to_end(domain)
+        if len(domains) > self.domains_per_device:
+            domains.popitem(last=False)
+
+        if verdict == BLOCKED:
+            alert_type = "dns_blocklisted"
+        elif score >= self.dga_threshold and is_new:
+            alert_type = "dns_dga_suspect"
+        else:
+            if is_new and timestamp - device["first_seen"] >= self.learning_period:
+                device["new_domains"] += 1
+                self.new_domains += 1
+                self.recent_new_domains.append({"device_id": device_id, "domain": domain,
+                                                "dga_score": score, "timestamp": timestamp})
+            return None
+        return {"alert_type": alert_type, "domain": domain, "dga_score": score,
+                "known_domains": len(domains) - 1}
+
+    def domain_for(self, ip: str) -> Optional[str]:
+        """IP 最近一次解析对应的域名"""
+        return self._ip_domains.get(ip)
+
+    def device_summary(self, device_id: str, n: int = 10) -> Dict:
+        """单个设备查询过的域名数和最近的域名"""
+        device = self._devices.get(device_id)
+        if device is None:
+            return {}
+        domains = device["domains"]
+        recent = []
+        for domain in reversed(domains):
+            if len(recent) >= n:
+                break
+            recent.append(domain)
+        return {"dns_domains": len(domains), "dns_new_domains": device["new_domains"],
+                "recent_domains": recent}
+
+    def new_domain_events(self, device_id: str = None) -> List[Dict]:
+        """最近的新域名事件（可按设备过滤），最新的在前"""
+        return [event for event in reversed(self.recent_new_domains)
+                if device_id is None or event["device_id"] == device_id]
+
+    def remove_device(self, device_id: str):
+        """设备被淘汰时释放其域名集合"""
+        self._devices.pop(device_id, None)
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数"""
+        domains = sum(len(d["domains"]) for d in self._devices.values())
+        return (sys.getsizeof(self._cache) + len(self._cache) * 250
+                + sys.getsizeof(self._ip_domains) + len(self._ip_domains) * 200
+                + sys.getsizeof(self._devices) + len(self._devices) * 400 + domains * 150
+                + len(self.recent_new_domains) * 300)
+
+    def get_status(self) -> Dict:
+        """获取状态"""
+        return {
+            "queries": self.queries,
+            "responses": self.responses,
+            "cache_hits": self.cache_hits,
+            "cached_domains": len(self._cache),
+            "ip_mappings": len(self._ip_domains),
+            "devices": len(self._devices),
+            "list_entries": len(self.index),
+            "malformed": self.malformed,
+            "new_domains": self.new_domains
+        }
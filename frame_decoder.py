@@ -0,0 +1,47 @@
+import struct
+from typing import Optional
+
+_U16 = struct.Struct(">H")
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86DD
+_ETHERTYPE_VLAN = (0x8100, 0x88A8)
+TCP = 6
+UDP = 17
+
+
+def transport_payload(frame: bytes, protocol: int) -> Optional[memoryview]:
+    """从以太网帧中取出TCP/UDP负载（零拷贝视图）
+
+    支持VLAN标签、IPv4和无扩展头的IPv6；传输层协议不符或帧不完整时返回 None。
+    """
+    view = memoryview(frame)
+    if len(view) < 14:
+        return None
+    offset = 12
+    (ethertype,) = _U16.unpack_from(view, offset)
+    while ethertype in _ETHERTYPE_VLAN and len(view) >= offset + 6:
+        offset += 4
+        (ethertype,) = _U16.unpack_from(view, offset)
+    offset += 2
+
+    if ethertype == _ETHERTYPE_IPV4:
+        if len(view) < offset + 20 or view[offset + 9] != protocol:
+            return None
+        total_length = _U16.unpack_from(view, offset + 2)[0]
+        end = min(len(view), offset + total_length) if total_length else len(view)
+        offset += (view[offset] & 0x0F) * 4
+    elif ethertype == _ETHERTYPE_IPV6:
+        if len(view) < offset + 40 or view[offset + 6] != protocol:
+            return None
+        end = min(len(view), offset + 40 + _U16.unpack_from(view, offset + 4)[0])
+        offset += 40
+    else:
+        return None
+
+    if protocol == TCP:
+        if end < offset + 20:
+            return None
+        offset += (view[offset + 12] >> 4) * 4
+    elif protocol == UDP:
+        offset += 8
+    return view[offset:end] if offset <= end else None
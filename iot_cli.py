@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+物联网安全监控系统 无界面命令行入口
+
+不导入 matplotlib 和 tkinter，适合采集器、汇聚节点和定时报告任务：
+    python iot_cli.py run --mode collector
+    python iot_cli.py report --charts
+    python iot_cli.py alerts --severity high --limit 20
+    python iot_cli.py backtest --export iot_traffic_data_*.json --incidents incidents.csv
+    python iot_cli.py action-stub --port 8099 --fail-first 2
+"""
+
+import argparse
+import json
+import signal
+import sys
+import threading
+from datetime import datetime
+
+
+def cmd_run(args):
+    """无界面运行（不显示控制台面板，收到 SIGINT/SIGTERM 时退出）"""
+    from main import IoTSecuritySystem
+
+    system = IoTSecuritySystem(args.config, args.mode)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    try:
+        system.start_system(show_dashboard=False)
+        while not stop_event.wait(1.0):
+            pass
+    finally:
+        system.stop_system()
+
+
+def cmd_report(args):
+    """从最新检查点生成报告（不加载模型）"""
+    from checkpoint import CheckpointManager
+    from config_loader import load_config
+    from iot_traffic_monitor import IoTTrafficMonitor
+
+    config = load_config(args.config)
+    monitor = IoTTrafficMonitor.from_config(config)
+    try:
+        checkpoints = CheckpointManager(config["checkpoint"]["directory"], config["checkpoint"]["keep"])
+        if not checkpoints.load(monitor, include_models=False):
+            print("⚠️ 没有可用的检查点，报告只包含警报汇总")
+
+        report = monitor.build_report()
+        filename = args.output or f"iot_security_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"📄 报告已生成: {filename} ({len(report['device_statistics'])} 个设备)")
+
+        if args.charts:
+            # 只有需要图表时才加载 matplotlib（Agg 画布，不需要显示器）
+            from traffic_visualizer import TrafficVisualizer
+            visualization = config["visualization"]
+            visualizer = TrafficVisualizer(headless=True,
+                                           output_dir=args.chart_dir or visualization["output_dir"],
+                                           image_format=visualization["image_format"],
+                                           render_workers=visualization["render_workers"])
+            paths = visualizer.render_device_timelines(monitor.traffic_data, monitor._get_active_devices())
+            visualizer.plot_device_comparison(
+                {d: monitor.traffic_data[d]
+                 for d in monitor._get_active_devices(visualization["max_display_devices"])})
+            print(f"🖼️ 已生成 {len(paths)} 张设备时间线: {visualizer.output_dir}")
+    finally:
+        monitor.close()
+
+
+def cmd_alerts(args):
+    """查询或导出警报库"""
+    from alert_store import AlertStore
+    from config_loader import load_config
+
+    config = load_config(args.config)
+    store = AlertStore(config["security"]["alert_db"])
+    try:
+        filters = {"device_id": args.device, "alert_type": args.type, "severity": args.severity}
+        if args.export:
+            count = store.export_jsonl(args.export, **filters)
+            print(f"💾 已导出 {count} 条警报: {args.export}")
+        elif args.summary:
+            print(json.dumps(store.summary(device_id=args.device), indent=2, ensure_ascii=False))
+        else:
+            alerts, _ = store.query(limit=args.limit, **filters)
+            for alert in alerts:
+                print(json.dumps(alert, ensure_ascii=False))
+    finally:
+        store.close()
+
+
+def cmd_backtest(args):
+    """回放历史窗口，扫描告警阈值和检测参数"""
+    import os
+    from backtest import (Backtester, best_setting, format_results, load_checkpoint_history,
+                          load_exports, load_incidents, parse_values)
+    from config_loader import load_config
+
+    config = load_config(args.config)
+    if args.export:
+        histories = load_exports(args.export)
+    else:
+        histories = load_checkpoint_history(config["checkpoint"]["directory"])
+    if not histories:
+        print("⚠️ 没有可回放的历史数据")
+        return
+
+    incidents = load_incidents(args.incidents) if args.incidents else {}
+    backtester = Backtester(histories, incidents, args.tolerance)
+    windows = sum(len(timestamps) for timestamps, _ in histories.values())
+    print(f"⏪ 回放 {len(histories)} 个设备的 {windows} 个窗口，标注事件 {backtester.incident_count} 个")
+
+    rows = backtester.sweep(parse_values(args.thresholds),
+                            contamination=parse_values(args.contamination),
+                            n_estimators=parse_values(args.n_estimators, int),
+                            train_windows=parse_values(args.train_windows, int),
+                            workers=args.workers or os.cpu_count() or 1)
+    print(format_results(rows))
+
+    best = best_setting(rows)
+    if best:
+        print(f"🏆 F1 最高: 阈值 {best['threshold']:.3f}, 污染率 {best['contamination']}, "
+              f"树数 {best['n_estimators']}, 训练窗口 {best['train_windows']} (F1 {best['f1']:.3f})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"results": rows, "best": best}, f, indent=2, ensure_ascii=False)
+        print(f"💾 回测结果已保存: {args.output}")
+
+
+def cmd_action_stub(args):
+    """启动本地HTTP隔离接口桩，用于测试 response_backend = "http" """
+    from response_dispatcher import ActionStubServer
+
+    stub = ActionStubServer(args.host, args.port, delay=args.delay, fail_first=args.fail_first)
+    stub.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+        print(f"🧪 共收到 {len(stub.requests)} 个请求")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="物联网安全监控系统（无界面）")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="无界面运行监控")
+    run_parser.add_argument("--mode", choices=("standalone", "collector", "aggregator"),
+                            default="standalone", help="运行模式")
+    run_parser.set_defaults(func=cmd_run)
+
+    report_parser = subparsers.add_parser("report", help="从检查点生成报告")
+    report_parser.add_argument("--output", help="报告文件名")
+    report_parser.add_argument("--charts", action="store_true", help="同时渲染设备图表")
+    report_parser.add_argument("--chart-dir", help="图表输出目录")
+    report_parser.set_defaults(func=cmd_report)
+
+    alerts_parser = subparsers.add_parser("alerts", help="查询警报")
+    alerts_parser.add_argument("--device", help="设备ID")
+    alerts_parser.add_argument("--type", help="警报类型")
+    alerts_parser.add_argument("--severity", help="严重程度")
+    alerts_parser.add_argument("--limit", type=int, default=50, help="最多显示条数")
+    alerts_parser.add_argument("--summary", action="store_true", help="只显示汇总")
+    alerts_parser.add_argument("--export", help="导出为 JSON Lines 文件")
+    alerts_parser.set_defaults(func=cmd_alerts)
+
+    backtest_parser = subparsers.add_parser("backtest", help="回测告警阈值和检测参数")
+    backtest_parser.add_argument("--export", nargs="+", help="流量导出文件（默认使用最新检查点）")
+    backtest_parser.add_argument("--incidents", help="标注事件文件（JSON 或 CSV：device_id,start,end）")
+    backtest_parser.add_argument("--tolerance", type=float, default=0.0, help="事件结束后仍算命中的秒数")
+    backtest_parser.add_argument("--thresholds", default="0.05:0.5:0.05", help="阈值列表或 起点:终点:步长")
+    backtest_parser.add_argument("--contamination", default="0.1", help="IsolationForest 污染率列表")
+    backtest_parser.add_argument("--n-estimators", default="100", help="IsolationForest 树数量列表")
+    backtest_parser.add_argument("--train-windows", default="50", help="建模所需窗口数列表")
+    backtest_parser.add_argument("--workers", type=int, default=0, help="评分进程数（0 表示CPU数量）")
+    backtest_parser.add_argument("--output", help="结果保存为 JSON")
+    backtest_parser.set_defaults(func=cmd_backtest)
+
+    stub_parser = subparsers.add_parser("action-stub", help="启动本地隔离接口桩")
+    stub_parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    stub_parser.add_argument("--port", type=int, default=8099, help="监听端口")
+    stub_parser.add_argument("--delay", type=float, default=0.0, help="每个请求的响应延迟（秒）")
+    stub_parser.add_argument("--fail-first", type=int, default=0, help="前N个请求返回503")
+    stub_parser.set_defaults(func=cmd_action_stub)
+
+    return parser
+
+
+def main(argv=None):
+    """主函数"""
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
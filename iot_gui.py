@@ -7,9 +7,10 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 import numpy as np
+from async_runtime import AsyncRuntime
+from config_loader import load_config
 from iot_traffic_monitor import IoTTrafficMonitor
 from traffic_visualizer import TrafficVisualizer
-import time
 
 class IoTMonitorGUI:
     """物联网流量监控系统GUI界面"""
@@ -21,17 +22,23 @@ class IoTMonitorGUI:
         self.root.configure(bg='#f0f0f0')
         
         # 初始化监控系统
-        self.monitor = IoTTrafficMonitor()
+        self.config = load_config()
+        self.runtime = AsyncRuntime()
+        self.monitor = IoTTrafficMonitor.from_config(self.config)
         self.visualizer = TrafficVisualizer()
         self.monitoring_active = False
+        self.device_list_version = 0
+        self.listed_devices = set()
+        self.max_display_devices = self.config["visualization"]["max_display_devices"]
         
         # 创建界面
         self.create_widgets()
         self.setup_layout()
         
-        # 启动状态更新线程
-        self.update_thread = threading.Thread(target=self.update_status_loop, daemon=True)
-        self.update_thread.start()
+        # 启动事件循环，状态更新作为定时任务运行
+        self.runtime.start()
+        self.runtime.schedule_periodic("gui.status", self.config["gui"]["update_interval"],
+                                       self.update_status_tick)
     
     def create_widgets(self):
         """创建界面组件"""
@@ -96,7 +103,7 @@ class IoTMonitorGUI:
         config_frame.pack(fill='x', padx=10, pady=5)
         
         tk.Label(config_frame, text="警报阈值:", bg='#ecf0f1').pack(anchor='w', padx=5)
-        self.threshold_var = tk.DoubleVar(value=0.1)
+        self.threshold_var = tk.DoubleVar(value=self.monitor.alert_threshold)
         threshold_scale = tk.Scale(config_frame, from_=0.01, to=1.0, resolution=0.01,
                                   orient='horizontal', variable=self.threshold_var,
                                   command=self.update_threshold)
@@ -172,6 +179,26 @@ class IoTMonitorGUI:
         alert_frame = tk.Frame(self.notebook, bg='white')
         self.notebook.add(alert_frame, text="🚨 安全警报")
         
+        # 查询条件
+        filter_frame = tk.Frame(alert_frame, bg='white')
+        filter_frame.pack(fill='x', padx=10, pady=(5, 0))
+        
+        tk.Label(filter_frame, text="设备:", bg='white').pack(side='left')
+        self.alert_device_var = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.alert_device_var, width=20).pack(side='left', padx=5)
+        
+        tk.Label(filter_frame, text="严重程度:", bg='white').pack(side='left')
+        self.alert_severity_var = tk.StringVar(value='全部')
+        ttk.Combobox(filter_frame, textvariable=self.alert_severity_var, width=8, state='readonly',
+                     values=('全部', 'high', 'medium')).pack(side='left', padx=5)
+        
+        tk.Button(filter_frame, text="🔍 查询", command=self.load_alerts).pack(side='left', padx=5)
+        self.more_alerts_btn = tk.Button(filter_frame, text="加载更多", state='disabled',
+                                         command=lambda: self.load_alerts(reset=False))
+        self.more_alerts_btn.pack(side='left')
+        self.alert_cursor = None
+        self.alert_paged = False  # 用户点击过"加载更多"时为 True，停止自动刷新
+        
         # 警报列表
         alert_list_frame = tk.LabelFrame(alert_frame, text="警报历史", font=('Arial', 12, 'bold'))
         alert_list_frame.pack(fill='both', expand=True, padx=10, pady=5)
@@ -191,6 +218,28 @@ class IoTMonitorGUI:
         self.alert_tree.pack(side='left', fill='both', expand=True, padx=5, pady=5)
         alert_scrollbar.pack(side='right', fill='y')
     
+    def load_alerts(self, reset: bool = True):
+        """从警报库分页加载警报（reset=False 表示加载下一页）"""
+        store = self.monitor.alert_store
+        if store is None:
+            return
+        
+        self.alert_paged = not reset
+        if reset:
+            self.alert_tree.delete(*self.alert_tree.get_children())
+            self.alert_cursor = None
+        
+        severity = self.alert_severity_var.get()
+        alerts, self.alert_cursor = store.query(device_id=self.alert_device_var.get().strip() or None,
+                                                severity=None if severity == '全部' else severity,
+                                                limit=200, cursor=self.alert_cursor)
+        for alert in alerts:
+            self.alert_tree.insert('', tk.END, values=(alert['timestamp'], alert['device_id'],
+                                                       alert['alert_type'], alert['severity'],
+                                                       f"{alert.get('anomaly_score') or 0:.3f}"))
+        
+        self.more_alerts_btn.config(state='normal' if self.alert_cursor else 'disabled')
+    
     def create_stats_tab(self):
         """创建统计分析选项卡"""
         stats_frame = tk.Frame(self.notebook, bg='white')
@@ -213,15 +262,15 @@ class IoTMonitorGUI:
     def start_monitoring(self):
         """开始监控"""
         try:
-            self.monitor.start_monitoring()
+            self.monitor.start_monitoring(self.runtime)
             self.monitoring_active = True
             self.start_btn.config(state='disabled')
             self.stop_btn.config(state='normal')
             self.update_status("✅ 监控已开始")
             
-            # 启动数据更新线程
-            self.data_update_thread = threading.Thread(target=self.data_update_loop, daemon=True)
-            self.data_update_thread.start()
+            # 启动数据更新任务
+            self.runtime.schedule_periodic("gui.data", self.config["gui"]["chart_update_interval"],
+                                           self.data_update_tick)
             
         except Exception as e:
             messagebox.showerror("错误", f"启动监控失败: {str(e)}")
@@ -231,6 +280,7 @@ class IoTMonitorGUI:
         try:
             self.monitor.stop_monitoring()
             self.monitoring_active = False
+            self.runtime.cancel("gui.data")
             self.start_btn.config(state='normal')
             self.stop_btn.config(state='disabled')
             self.update_status("🛑 监控已停止")
@@ -247,11 +297,30 @@ class IoTMonitorGUI:
         self.status_text.see(tk.END)
     
     def update_device_list(self):
-        """更新设备列表"""
-        self.device_listbox.delete(0, tk.END)
-        devices = self.monitor._get_active_devices()
-        for device in devices:
-            self.device_listbox.insert(tk.END, device)
+        """增量更新设备列表（只处理上次刷新后变化的设备）"""
+        changes = self.monitor.get_device_changes(self.device_list_version)
+        
+        if changes["full_resync"] or self.device_list_version == 0:
+            self.device_listbox.delete(0, tk.END)
+            self.listed_devices = set()
+            changed = self.monitor._get_active_devices()
+            removed = []
+        else:
+            changed, removed = changes["changed"], changes["removed"]
+        
+        if removed:
+            removed_set = set(removed) & self.listed_devices
+            for index in reversed(range(self.device_listbox.size())):
+                if self.device_listbox.get(index) in removed_set:
+                    self.device_listbox.delete(index)
+            self.listed_devices -= removed_set
+        
+        for device in changed:
+            if device not in self.listed_devices:
+                self.device_listbox.insert(tk.END, device)
+                self.listed_devices.add(device)
+        
+        self.device_list_version = changes["version"]
     
     def on_device_select(self, event):
         """设备选择事件"""
@@ -285,7 +354,7 @@ class IoTMonitorGUI:
                 recent_data = list(self.monitor.traffic_data[device_id])[-10:]
                 info += "\n最近10条记录:\n"
                 for i, record in enumerate(recent_data, 1):
-                    info += f"{i:2d}. {record['timestamp'].strftime('%H:%M:%S')} - "
+                    info += f"{i:2d}. {datetime.fromtimestamp(record['timestamp']).strftime('%H:%M:%S')} - "
                     info += f"发送: {record['bytes_sent']:.0f}B, 接收: {record['bytes_received']:.0f}B\n"
         else:
             info = f"设备 {device_id} 暂无数据"
@@ -299,35 +368,40 @@ class IoTMonitorGUI:
         self.update_status(f"📊 警报阈值已更新为: {threshold}")
     
     def generate_report(self):
-        """生成报告"""
+        """生成报告（不阻塞界面）
+
+        启用报告引擎时汇总和写文件在引擎的写线程中完成；
+        未启用时在后台线程中用 build_report 生成完整报告。
+        """
+        on_done = lambda path, error: self.root.after(0, self.on_report_done, path, error)
+        if self.monitor.reports is not None:
+            header = {"system_status": self.monitor.get_system_status()}
+            self.monitor.reports.request_report(header, on_done=on_done)
+        else:
+            threading.Thread(target=self._write_full_report, args=(on_done,), daemon=True).start()
+        self.update_status("📄 正在后台生成报告...")
+    
+    def _write_full_report(self, on_done):
+        """后台线程：由 build_report 生成报告并保存（报告引擎未启用时使用）"""
+        filename = error = None
         try:
-            report_data = {
-                "timestamp": datetime.now().isoformat(),
-                "system_status": self.monitor.get_system_status(),
-                "device_statistics": {},
-                "alert_summary": {
-                    "total_alerts": 0,
-                    "high_severity": 0,
-                    "medium_severity": 0
-                }
-            }
-            
-            # 收集设备统计
-            for device_id in self.monitor._get_active_devices():
-                stats = self.monitor.get_device_statistics(device_id)
-                if stats:
-                    report_data["device_statistics"][device_id] = stats
+            with self.monitor._lock:
+                report_data = self.monitor.build_report()
             
-            # 保存报告
             filename = f"iot_security_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
             with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(report_data, f, indent=2, ensure_ascii=False)
-            
-            messagebox.showinfo("成功", f"报告已生成: {filename}")
-            self.update_status(f"📄 报告已生成: {filename}")
-            
+                json.dump(report_data, f, indent=2, ensure_ascii=False, default=str)
         except Exception as e:
-            messagebox.showerror("错误", f"生成报告失败: {str(e)}")
+            error = str(e)
+        on_done(filename, error)
+    
+    def on_report_done(self, path, error):
+        """报告写完后的提示（Tk线程）"""
+        if error:
+            messagebox.showerror("错误", f"生成报告失败: {error}")
+            return
+        messagebox.showinfo("成功", f"报告已生成: {path}")
+        self.update_status(f"📄 报告已生成: {path}")
     
     def show_charts(self):
         """显示图表"""
@@ -336,7 +410,7 @@ class IoTMonitorGUI:
             for ax in [self.ax1, self.ax2, self.ax3, self.ax4]:
                 ax.clear()
             
-            devices = self.monitor._get_active_devices()
+            devices = self.monitor._get_active_devices(self.max_display_devices)
             
             if not devices:
                 self.ax1.text(0.5, 0.5, '暂无设备数据', ha='center', va='center', transform=self.ax1.transAxes)
@@ -391,7 +465,7 @@ class IoTMonitorGUI:
             for device_id in devices:
                 if device_id in self.monitor.traffic_data and self.monitor.traffic_data[device_id]:
                     data = list(self.monitor.traffic_data[device_id])[-20:]  # 最近20条记录
-                    timestamps = [d['timestamp'] for d in data]
+                    timestamps = [datetime.fromtimestamp(d['timestamp']) for d in data]
                     bytes_sent = [d['bytes_sent'] for d in data]
                     
                     self.ax3.plot(timestamps, bytes_sent, marker='o', label=device_id)
@@ -420,23 +494,7 @@ class IoTMonitorGUI:
     def export_data(self):
         """导出数据"""
         try:
-            export_data = self.monitor.export_traffic_data()
-            filename = f"iot_traffic_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            
-            # 转换datetime对象为字符串
-            def convert_datetime(obj):
-                if isinstance(obj, datetime):
-                    return obj.isoformat()
-                elif isinstance(obj, dict):
-                    return {k: convert_datetime(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_datetime(item) for item in obj]
-                return obj
-            
-            converted_data = convert_datetime(export_data)
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(converted_data, f, indent=2, ensure_ascii=False)
+            filename = self.monitor.save_traffic_export()
             
             messagebox.showinfo("成功", f"数据已导出: {filename}")
             self.update_status(f"💾 数据已导出: {filename}")
@@ -444,31 +502,31 @@ class IoTMonitorGUI:
         except Exception as e:
             messagebox.showerror("错误", f"导出数据失败: {str(e)}")
     
-    def update_status_loop(self):
-        """状态更新循环"""
-        while True:
-            try:
-                if self.monitoring_active:
-                    status = self.monitor.get_system_status()
-                    self.root.after(0, lambda: self.update_stats_display(status))
-                time.sleep(5)
-            except Exception as e:
-                print(f"状态更新错误: {e}")
+    def update_status_tick(self):
+        """状态更新（由运行时定时调用）"""
+        if self.monitoring_active:
+            status = self.monitor.get_system_status()
+            self.root.after(0, lambda: self.update_stats_display(status))
     
-    def data_update_loop(self):
-        """数据更新循环"""
-        while self.monitoring_active:
-            try:
-                # 更新设备列表
-                self.root.after(0, self.update_device_list)
-                
-                # 更新图表（如果当前在实时监控选项卡）
-                if self.notebook.index(self.notebook.select()) == 0:
-                    self.root.after(0, self.show_charts)
-                
-                time.sleep(10)
-            except Exception as e:
-                print(f"数据更新错误: {e}")
+    def data_update_tick(self):
+        """数据更新（由运行时定时调用，界面操作交回Tk线程）"""
+        if not self.monitoring_active:
+            return
+        
+        # 更新设备列表
+        self.root.after(0, self.update_device_list)
+        
+        # 更新图表或警报（仅刷新当前可见的选项卡）
+        self.root.after(0, self._refresh_visible_tab)
+    
+    def _refresh_visible_tab(self):
+        """仅刷新当前可见的选项卡"""
+        tab = self.notebook.index(self.notebook.select())
+        if tab == 0:
+            self.show_charts()
+        elif tab == 2 and not self.alert_paged:
+            # 停留在第一页时自动刷新，用户翻页浏览历史后不自动刷新（重新查询后恢复）
+            self.load_alerts()
     
     def update_stats_display(self, status):
         """更新统计显示"""
@@ -481,11 +539,13 @@ class IoTMonitorGUI:
 • 训练模型数: {status['trained_models']}
 • 警报阈值: {status['alert_threshold']}
 • 窗口大小: {status['window_size']}
+• 窗口长度/步长: {status['window_length']}s / {status['window_slide']}s
+• 迟到丢弃包数: {status['late_packets']}
 
 📊 设备详情:
 """
         
-        for device_id in self.monitor._get_active_devices():
+        for device_id in self.monitor._get_active_devices(self.max_display_devices):
             device_stats = self.monitor.get_device_statistics(device_id)
             if device_stats and device_stats.get('total_records', 0) > 0:
                 stats_info += f"\n📱 {device_id}:"
@@ -508,6 +568,8 @@ def main():
     def on_closing():
         if app.monitoring_active:
             app.stop_monitoring()
+        app.runtime.stop()
+        app.monitor.close()
         root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
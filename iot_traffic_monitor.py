@@ -2,171 +2,723 @@ import json
 import time
 import threading
 from collections import defaultdict, deque
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Tuple
 import numpy as np
-from sklearn.ensemble import IsolationForest
+from alert_store import AlertStore
+from cohort_models import CohortModelManager
+from device_registry import DeviceRegistry
+from dns_analyzer import DNSAnalyzer, DomainIndex
+from memory_budget import MB, MemoryBudget, history_nbytes
+from scoring import RobustPrefilter
+from scan_detector import ScanDetector
+from tls_inspector import TLSInspector
+from sketches import TrafficSketches
+from windowing import BEHAVIOR_FEATURES, SIZE_FEATURES, WindowManager, is_local_address
+
+# 异常检测使用的窗口特征：流量总量加发包行为（间隔、大小分布、周期性）
+FEATURE_NAMES = [
+    "bytes_sent",
+    "bytes_received",
+    "packets_sent",
+    "packets_received",
+    "connection_count",
+    "unique_destinations",
+    *BEHAVIOR_FEATURES
+]
+
+# 模拟模式下使用的设备
+SIMULATED_DEVICES = ["device_001", "device_002", "device_003", "sensor_001", "camera_001"]
 
 class IoTTrafficMonitor:
     """物联网流量监控系统"""
     
-    def __init__(self, window_size: int = 300):
-        self.window_size = window_size  # 5分钟窗口
+    def __init__(self, window_size: int = 300, check_interval: float = 60,
+                 window_length: float = None, window_slide: float = None,
+                 allowed_lateness: float = 2.0, max_devices: int = 50000,
+                 device_timeout: float = 3600, model_mode: str = "device",
+                 n_cohorts: int = 8, cohort_retrain_interval: float = 3600,
+                 top_k: int = 20, memory_budget_mb: float = 0, spill_dir: str = None,
+                 prefilter_mad: float = 0.0):
+        self.window_size = window_size  # 每个设备保留的历史窗口数
+        self.check_interval = check_interval  # 检测周期（秒）
         self.traffic_data = defaultdict(lambda: deque(maxlen=window_size))
         self.baseline_models = {}
         self.alert_threshold = 0.1
+        
+        # 模型模式："device" 每设备一个模型，"cohort" 同类设备共享模型
+        if model_mode not in ("device", "cohort"):
+            raise ValueError(f"未知的模型模式: {model_mode}")
+        self.model_mode = model_mode
+        self.cohorts = CohortModelManager(n_cohorts=n_cohorts)
+        self.cohort_retrain_interval = cohort_retrain_interval
+        
+        # 编译后的模型打分 + 可选的中位数/MAD 预筛选（仅每设备模型模式，prefilter_mad 为 0 时不筛选）
+        self.prefilter = (RobustPrefilter(len(FEATURE_NAMES), k=prefilter_mad)
+                          if model_mode == "device" else None)
         self.running = False
+        self.simulate = True  # 没有真实抓包数据时使用模拟数据
+        self.runtime = None
+        self.window_sink = None  # 采集器模式下关闭的窗口转发到这里，不在本地检测
+        self.alert_store = None  # 可选的 AlertStore
+        self.dispatcher = None  # 可选的 ActionDispatcher，自动响应动作在其工作线程中执行
+        self._response_config = None  # 创建分发器所用的 security 配置（开始监控时才创建）
+        self.recorder = None  # 可选的 PacketRecorder，告警时导出设备最近的原始帧
+        self.reports = None  # 可选的 ReportEngine，窗口关闭时增量汇总，后台生成小时/日报告
+        self.auto_response = True
+        self.isolation_threshold = 0.5  # 异常分数达到该值时自动隔离设备
+        self.log_file = "security_events.log"
+        self._stop_event = threading.Event()
+        self._lock = threading.RLock()
+        # 抓包时关闭的窗口先排队，由线程池中的检测任务处理，不在事件循环上训练模型和告警
+        self._closed_windows = deque()
+        self._drain_pending = False
+        
+        # 设备注册表：根据抓包结果维护设备，淘汰时同步清理历史数据和模型
+        self.registry = DeviceRegistry(max_devices=max_devices,
+                                       inactive_timeout=device_timeout,
+                                       on_evict=self._on_device_evicted)
+        
+        # 流量草图：Top-K 目标/协议/发送方和每设备的不同目标数，内存固定
+        self.sketches = TrafficSketches(top_k=top_k)
+        
+        # 扫描/横向移动检测：逐包更新，超过阈值时立即告警（None 表示关闭）
+        self.scans = ScanDetector()
+        
+        # TLS 指纹/SNI：每个流只检查前几个包，需要原始帧（None 表示关闭）
+        self.tls = TLSInspector()
+        
+        # DNS 分析：设备查询过的域名、黑白名单、DGA评分和 IP → 域名映射（None 表示关闭）
+        self.dns = DNSAnalyzer()
+        
+        # 内存预算：超出时挤出最久未活跃设备的历史、模型和草图（0 表示不限制）
+        self.memory = MemoryBudget(int(memory_budget_mb * MB), spill_dir)
+        
+        # 事件时间窗口：由数据包时间戳驱动，默认窗口长度等于检测周期
+        window_length = window_length or check_interval
+        self.windows = WindowManager(window_size=window_length,
+                                     slide=window_slide or window_length,
+                                     allowed_lateness=allowed_lateness,
+                                     on_close=self._queue_windows,
+                                     device_resolver=self._resolve_devices)
+    
+    @classmethod
+    def from_config(cls, config: Dict) -> "IoTTrafficMonitor":
+        """根据配置创建监控实例"""
+        monitoring = config.get("monitoring", {})
+        monitor = cls(window_size=monitoring.get("window_size", 300),
+                      check_interval=monitoring.get("check_interval", 60),
+                      window_length=monitoring.get("window_length"),
+                      window_slide=monitoring.get("window_slide"),
+                      allowed_lateness=monitoring.get("allowed_lateness", 2.0),
+                      max_devices=monitoring.get("max_devices", 50000),
+                      device_timeout=monitoring.get("device_timeout", 3600),
+                      model_mode=monitoring.get("model_mode", "device"),
+                      n_cohorts=monitoring.get("n_cohorts", 8),
+                      cohort_retrain_interval=monitoring.get("cohort_retrain_interval", 3600),
+                      top_k=monitoring.get("top_k", 20),
+                      memory_budget_mb=monitoring.get("memory_budget_mb", 0),
+                      spill_dir=monitoring.get("spill_dir"),
+                      prefilter_mad=monitoring.get("prefilter_mad", 0.0))
+        monitor.alert_threshold = monitoring.get("alert_threshold", monitor.alert_threshold)
+        
+        scan = config.get("scan_detection", {})
+        if not scan.get("enabled", True):
+            monitor.scans = None
+        elif scan:
+            monitor.scans = ScanDetector(window=scan.get("window", 10.0),
+                                         slots=scan.get("slots", 5),
+                                         port_threshold=scan.get("port_threshold", 100),
+                                         host_threshold=scan.get("host_threshold", 50),
+                                         internal_host_threshold=scan.get("internal_host_threshold", 20),
+                                         cooldown=scan.get("cooldown", 60.0),
+                                         max_sources=scan.get("max_sources", 10000))
+        
+        tls = config.get("tls_inspection", {})
+        if not tls.get("enabled", True):
+            monitor.tls = None
+        elif tls:
+            monitor.tls = TLSInspector(max_packets=tls.get("max_packets_per_flow", 4),
+                                       max_flows=tls.get("max_flows", 65536),
+                                       fingerprints_per_device=tls.get("fingerprints_per_device", 16),
+                                       learning_period=tls.get("learning_period", 3600.0),
+                                       max_devices=monitoring.get("max_devices", 50000))
+        
+        dns = config.get("dns", {})
+        if not dns.get("enabled", True):
+            monitor.dns = None
+        elif dns:
+            monitor.dns = DNSAnalyzer(index=DomainIndex.from_files(dns.get("blocklist"), dns.get("allowlist")),
+                                      domains_per_device=dns.get("domains_per_device", 256),
+                                      learning_period=dns.get("learning_period", 3600.0),
+                                      dga_threshold=dns.get("dga_threshold", 0.6),
+                                      cache_size=dns.get("cache_size", 65536),
+                                      recent_new_domains=dns.get("recent_new_domains", 1000),
+                                      max_devices=monitoring.get("max_devices", 50000))
+        
+        capture = config.get("capture", {})
+        if capture.get("ring_enabled"):
+            from packet_ring import PacketRecorder
+            monitor.recorder = PacketRecorder(output_dir=capture.get("pcap_dir", "evidence"),
+                                              ring_bytes=capture.get("ring_bytes", 262144),
+                                              total_bytes=int(capture.get("ring_total_mb", 32) * MB),
+                                              retention=capture.get("ring_retention", 120.0),
+                                              snaplen=capture.get("snaplen", 1514))
+        
+        reports = config.get("reports", {})
+        if reports.get("enabled"):
+            from report_engine import ReportEngine
+            monitor.reports = ReportEngine(FEATURE_NAMES, output_dir=reports.get("output_dir", "reports"),
+                                           history_hours=reports.get("history_hours", 48),
+                                           history_days=reports.get("history_days", 31),
+                                           context_source=monitor.report_context,
+                                           device_source=monitor.report_device_statistics)
+        
+        security = config.get("security", {})
+        monitor.log_file = security.get("log_file", monitor.log_file)
+        if security.get("alert_db"):
+            monitor.alert_store = AlertStore(security["alert_db"])
+        monitor.auto_response = security.get("auto_response", monitor.auto_response)
+        monitor.isolation_threshold = security.get("isolation_threshold", monitor.isolation_threshold)
+        # 分发器会读取并改写隔离状态文件，只在真正开始检测的进程中创建（见 start_monitoring），
+        # 报告、回测等只读用途不会解除隔离或覆盖运行中进程的状态
+        monitor._response_config = security
+        return monitor
+    
+    @property
+    def needs_raw_frames(self) -> bool:
+        """抓包时是否需要附带原始帧（抓包缓冲区、TLS检查或DNS分析开启时）"""
+        return self.recorder is not None or self.tls is not None or self.dns is not None
+        
+    def start_monitoring(self, runtime=None):
+        """开始监控
+
+        传入 AsyncRuntime 时检测周期作为事件循环上的定时任务运行，
+        否则退回到独立的后台线程。由 from_config 创建且开启自动响应时，
+        在这里创建响应分发器。
+        """
+        if self.auto_response and self.dispatcher is None and self._response_config is not None:
+            from response_dispatcher import create_dispatcher
+            self.dispatcher = create_dispatcher(self._response_config, on_result=self._on_response_result)
         
-    def start_monitoring(self):
-        """开始监控"""
         self.running = True
-        monitor_thread = threading.Thread(target=self._monitor_loop)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        self._stop_event.clear()
+        self.runtime = runtime
+        
+        if runtime is not None:
+            runtime.schedule_periodic("monitor.detection", self.check_interval,
+                                      self.run_detection_cycle, blocking=True)
+        else:
+            monitor_thread = threading.Thread(target=self._monitor_loop)
+            monitor_thread.daemon = True
+            monitor_thread.start()
         
     def _monitor_loop(self):
-        """监控主循环"""
+        """监控主循环（无运行时时使用）"""
         while self.running:
-            current_time = datetime.now()
+            self.run_detection_cycle()
+            
+            # 等待下一个周期，停止时立即唤醒
+            self._stop_event.wait(self.check_interval)
+    
+    def run_detection_cycle(self):
+        """执行一次检测周期
+
+        模拟模式下生成一批模拟窗口；抓包模式下窗口由数据包时间戳关闭，
+        这里只在流量中断时按处理时间推进水位线。
+        """
+        if not self.running:
+            return
+        
+        with self._lock:
+            if self.simulate:
+                self._process_windows(time.time(), self._collect_traffic_stats())
+            else:
+                self.windows.advance_idle(time.time())
+                self.drain_closed_windows()
             
-            # 收集当前时间窗口的流量数据
-            traffic_stats = self._collect_traffic_stats()
+            # 淘汰长时间不活跃的设备
+            self.registry.expire()
             
-            # 检测异常
-            for device_id, stats in traffic_stats.items():
-                anomaly_score = self._detect_anomaly(device_id, stats)
-                if anomaly_score > self.alert_threshold:
-                    self._trigger_alert(device_id, stats, anomaly_score)
+            # 统计内存用量，超出预算时挤出最久未活跃设备的数据
+            self.enforce_memory_budget()
             
-            time.sleep(60)  # 每分钟检查一次
+            # 群组模式下定期用全体设备重新聚类和训练
+            if (self.model_mode == "cohort" and self.cohorts.trained
+                    and time.time() - self.cohorts.last_trained >= self.cohort_retrain_interval):
+                self._train_cohort_models()
+    
+    def observe_packet(self, packet_info: Dict):
+        """接收一个抓包结果，按事件时间归入窗口"""
+        with self._lock:
+            self.windows.add_packet(packet_info, time.time())
+            src_device = self.registry.resolve_ip(packet_info.get("src_ip"))
+            self.sketches.add_packet(packet_info, src_device)
+            raw = packet_info.get("raw")
+            if raw is not None:
+                if self.recorder is not None:
+                    self._record_frame(packet_info, src_device, raw)
+                if self.tls is not None and src_device is not None:
+                    finding = self.tls.observe(packet_info, src_device)
+                    if finding:
+                        self._trigger_alert(src_device, finding, 0.4, packet_info["timestamp"],
+                                            alert_type="tls_fingerprint_change",
+                                            recommended_actions=["确认设备是否刚进行过固件升级",
+                                                                 "核对固件完整性",
+                                                                 "检查新的TLS目标地址(SNI)是否可信"])
+                if self.dns is not None:
+                    self._inspect_dns(packet_info, src_device)
+            if self.scans is not None:
+                for finding in self.scans.observe(packet_info):
+                    self._trigger_scan_alert(src_device or finding["source_ip"], finding,
+                                             packet_info["timestamp"])
+    
+    def _record_frame(self, packet_info: Dict, src_device: str, raw: bytes):
+        """原始帧存入两端内网设备的环形缓冲区"""
+        timestamp = packet_info["timestamp"]
+        if src_device is not None:
+            self.recorder.record(src_device, timestamp, raw)
+        dst_device = self.registry.resolve_ip(packet_info.get("dst_ip"))
+        if dst_device is not None and dst_device != src_device:
+            self.recorder.record(dst_device, timestamp, raw)
+    
+    def _inspect_dns(self, packet_info: Dict, src_device: str):
+        """DNS 查询的黑名单/DGA发现结果转换为安全警报（响应只用于建立 IP → 域名映射）"""
+        finding = self.dns.observe(packet_info, src_device)
+        if not finding:
+            return
+        score, actions = {
+            "dns_blocklisted": (0.8, ["立即隔离设备", "检查设备是否感染恶意软件", "在DNS服务器上拦截该域名"]),
+            "dns_dga_suspect": (0.6, ["检查设备是否被僵尸网络控制", "核对固件完整性"])
+        }[finding["alert_type"]]
+        self._trigger_alert(src_device, finding, score, packet_info["timestamp"],
+                            alert_type=finding["alert_type"], recommended_actions=actions)
+    
+    def _trigger_scan_alert(self, device_id: str, finding: Dict, timestamp: float):
+        """扫描/横向移动检测结果转换为安全警报"""
+        actions = {
+            "vertical_scan": ["检查设备是否被入侵", "确认是否有授权的漏洞扫描"],
+            "horizontal_scan": ["检查设备是否被入侵", "排查同网段其他设备是否已被感染"],
+            "lateral_movement": ["立即隔离设备", "排查被访问的内网主机", "检查设备固件和凭据"]
+        }[finding["scan_type"]]
+        self._trigger_alert(device_id, finding, finding["score"], timestamp,
+                            alert_type=finding["scan_type"], recommended_actions=actions)
+    
+    def drain_sketches(self):
+        """取出并重置流量草图（采集器模式下发送给汇聚节点），没有新数据时返回 None"""
+        with self._lock:
+            if not self.sketches.packets:
+                return None
+            sketches, self.sketches = self.sketches, self.sketches.empty_like()
+        return sketches.to_bytes()
+    
+    def merge_sketches(self, data: bytes, device_prefix: str = ""):
+        """合并远端采集器发送的流量草图"""
+        sketches = TrafficSketches.from_bytes(data)
+        with self._lock:
+            self.sketches.merge(sketches, device_prefix)
+    
+    def _resolve_devices(self, packet_info: Dict):
+        """通过注册表识别数据包两端的内网设备"""
+        timestamp = packet_info["timestamp"]
+        length = packet_info.get("length", 0)
+        src_ip = packet_info.get("src_ip")
+        dst_ip = packet_info.get("dst_ip")
+        
+        src_device = dst_device = None
+        if src_ip and is_local_address(src_ip):
+            src_device = self.registry.observe(src_ip, packet_info.get("src_mac"), timestamp, length)
+        if dst_ip and is_local_address(dst_ip):
+            dst_device = self.registry.observe(dst_ip, packet_info.get("dst_mac"), timestamp, length)
+        return src_device, dst_device
+    
+    def _on_device_evicted(self, device_id: str, ips: List[str] = ()):
+        """设备被注册表淘汰时释放其历史数据、模型和以其IP为键的扫描检测状态"""
+        self.traffic_data.pop(device_id, None)
+        self.baseline_models.pop(device_id, None)
+        self.cohorts.remove(device_id)
+        self.sketches.remove_device(device_id)
+        self.windows.forget_device(device_id)
+        self.memory.forget(device_id)
+        if self.prefilter is not None:
+            self.prefilter.remove(device_id)
+        if self.tls is not None:
+            self.tls.remove_device(device_id)
+        if self.dns is not None:
+            self.dns.remove_device(device_id)
+        if self.recorder is not None:
+            self.recorder.remove(device_id)
+        if self.scans is not None:
+            for ip in ips:
+                self.scans.forget(ip)
+    
+    def get_memory_usage(self) -> Dict:
+        """统计各数据结构的近似内存用量（字节）"""
+        with self._lock:
+            structures = {
+                "traffic_data": sum(history_nbytes(history) for history in self.traffic_data.values()),
+                "baseline_models": self.memory.models_bytes(self.baseline_models, "model:"),
+                "cohort_models": self.memory.models_bytes(self.cohorts.cohort_models, "cohort:"),
+                "sketches": self.sketches.nbytes,
+                "windows": self.windows.nbytes,
+                "registry": self.registry.nbytes,
+                "scan_detector": self.scans.nbytes if self.scans is not None else 0,
+                "packet_rings": self.recorder.nbytes if self.recorder is not None else 0,
+                "tls_inspector": self.tls.nbytes if self.tls is not None else 0,
+                "dns_analyzer": self.dns.nbytes if self.dns is not None else 0,
+                "prefilter": self.prefilter.nbytes if self.prefilter is not None else 0,
+                "report_engine": self.reports.nbytes if self.reports is not None else 0
+            }
+            return self.memory.record(structures)
+    
+    def enforce_memory_budget(self) -> int:
+        """超出内存预算时按最久未活跃的顺序挤出设备数据，返回挤出的设备数
+
+        设备仍保留在注册表中；配置了溢出目录时数据写入磁盘，设备产生新窗口时取回。
+        """
+        with self._lock:
+            usage = self.get_memory_usage()
+            if not self.memory.enabled or usage["total_bytes"] <= self.memory.limit_bytes:
+                return 0
+            
+            excess = usage["total_bytes"] - self.memory.target_bytes
+            victims = []
+            for device_id in self.registry.iter_lru():
+                if excess <= 0:
+                    break
+                freed = self._device_nbytes(device_id)
+                if freed:
+                    victims.append(device_id)
+                    excess -= freed
+            
+            for device_id in victims:
+                self._evict_device_data(device_id)
+            
+            if excess > 0:
+                print(f"⚠️ 内存预算不足: 挤出全部设备数据后仍超出 {excess / MB:.1f} MB")
+            if victims:
+                action = "溢出到磁盘" if self.memory.spill is not None else "丢弃"
+                print(f"🧹 内存超出预算，已{action} {len(victims)} 个设备的历史数据和模型")
+                self.get_memory_usage()
+            return len(victims)
+    
+    def _device_nbytes(self, device_id: str) -> int:
+        """单个设备可挤出的数据的字节数"""
+        size = self.sketches.device_nbytes(device_id)
+        history = self.traffic_data.get(device_id)
+        if history:
+            size += history_nbytes(history)
+        model = self.baseline_models.get(device_id)
+        if model is not None:
+            size += self.memory.model_bytes(f"model:{device_id}", model)
+        return size
+    
+    def _evict_device_data(self, device_id: str):
+        """把设备的历史、模型和草图挤出内存（溢出到磁盘或丢弃）"""
+        model = self.baseline_models.pop(device_id, None)
+        if self.prefilter is not None:
+            self.prefilter.remove(device_id)
+        payload = {
+            "history": list(self.traffic_data.pop(device_id, ())),
+            "model": model,
+            "model_bytes": self.memory.model_bytes(f"model:{device_id}", model) if model is not None else 0,
+            "sketches": self.sketches.export_device(device_id)
+        }
+        self.memory.evicted += 1
+        if self.memory.spill is not None:
+            self.memory.spill.put(device_id, payload)
+    
+    def _reload_device_data(self, device_id: str):
+        """取回溢出到磁盘的设备数据"""
+        payload = self.memory.spill.take(device_id)
+        if payload is None:
+            return
+        self.memory.reloaded += 1
+        history = self.traffic_data[device_id]
+        for record in reversed(payload["history"]):
+            if len(history) >= history.maxlen:
+                break
+            history.appendleft(record)
+        if payload["model"] is not None and device_id not in self.baseline_models:
+            self.baseline_models[device_id] = payload["model"]
+            self.memory.remember_model(f"model:{device_id}", payload["model"], payload["model_bytes"])
+        if payload["sketches"] is not None:
+            self.sketches.import_device(device_id, payload["sketches"])
+    
+    def _queue_windows(self, window_end: float, window_stats: Dict[str, Dict]):
+        """窗口关闭回调：有运行时时排队并交给线程池处理，否则直接处理"""
+        if self.window_sink is not None or self.runtime is None:
+            self._process_windows(window_end, window_stats)
+            return
+        
+        self._closed_windows.append((window_end, window_stats))
+        if not self._drain_pending:
+            self._drain_pending = True
+            self.runtime.run_blocking("monitor.windows", self.drain_closed_windows)
+    
+    def drain_closed_windows(self):
+        """处理排队的已关闭窗口（在线程池或检测周期中调用）"""
+        self._drain_pending = False
+        while self._closed_windows:
+            with self._lock:
+                if not self._closed_windows:
+                    break
+                window_end, window_stats = self._closed_windows.popleft()
+                self._process_windows(window_end, window_stats)
+    
+    def _process_windows(self, window_end: float, window_stats: Dict[str, Dict]):
+        """处理一批已关闭的窗口"""
+        if self.window_sink is not None:
+            self.window_sink(window_end, window_stats)
+            return
+        
+        self._process_batch([(device_id, window_end, stats) for device_id, stats in window_stats.items()])
+    
+    def ingest_window_summaries(self, summaries: List[Tuple[str, float, Dict]]):
+        """接收远端采集器发送的窗口摘要 (设备ID, 窗口结束时间, 统计)"""
+        with self._lock:
+            for device_id, window_end, stats in summaries:
+                self.registry.touch(device_id, window_end)
+            self._process_batch(summaries)
+    
+    def _process_batch(self, windows: List[Tuple[str, float, Dict]]):
+        """处理一批窗口：开启预筛选时先对整批做向量化筛选，再逐个记录和检测"""
+        skip = None
+        if self.prefilter is not None and self.prefilter.screening and windows:
+            features = np.array([self._feature_vector(stats) for _, _, stats in windows])
+            skip = self.prefilter.screen([device_id for device_id, _, _ in windows],
+                                         features, self.alert_threshold)
+        
+        for i, (device_id, timestamp, stats) in enumerate(windows):
+            self.process_window(device_id, stats, timestamp, screened=skip is not None and skip[i])
+    
+    def process_window(self, device_id: str, stats: Dict, timestamp: float, screened: bool = False):
+        """记录一个设备窗口并进行异常检测（screened 表示预筛选已判定为正常，不调用模型）"""
+        # 数据被挤到磁盘的设备重新活跃时先取回
+        if self.memory.spill is not None and device_id in self.memory.spill:
+            self._reload_device_data(device_id)
+        
+        # 添加到历史数据
+        self.traffic_data[device_id].append({
+            "timestamp": timestamp,
+            **stats
+        })
+        if self.reports is not None:
+            self.reports.observe_window(device_id, timestamp, stats)
+        
+        if screened:
+            return
+        
+        # 检测异常
+        anomaly_score = self._detect_anomaly(device_id, stats)
+        if anomaly_score > self.alert_threshold:
+            self._trigger_alert(device_id, stats, anomaly_score, timestamp)
     
     def _collect_traffic_stats(self) -> Dict:
-        """收集流量统计信息"""
-        # 模拟流量数据收集
+        """收集流量统计信息（模拟数据）"""
         stats = {}
         
-        # 这里应该从实际网络接口收集数据
-        # 示例数据结构
-        for device_id in self._get_active_devices():
+        # 实际流量由 observe_packet 按窗口聚合，这里仅生成模拟数据
+        now = time.time()
+        for device_id in SIMULATED_DEVICES:
+            self.registry.touch(device_id, now)
             stats[device_id] = {
                 "bytes_sent": np.random.normal(1000, 200),
                 "bytes_received": np.random.normal(800, 150),
                 "packets_sent": np.random.normal(50, 10),
                 "packets_received": np.random.normal(40, 8),
                 "connection_count": np.random.poisson(5),
-                "unique_destinations": np.random.poisson(3)
+                "unique_destinations": np.random.poisson(3),
+                "iat_mean": np.random.normal(1.2, 0.1),
+                "iat_variance": abs(np.random.normal(0.05, 0.01)),
+                **dict(zip(SIZE_FEATURES, np.random.dirichlet([2, 4, 6, 3, 1, 1]))),
+                "dominant_period": np.random.normal(10, 0.5),
+                "periodicity_strength": np.random.uniform(0.5, 0.7)
             }
-            
-            # 添加到历史数据
-            self.traffic_data[device_id].append({
-                "timestamp": datetime.now(),
-                **stats[device_id]
-            })
         
         return stats
     
     def _detect_anomaly(self, device_id: str, current_stats: Dict) -> float:
         """检测异常流量"""
+        if self.model_mode == "cohort":
+            return self._detect_anomaly_cohort(device_id, current_stats)
+        
         if device_id not in self.baseline_models:
             self._build_baseline_model(device_id)
             return 0.0
         
         # 提取特征向量
-        features = np.array([
-            current_stats["bytes_sent"],
-            current_stats["bytes_received"],
-            current_stats["packets_sent"],
-            current_stats["packets_received"],
-            current_stats["connection_count"],
-            current_stats["unique_destinations"]
-        ]).reshape(1, -1)
+        features = self._feature_vector(current_stats).reshape(1, -1)
         
         # 计算异常分数
         model = self.baseline_models[device_id]
-        anomaly_score = model.decision_function(features)[0]
+        if self.prefilter is not None:
+            # 从检查点或磁盘取回的模型还没有编译，用当前历史补算一次区间
+            if device_id not in self.prefilter:
+                self.prefilter.fit(device_id, model, self._history_matrix(device_id))
+            anomaly_score = self.prefilter.score(device_id, features)
+        else:
+            anomaly_score = model.decision_function(features)[0]
         
         return abs(anomaly_score)
     
+    def _detect_anomaly_cohort(self, device_id: str, current_stats: Dict) -> float:
+        """使用群组共享模型检测异常流量"""
+        if not self.cohorts.has_model(device_id):
+            if len(self.traffic_data[device_id]) < 50:  # 需要足够的历史数据
+                return 0.0
+            
+            # 首次训练使用所有数据充足的设备，之后新设备直接归入最近的群组，
+            # 设备数量翻倍时重新聚类
+            if not self.cohorts.trained:
+                self._train_cohort_models()
+            else:
+                self.cohorts.assign(device_id, self._history_matrix(device_id))
+                if self.cohorts.should_retrain():
+                    self._train_cohort_models()
+            return 0.0
+        
+        return self.cohorts.score(device_id, self._feature_vector(current_stats))
+    
+    def _train_cohort_models(self):
+        """用所有数据充足的设备重新训练群组模型"""
+        histories = {device_id: self._history_matrix(device_id)
+                     for device_id, data in list(self.traffic_data.items()) if len(data) >= 50}
+        self.cohorts.fit(histories, time.time())
+    
+    @staticmethod
+    def _feature_vector(record: Dict) -> np.ndarray:
+        """从窗口统计中提取特征向量（旧版采集器没有的特征按0处理）"""
+        return np.array([record.get(name, 0.0) for name in FEATURE_NAMES], dtype=float)
+    
+    def _history_matrix(self, device_id: str) -> np.ndarray:
+        """设备历史窗口的特征矩阵"""
+        return np.array([[record.get(name, 0.0) for name in FEATURE_NAMES]
+                         for record in self.traffic_data[device_id]], dtype=float)
+    
     def _build_baseline_model(self, device_id: str):
         """构建基线模型"""
         if len(self.traffic_data[device_id]) < 50:  # 需要足够的历史数据
             return
         
         # 提取历史特征
-        features = []
-        for record in self.traffic_data[device_id]:
-            features.append([
-                record["bytes_sent"],
-                record["bytes_received"],
-                record["packets_sent"],
-                record["packets_received"],
-                record["connection_count"],
-                record["unique_destinations"]
-            ])
-        
-        # 训练异常检测模型
-        X = np.array(features)
+        X = self._history_matrix(device_id)
+        
+        # 训练异常检测模型（sklearn 加载较慢，第一次建模时才导入）
+        from sklearn.ensemble import IsolationForest
         model = IsolationForest(contamination=0.1, random_state=42)
         model.fit(X)
         
         self.baseline_models[device_id] = model
+        if self.prefilter is not None:
+            self.prefilter.fit(device_id, model, X)
     
-    def _trigger_alert(self, device_id: str, stats: Dict, score: float):
-        """触发安全警报"""
+    def _trigger_alert(self, device_id: str, stats: Dict, score: float, timestamp: float = None,
+                       alert_type: str = "traffic_anomaly", recommended_actions: List[str] = None):
+        """触发安全警报（时间戳使用窗口或数据包的事件时间）"""
+        if timestamp is None:
+            timestamp = time.time()
+        
         alert = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
             "device_id": device_id,
-            "alert_type": "traffic_anomaly",
-            "severity": "high" if score > 0.5 else "medium",
+            "alert_type": alert_type,
+            "severity": "high" if score >= 0.5 else "medium",  # 与默认隔离阈值一致：会被隔离的都是高危
             "anomaly_score": score,
             "traffic_stats": stats,
-            "recommended_actions": [
+            "recommended_actions": recommended_actions or [
                 "检查设备状态",
                 "验证网络连接",
                 "检查是否存在恶意软件"
             ]
         }
         
-        print(f"🚨 安全警报: {json.dumps(alert, indent=2, ensure_ascii=False)}")
+        # 导出设备最近的原始帧作为证据（后台写文件，这里只确定路径）
+        if self.recorder is not None:
+            evidence = self.recorder.dump(device_id, alert_type, timestamp)
+            if evidence:
+                alert["evidence_pcap"] = evidence
+        
+        print(f"🚨 安全警报: {json.dumps(alert, indent=2, ensure_ascii=False, default=str)}")
+        
+        # 写入警报库（后台批量提交）
+        if self.alert_store is not None:
+            self.alert_store.add(alert)
+        if self.reports is not None:
+            self.reports.observe_alert(alert)
         
         # 这里可以集成更多响应机制
         self._auto_response(device_id, alert)
     
     def _auto_response(self, device_id: str, alert: Dict):
-        """自动响应机制"""
-        if alert["severity"] == "high":
-            # 高风险：临时隔离设备
-            print(f"⚠️ 自动响应: 设备 {device_id} 已被临时隔离")
-            # 实际实现中会调用网络隔离API
+        """自动响应机制
+
+        分数达到隔离阈值时临时隔离设备。隔离请求交给分发器异步执行，
+        外部接口再慢也不会阻塞检测。
+        """
+        if self.auto_response and alert["anomaly_score"] >= self.isolation_threshold:
+            if self.dispatcher is not None:
+                self.dispatcher.submit("isolate", device_id, {
+                    "alert_type": alert["alert_type"],
+                    "anomaly_score": alert["anomaly_score"],
+                    "timestamp": alert["timestamp"]
+                })
+            else:
+                print(f"⚠️ 自动响应: 设备 {device_id} 已被临时隔离")
         
         # 记录到安全日志
         self._log_security_event(alert)
     
-    def _get_active_devices(self) -> List[str]:
-        """获取活跃设备列表"""
-        # 模拟活跃设备列表
-        # 实际实现中应该从网络扫描或设备注册表获取
-        return ["device_001", "device_002", "device_003", "sensor_001", "camera_001"]
+    def _on_response_result(self, result: Dict):
+        """记录自动响应动作的执行结果（在分发器线程中调用）"""
+        self._log_security_event(result, event_type="response_action")
+    
+    def _get_active_devices(self, limit: int = None) -> List[str]:
+        """获取活跃设备列表（按最近活跃排序）"""
+        return self.registry.device_ids(limit)
+    
+    def get_device_changes(self, version: int) -> Dict:
+        """获取指定版本之后变化的设备"""
+        return self.registry.changes_since(version)
     
-    def _log_security_event(self, event: Dict):
+    def _log_security_event(self, event: Dict, event_type: str = "security_alert"):
         """记录安全事件到日志"""
         log_entry = {
             "timestamp": datetime.now().isoformat(),
-            "event_type": "security_alert",
+            "event_type": event_type,
             "details": event
         }
         
         # 写入日志文件
-        with open("security_events.log", "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+        with open(self.log_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(log_entry, ensure_ascii=False, default=str) + "\n")
         
-        print(f"📝 安全事件已记录: {event['alert_type']}")
+        print(f"📝 安全事件已记录: {event.get('alert_type', event_type)}")
     
     def stop_monitoring(self):
         """停止监控"""
         self.running = False
+        self._stop_event.set()
+        if self.runtime is not None:
+            self.runtime.cancel("monitor.detection")
+            self.runtime = None
+        self.drain_closed_windows()
+        if self.alert_store is not None:
+            self.alert_store.flush()
         print("🛑 流量监控已停止")
     
+    def close(self):
+        """释放警报库、响应分发器、抓包缓冲区、报告引擎和溢出目录（进程退出前调用）"""
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.reports is not None:
+            self.reports.stop()
+        if self.alert_store is not None:
+            self.alert_store.close()
+        self.memory.close()
+    
     def get_device_statistics(self, device_id: str) -> Dict:
         """获取设备统计信息"""
         if device_id not in self.traffic_data:
@@ -182,19 +734,156 @@ class IoTTrafficMonitor:
             "avg_bytes_sent": np.mean([d["bytes_sent"] for d in data]),
             "avg_bytes_received": np.mean([d["bytes_received"] for d in data]),
             "max_connections": max([d["connection_count"] for d in data]),
-            "last_seen": data[-1]["timestamp"].isoformat() if data else None
+            "last_seen": datetime.fromtimestamp(data[-1]["timestamp"]).isoformat() if data else None
         }
         
+        # 抓包以来的不同目标地址数/端口数（HyperLogLog 估计）
+        stats.update(self.sketches.device_cardinality(device_id))
+        
+        # 已知的TLS客户端指纹（JA3）和最近访问的SNI
+        if self.tls is not None:
+            stats.update(self.tls.device_summary(device_id))
+        
+        # 查询过的域名数和最近查询的域名
+        if self.dns is not None:
+            stats.update(self.dns.device_summary(device_id))
+        
         return stats
     
+    def get_traffic_summary(self, n: int = None) -> Dict:
+        """全局流量摘要：Top-K 目标地址、协议、发送方和不同目标地址数
+
+        开启DNS分析时，目标地址附带最近一次解析到该地址的域名。
+        """
+        with self._lock:
+            summary = self.sketches.summary(n)
+            if self.dns is not None:
+                for destination in summary["top_destinations"]:
+                    domain = self.dns.domain_for(destination["key"])
+                    if domain:
+                        destination["domain"] = domain
+            return summary
+    
+    def build_report(self, device_ids: List[str] = None) -> Dict:
+        """生成安全报告数据（系统状态、设备统计、流量摘要、警报汇总）"""
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "system_status": self.get_system_status(),
+            "device_statistics": {},
+            "traffic_summary": self.get_traffic_summary(),
+            "alert_summary": {
+                "total_alerts": 0,
+                "high_severity": 0,
+                "medium_severity": 0
+            },
+            "memory_usage": self.get_memory_usage()
+        }
+        
+        # 当天截至目前的全体汇总由报告引擎增量维护
+        if self.reports is not None:
+            report["fleet_summary"] = self.reports.fleet_summary("day")
+        
+        # 警报汇总直接由警报库索引统计
+        if self.alert_store is not None:
+            self.alert_store.flush()
+            report["alert_summary"] = self.alert_store.summary()
+        
+        # 收集设备统计
+        for device_id in (device_ids if device_ids is not None else self._get_active_devices()):
+            stats = self.get_device_statistics(device_id)
+            if stats:
+                report["device_statistics"][device_id] = stats
+        
+        return report
+    
+    def report_context(self, start: float, end: float = None) -> Dict:
+        """报告引擎写报告时附加的流量摘要和时段内的警报汇总（在写线程中调用）"""
+        context = {"traffic_summary": self.get_traffic_summary()}
+        if self.alert_store is not None:
+            self.alert_store.flush()
+            context["alert_summary"] = self.alert_store.summary(start=start, end=end)
+        return context
+    
+    def report_device_statistics(self, device_id: str) -> Dict:
+        """报告引擎写报告时附加的设备统计（在写线程中调用）"""
+        with self._lock:
+            return self.get_device_statistics(device_id)
+    
+    def snapshot_state(self) -> Dict:
+        """导出检查点所需的状态
+
+        历史窗口压平为一个数值矩阵加每设备偏移量；模型对象训练后不再修改，
+        只做浅拷贝，序列化留给后台线程。
+        """
+        with self._lock:
+            columns = ["timestamp"] + FEATURE_NAMES
+            device_ids = [d for d, data in self.traffic_data.items() if data]
+            offsets = np.zeros(len(device_ids) + 1, dtype=np.int64)
+            rows = []
+            for i, device_id in enumerate(device_ids):
+                rows.extend([record.get(name, 0.0) for name in columns]
+                            for record in self.traffic_data[device_id])
+                offsets[i + 1] = len(rows)
+            
+            return {
+                "timestamp": time.time(),
+                "columns": columns,
+                "device_ids": device_ids,
+                "offsets": offsets,
+                "values": np.array(rows, dtype=np.float64).reshape(-1, len(columns)),
+                "baseline_models": dict(self.baseline_models),
+                "cohorts": self.cohorts.get_state(),
+                "registry": self.registry.snapshot(),
+                "model_mode": self.model_mode,
+                "reports": self.reports.get_state() if self.reports is not None else None
+            }
+    
+    def restore_state(self, state: Dict):
+        """从检查点恢复历史窗口、模型和设备注册表"""
+        with self._lock:
+            columns = list(state["columns"])
+            missing = [name for name in FEATURE_NAMES if name not in columns]
+            values = state["values"]
+            offsets = state["offsets"]
+            
+            for i, device_id in enumerate(state["device_ids"]):
+                history = self.traffic_data[device_id]
+                for row in values[offsets[i]:offsets[i + 1]].tolist():
+                    record = dict(zip(columns, row))
+                    for name in missing:
+                        record[name] = 0.0
+                    history.append(record)
+            
+            # 特征集变化之前训练的模型输入维度不同，不能继续使用，由新历史重新训练
+            if missing:
+                print(f"⚠️ 检查点缺少特征 {', '.join(missing)}，模型将重新训练")
+            else:
+                self.baseline_models.update(state.get("baseline_models") or {})
+                if state.get("model_mode") == self.model_mode and state.get("cohorts"):
+                    self.cohorts.set_state(state["cohorts"])
+            self.registry.restore(state.get("registry", []))
+            if self.reports is not None and state.get("reports"):
+                self.reports.set_state(state["reports"])
+    
     def get_system_status(self) -> Dict:
         """获取系统状态"""
         return {
             "running": self.running,
             "monitored_devices": len(self.traffic_data),
-            "trained_models": len(self.baseline_models),
+            "trained_models": len(self.baseline_models) + len(self.cohorts.cohort_models),
+            "model_mode": self.model_mode,
             "alert_threshold": self.alert_threshold,
-            "window_size": self.window_size
+            "window_size": self.window_size,
+            "window_length": self.windows.window_size,
+            "window_slide": self.windows.slide,
+            "late_packets": self.windows.late_packets,
+            "queued_windows": len(self._closed_windows),
+            "known_devices": len(self.registry),
+            "registry_version": self.registry.version,
+            "isolated_devices": len(self.dispatcher.isolated) if self.dispatcher is not None else 0,
+            "memory_bytes": self.memory.usage.get("total_bytes", 0),
+            "memory_limit_bytes": self.memory.limit_bytes,
+            "prefilter_screened_ratio": self.prefilter.get_status()["screened_ratio"] if self.prefilter is not None else 0.0
         }
     
     def update_alert_threshold(self, threshold: float):
@@ -215,6 +904,23 @@ class IoTTrafficMonitor:
             for dev_id, data in self.traffic_data.items():
                 export_data[dev_id] = list(data)
             return export_data
+    
+    def save_traffic_export(self, filename: str = None, device_id: str = None) -> str:
+        """将流量数据导出为JSON文件，返回文件名"""
+        if filename is None:
+            filename = f"iot_traffic_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        
+        # 内部使用浮点epoch时间戳，导出时转换为ISO字符串
+        converted_data = {
+            dev_id: [{**record, "timestamp": datetime.fromtimestamp(record["timestamp"]).isoformat()}
+                     for record in records]
+            for dev_id, records in self.export_traffic_data(device_id).items()
+        }
+        
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(converted_data, f, indent=2, ensure_ascii=False)
+        
+        return filename
 
 # 主程序入口
 if __name__ == "__main__":
@@ -1,72 +1,184 @@
-import time
-import threading
-from iot_traffic_monitor import IoTTrafficMonitor
-from traffic_capture import TrafficCapture
+import argparse
+from async_runtime import AsyncRuntime
+from checkpoint import CheckpointManager
+from config_loader import load_config
+from distributed import AggregatorServer, CollectorClient
+from iot_traffic_monitor import IoTTrafficMonitor, FEATURE_NAMES
 from protocol_parser import ProtocolParser
-from traffic_visualizer import TrafficVisualizer
+from web_dashboard import WebDashboardServer
 
 class IoTSecuritySystem:
-    """物联网安全监控系统主程序"""
+    """物联网安全监控系统主程序
+
+    抓包（scapy）和可视化（matplotlib）模块在第一次用到时才导入，
+    汇聚节点和不画图的运行方式不会加载它们。
+    """
+    
+    MODES = ("standalone", "collector", "aggregator")
     
-    def __init__(self):
-        self.monitor = IoTTrafficMonitor()
-        self.capture = TrafficCapture()
+    def __init__(self, config_path: str = "config.json", mode: str = "standalone"):
+        if mode not in self.MODES:
+            raise ValueError(f"未知的运行模式: {mode}")
+        self.mode = mode
+        self.config = load_config(config_path)
+        self.runtime = AsyncRuntime()
+        self.monitor = IoTTrafficMonitor.from_config(self.config)
+        self.capture = None
         self.parser = ProtocolParser()
-        self.visualizer = TrafficVisualizer()
+        self._visualizer = None
+        self.checkpoints = CheckpointManager(self.config["checkpoint"]["directory"],
+                                             self.config["checkpoint"]["keep"])
+        self.collector = None
+        self.aggregator = None
+        self.web_dashboard = None
         self.running = False
+    
+    @property
+    def visualizer(self):
+        """可视化模块（第一次使用时创建）"""
+        if self._visualizer is None:
+            from traffic_visualizer import TrafficVisualizer
+            visualization = self.config["visualization"]
+            self._visualizer = TrafficVisualizer(headless=visualization["headless"],
+                                                 output_dir=visualization["output_dir"],
+                                                 image_format=visualization["image_format"],
+                                                 render_workers=visualization["render_workers"])
+        return self._visualizer
+        
+    def start_system(self, show_dashboard: bool = True):
+        """启动系统
+
+        standalone: 本地抓包并检测；collector: 本地抓包和窗口聚合，摘要发送到汇聚节点；
+        aggregator: 不抓包，接收各采集器的摘要并统一检测。
+        """
+        print(f"🚀 启动物联网安全监控系统 ({self.mode})...")
+        
+        # 启动事件循环，抓包线程通过桥接队列把数据包交给事件循环处理
+        self.runtime.start()
+        self.runtime.set_item_handler(self._process_captured_packet)
+        self.running = True
         
-    def start_system(self):
-        """启动系统"""
-        print("🚀 启动物联网安全监控系统...")
+        distributed_config = self.config["distributed"]
+        if self.mode == "collector":
+            self.collector = CollectorClient(distributed_config["aggregator_host"],
+                                             distributed_config["aggregator_port"],
+                                             FEATURE_NAMES,
+                                             collector_id=distributed_config["collector_id"],
+                                             batch_size=distributed_config["batch_size"],
+                                             flush_interval=distributed_config["flush_interval"],
+                                             max_buffer=distributed_config["max_buffer"],
+                                             sketch_source=self.monitor.drain_sketches)
+            self.monitor.window_sink = self.collector.enqueue
+            self.collector.start(self.runtime)
+        elif self.mode == "aggregator":
+            self.aggregator = AggregatorServer(self.monitor,
+                                               distributed_config["listen_host"],
+                                               distributed_config["listen_port"])
+            self.aggregator.start(self.runtime)
+        
+        # 从检查点热启动，恢复历史窗口和已训练的模型
+        checkpoint_config = self.config["checkpoint"]
+        if checkpoint_config["enabled"] and self.mode != "collector":
+            self.checkpoints.load(self.monitor)
+            self.runtime.schedule_periodic("checkpoint.save", checkpoint_config["interval"],
+                                           lambda: self.checkpoints.save(self.monitor), blocking=True)
         
         # 启动流量监控
-        self.monitor.start_monitoring()
+        self.monitor.start_monitoring(self.runtime)
         
-        # 启动流量捕获（可选，需要管理员权限）
-        try:
-            self.capture.start_capture(self._process_captured_packet)
-            print("✅ 流量捕获已启动")
-        except Exception as e:
-            print(f"⚠️ 流量捕获启动失败: {e}")
-            print("💡 系统将使用模拟数据运行")
+        # 面板刷新与自动导出作为定时任务运行
+        if show_dashboard:
+            self.runtime.schedule_periodic("dashboard.refresh", self.config["gui"]["update_interval"],
+                                           self.show_dashboard, run_immediately=True)
+        
+        web_config = self.config["web"]
+        if web_config["enabled"] and self.mode != "collector":
+            self.web_dashboard = WebDashboardServer(self.monitor, web_config["host"], web_config["port"],
+                                                    web_config["refresh_interval"],
+                                                    web_config["max_devices"])
+            self.web_dashboard.start(self.runtime)
+        
+        export_config = self.config["export"]
+        if export_config["auto_export"]:
+            self.runtime.schedule_periodic("export.traffic", export_config["export_interval"],
+                                           self._auto_export, blocking=True)
+        
+        # 启动流量捕获（可选，需要管理员权限）；汇聚节点只接收摘要
+        if self.mode == "aggregator":
+            self.monitor.simulate = False
+        else:
+            try:
+                from traffic_capture import TrafficCapture
+                self.capture = TrafficCapture(self.config["capture"]["interface"],
+                                              keep_raw=self.monitor.needs_raw_frames)
+                self.capture.start_capture(self.runtime.submit)
+                self.monitor.simulate = False
+                print("✅ 流量捕获已启动")
+            except Exception as e:
+                print(f"⚠️ 流量捕获启动失败: {e}")
+                print("💡 系统将使用模拟数据运行")
         
-        self.running = True
         print("✅ 系统启动完成")
         
     def _process_captured_packet(self, packet_info):
         """处理捕获的数据包"""
         parsed_packet = self.parser.parse_packet(packet_info)
-        # 这里可以添加实时处理逻辑
+        
+        # 按数据包时间戳归入事件时间窗口
+        self.monitor.observe_packet(packet_info)
         
     def show_dashboard(self):
-        """显示监控面板"""
-        while self.running:
-            print("\n" + "="*50)
-            print("📊 物联网安全监控面板")
-            print("="*50)
-            
-            # 显示设备统计
-            active_devices = self.monitor._get_active_devices()
-            print(f"🔗 活跃设备数量: {len(active_devices)}")
-            
-            for device_id in active_devices:
-                stats = self.monitor.get_device_statistics(device_id)
-                if stats:
-                    print(f"📱 {device_id}: 平均发送 {stats.get('avg_bytes_sent', 0):.1f} 字节")
-            
-            print("\n按 'q' 退出, 'v' 查看可视化, 'r' 刷新")
-            time.sleep(5)
+        """显示监控面板（由运行时定时调用）"""
+        if not self.running:
+            return
+        
+        print("\n" + "="*50)
+        print("📊 物联网安全监控面板")
+        print("="*50)
+        
+        # 显示设备统计（只显示最近活跃的设备）
+        print(f"🔗 活跃设备数量: {len(self.monitor.registry)}")
+        
+        for device_id in self.monitor._get_active_devices(self.config["visualization"]["max_display_devices"]):
+            stats = self.monitor.get_device_statistics(device_id)
+            if stats:
+                print(f"📱 {device_id}: 平均发送 {stats.get('avg_bytes_sent', 0):.1f} 字节")
+        
+        # 流量草图：Top-K 发送方和目标地址
+        summary = self.monitor.get_traffic_summary(5)
+        if summary["packets"]:
+            print(f"🌍 不同目标地址: ~{summary['distinct_destinations']}")
+            print("🔝 发送最多: " + ", ".join(f"{t['key']} ({t['count']} 字节)" for t in summary["top_talkers"]))
+            print("🎯 热门目标: " + ", ".join(f"{t.get('domain', t['key'])} ({t['count']} 包)" for t in summary["top_destinations"]))
+        
+        print("\n按 'q' 退出, 'v' 查看可视化, 'r' 刷新")
+    
+    def _auto_export(self):
+        """定时导出流量数据"""
+        filename = self.monitor.save_traffic_export()
+        print(f"💾 数据已自动导出: {filename}")
             
     def show_visualizations(self):
         """显示可视化图表"""
         print("📈 生成可视化图表...")
         
+        # 只复制最近活跃设备的历史引用，渲染时不持有监控锁
+        device_ids = self.monitor._get_active_devices(self.config["visualization"]["max_display_devices"])
+        with self.monitor._lock:
+            histories = {device_id: list(self.monitor.traffic_data[device_id])
+                         for device_id in device_ids if device_id in self.monitor.traffic_data}
+        
         # 设备流量对比
-        self.visualizer.plot_device_comparison(self.monitor.traffic_data)
+        self.visualizer.plot_device_comparison(histories)
+        
+        # 无界面模式下批量输出各设备的流量时间线
+        if self.visualizer.headless:
+            paths = self.visualizer.render_device_timelines(histories)
+            print(f"🖼️ 已生成 {len(paths)} 张设备时间线: {self.visualizer.output_dir}")
         
         # 异常检测结果
         anomaly_scores = {}
-        for device_id in self.monitor._get_active_devices():
+        for device_id in device_ids:
             if device_id in self.monitor.baseline_models:
                 # 获取最新的异常分数（这里简化处理）
                 anomaly_scores[device_id] = 0.05 + (hash(device_id) % 100) / 1000
@@ -79,20 +191,30 @@ class IoTSecuritySystem:
         print("🛑 正在停止系统...")
         self.running = False
         self.monitor.stop_monitoring()
-        self.capture.stop_capture()
+        if self.capture:
+            self.capture.stop_capture()
+        if self.aggregator:
+            self.aggregator.stop()
+        if self.web_dashboard:
+            self.web_dashboard.stop()
+        self.runtime.stop()
+        if self.config["checkpoint"]["enabled"] and self.mode != "collector":
+            self.checkpoints.save(self.monitor, wait=True)
+        self.monitor.close()
         print("✅ 系统已停止")
 
 if __name__ == "__main__":
-    system = IoTSecuritySystem()
+    arg_parser = argparse.ArgumentParser(description="物联网安全监控系统")
+    arg_parser.add_argument("--config", default="config.json", help="配置文件路径")
+    arg_parser.add_argument("--mode", choices=IoTSecuritySystem.MODES, default="standalone",
+                            help="运行模式")
+    args = arg_parser.parse_args()
+    
+    system = IoTSecuritySystem(args.config, args.mode)
     
     try:
         system.start_system()
         
-        # 启动面板显示线程
-        dashboard_thread = threading.Thread(target=system.show_dashboard)
-        dashboard_thread.daemon = True
-        dashboard_thread.start()
-        
         print("\n命令菜单:")
         print("- 输入 'v' 查看可视化图表")
         print("- 输入 'q' 退出系统")
@@ -0,0 +1,177 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from typing import Dict, Optional
+from sketches import hash64
+
+MB = 1024 * 1024
+
+
+def record_nbytes(record: Dict) -> int:
+    """估计一条历史窗口记录占用的字节数（字典本身加各个值，键是共享的字符串）"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+
+def history_nbytes(history) -> int:
+    """估计一个设备历史窗口队列的字节数（按第一条记录的大小外推）"""
+    if not history:
+        return sys.getsizeof(history)
+    return sys.getsizeof(history) + len(history) * record_nbytes(history[0])
+
+
+def model_nbytes(model) -> int:
+    """估计模型的字节数
+
+    树模型（IsolationForest）按节点数估计：每个节点约72字节，每棵树另有约1.9KB
+    的对象开销，与序列化大小相差在一成以内，但不必真的序列化。
+    其他模型按序列化后的大小估计。
+    """
+    estimators = getattr(model, "estimators_", None)
+    if estimators and hasattr(estimators[0], "tree_"):
+        features = sum(getattr(f, "nbytes", 0) for f in getattr(model, "estimators_features_", ()))
+        return sum(e.tree_.node_count * 72 + 1900 for e in estimators) + features
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class SpillStore:
+    """被挤出内存的设备数据的磁盘存储
+
+    每个设备一个 pickle 文件，取回时删除。溢出数据只属于当前进程：每个进程在
+    配置的目录下建一个独立的子目录，关闭时只删除自己的子目录，同一目录可以被
+    多个进程（监控、命令行报告、GUI）共用；重启后的恢复由检查点负责。
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="spill-", dir=directory)
+        self._files: Dict[str, str] = {}  # 设备ID -> 文件路径
+        self._sizes: Dict[str, int] = {}
+        self.disk_bytes = 0
+        self.lost = 0
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._files
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def put(self, device_id: str, payload: Dict):
+        """写入一个设备的数据（已存在时覆盖）"""
+        self.discard(device_id)
+        path = os.path.join(self.directory, f"{hash64(device_id):016x}.pkl")
+        with open(path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._files[device_id] = path
+        self._sizes[device_id] = os.path.getsize(path)
+        self.disk_bytes += self._sizes[device_id]
+
+    def take(self, device_id: str) -> Optional[Dict]:
+        """取回并删除一个设备的数据
+
+        文件丢失或损坏时返回 None，设备按冷启动处理（重新积累历史、重新训练）。
+        """
+        path = self._files.get(device_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            self.lost += 1
+            print(f"⚠️ 设备 {device_id} 的溢出数据无法读取，按冷启动处理: {e}")
+            return None
+        finally:
+            self.discard(device_id)
+
+    def discard(self, device_id: str):
+        """删除一个设备的数据"""
+        path = self._files.pop(device_id, None)
+        if path is None:
+            return
+        self.disk_bytes -= self._sizes.pop(device_id, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        """删除本进程的溢出子目录"""
+        self._files.clear()
+        self._sizes.clear()
+        self.disk_bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MemoryBudget:
+    """监控数据结构的全局内存预算
+
+    limit_bytes 为 0 表示不限制。超出预算时由监控按最久未活跃的顺序挤出设备的
+    历史窗口、模型和设备草图，直到回落到 low_water 比例以下；配置了 spill_dir
+    时挤出的数据写入磁盘，设备再次出现时取回，否则直接丢弃。
+    模型大小按对象缓存，模型不变时不重复计算。
+    """
+
+    def __init__(self, limit_bytes: int = 0, spill_dir: str = None, low_water: float = 0.9):
+        self.limit_bytes = limit_bytes
+        self.low_water = low_water
+        self.spill = SpillStore(spill_dir) if spill_dir else None
+        self.usage: Dict = {}  # 最近一次统计结果
+        self.evicted = 0
+        self.reloaded = 0
+        self._model_sizes: Dict[str, tuple] = {}  # 键 -> (id(模型), 字节数)
+
+    def close(self):
+        """释放磁盘溢出数据"""
+        if self.spill is not None:
+            self.spill.close()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit_bytes > 0
+
+    @property
+    def target_bytes(self) -> int:
+        """挤出数据时的目标用量"""
+        return int(self.limit_bytes * self.low_water)
+
+    def model_bytes(self, key: str, model) -> int:
+        """模型字节数（带缓存）"""
+        cached = self._model_sizes.get(key)
+        if cached is not None and cached[0] == id(model):
+            return cached[1]
+        size = model_nbytes(model)
+        self._model_sizes[key] = (id(model), size)
+        return size
+
+    def remember_model(self, key: str, model, size: int):
+        """登记已知大小的模型（从磁盘取回的模型不必重新序列化估计）"""
+        self._model_sizes[key] = (id(model), size)
+
+    def models_bytes(self, models: Dict, prefix: str) -> int:
+        """一组模型的字节数（缓存键加前缀区分），并清理已不存在的模型的缓存"""
+        total = sum(self.model_bytes(prefix + key, model) for key, model in models.items())
+        for key in [k for k in self._model_sizes if k.startswith(prefix) and k[len(prefix):] not in models]:
+            del self._model_sizes[key]
+        return total
+
+    def forget(self, device_id: str):
+        """设备被淘汰时清理缓存和溢出文件"""
+        self._model_sizes.pop(f"model:{device_id}", None)
+        if self.spill is not None:
+            self.spill.discard(device_id)
+
+    def record(self, structures: Dict[str, int]) -> Dict:
+        """保存一次统计结果"""
+        total = sum(structures.values())
+        self.usage = {
+            "limit_bytes": self.limit_bytes,
+            "total_bytes": total,
+            "structures": structures,
+            "evicted_devices": self.evicted,
+            "reloaded_devices": self.reloaded,
+            "spilled_devices": len(self.spill) if self.spill is not None else 0,
+            "spill_disk_bytes": self.spill.disk_bytes if self.spill is not None else 0
+        }
+        return self.usage
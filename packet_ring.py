@@ -0,0 +1,218 @@
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# pcap 文件格式（微秒精度，以太网链路层）
+_PCAP_HEADER = struct.Struct("<IHHiIII")
+_PCAP_RECORD = struct.Struct("<IIII")
+_PCAP_MAGIC = 0xA1B2C3D4
+_LINKTYPE_ETHERNET = 1
+_MIN_FRAME = 64  # 按最小帧长预分配索引槽位
+
+
+class PacketRing:
+    """单个设备的原始帧环形缓冲区
+
+    帧数据顺序写入一块预分配的 bytearray，索引（时间戳、偏移、长度）保存在
+    预分配的 array 中，追加一帧不创建任何对象；空间不足时覆盖最旧的帧。
+    帧超过 snaplen 时截断，pcap 中记录原始长度。
+    """
+
+    __slots__ = ("capacity", "slots", "snaplen", "data", "times", "offsets", "lengths",
+                 "orig_lengths", "start", "count", "write_pos")
+
+    def __init__(self, capacity: int = 262144, snaplen: int = 1514):
+        self.capacity = capacity
+        self.slots = max(16, capacity // _MIN_FRAME)
+        self.snaplen = min(snaplen, capacity)
+        self.data = bytearray(capacity)
+        self.times = array("d", bytes(8 * self.slots))
+        self.offsets = array("I", bytes(4 * self.slots))
+        self.lengths = array("I", bytes(4 * self.slots))
+        self.orig_lengths = array("I", bytes(4 * self.slots))
+        self.start = 0  # 最旧一帧的槽位
+        self.count = 0
+        self.write_pos = 0
+
+    def append(self, timestamp: float, frame: bytes):
+        """追加一帧"""
+        length = min(len(frame), self.snaplen)
+        pos = self.write_pos
+        if pos + length > self.capacity:
+            # 尾部放不下时回到开头，尾部剩余的帧都是最旧的，先丢弃
+            while self.count and self.offsets[self.start] >= pos:
+                self._drop_oldest()
+            pos = 0
+
+        # 丢弃与新帧区域重叠的最旧帧，槽位用完时也丢弃最旧帧
+        end = pos + length
+        while self.count:
+            offset = self.offsets[self.start]
+            if self.count < self.slots and (offset >= end or offset + self.lengths[self.start] <= pos):
+                break
+            self._drop_oldest()
+
+        slot = (self.start + self.count) % self.slots
+        self.data[pos:end] = frame[:length]
+        self.times[slot] = timestamp
+        self.offsets[slot] = pos
+        self.lengths[slot] = length
+        self.orig_lengths[slot] = len(frame)
+        self.count += 1
+        self.write_pos = end
+
+    def _drop_oldest(self):
+        self.start = (self.start + 1) % self.slots
+        self.count -= 1
+
+    def snapshot(self, since: float = None) -> List[Tuple[float, bytes, int]]:
+        """复制出缓冲区中的帧 (时间戳, 帧数据, 原始长度)，since 之前的帧不复制"""
+        frames = []
+        for i in range(self.count):
+            slot = (self.start + i) % self.slots
+            timestamp = self.times[slot]
+            if since is not None and timestamp < since:
+                continue
+            offset = self.offsets[slot]
+            frames.append((timestamp, bytes(self.data[offset:offset + self.lengths[slot]]),
+                           self.orig_lengths[slot]))
+        return frames
+
+    @property
+    def nbytes(self) -> int:
+        """占用的内存字节数（预分配，固定）"""
+        return self.capacity + self.slots * 20 + 200
+
+
+def write_pcap(path: str, frames: List[Tuple[float, bytes, int]], snaplen: int = 65535):
+    """把帧写入 pcap 文件"""
+    with open(path, "wb") as f:
+        f.write(_PCAP_HEADER.pack(_PCAP_MAGIC, 2, 4, 0, 0, snaplen, _LINKTYPE_ETHERNET))
+        for timestamp, frame, orig_length in frames:
+            seconds = int(timestamp)
+            f.write(_PCAP_RECORD.pack(seconds, int((timestamp - seconds) * 1_000_000),
+                                      len(frame), orig_length))
+            f.write(frame)
+
+
+class PacketRecorder:
+    """按设备保留最近的原始帧，告警时导出为 pcap
+
+    每个设备一个 PacketRing（首次见到时分配），总内存不超过 total_bytes：
+    环形缓冲区数量达到上限时回收最久未活动设备的缓冲区。dump 在调用线程中
+    只复制最近 retention 秒的帧，写文件由后台线程完成，不阻塞检测；
+    同一设备 min_interval 秒内的重复告警共用上一次导出的文件。
+    """
+
+    def __init__(self, output_dir: str = "evidence", ring_bytes: int = 262144,
+                 total_bytes: int = 64 * 1024 * 1024, retention: float = 120.0,
+                 snaplen: int = 1514, min_interval: float = 60.0):
+        self.output_dir = output_dir
+        self.ring_bytes = ring_bytes
+        self.max_rings = max(1, total_bytes // ring_bytes)
+        self.retention = retention
+        self.snaplen = snaplen
+        self.min_interval = min_interval
+        self.dumps = 0
+        self._rings: "OrderedDict[str, PacketRing]" = OrderedDict()
+        self._last_dump: Dict[str, Tuple[float, str]] = {}  # 设备 -> (导出时最新帧时间, 文件路径)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="pcap-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, device_id: str, timestamp: float, frame: bytes):
+        """记录一帧"""
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                if len(self._rings) >= self.max_rings:
+                    # 复用最久未活动设备的缓冲区，不重新分配内存
+                    evicted, ring = self._rings.popitem(last=False)
+                    self._last_dump.pop(evicted, None)
+                    ring.start = ring.count = ring.write_pos = 0
+                else:
+                    ring = PacketRing(self.ring_bytes, self.snaplen)
+                self._rings[device_id] = ring
+            else:
+                self._rings.move_to_end(device_id)
+            ring.append(timestamp, frame)
+
+    def dump(self, device_id: str, label: str = "alert", timestamp: float = None) -> Optional[str]:
+        """把设备最近 retention 秒的帧导出为 pcap，返回文件路径（没有数据时返回 None）
+
+        截止时间以缓冲区中最新一帧为准，回放和实时抓包都适用。
+        """
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None or not ring.count:
+                return None
+            latest = ring.times[(ring.start + ring.count - 1) % ring.slots]
+            previous = self._last_dump.get(device_id)
+            if previous is not None and latest - previous[0] < self.min_interval:
+                return previous[1]
+            frames = ring.snapshot(since=latest - self.retention)
+
+        timestamp = timestamp or latest
+        name = re.sub(r"[^\w.-]", "_", f"{device_id}_{label}")
+        path = os.path.join(self.output_dir,
+                            f"{name}_{datetime.fromtimestamp(timestamp).strftime('%Y%m%d_%H%M%S')}.pcap")
+        with self._lock:
+            self._last_dump[device_id] = (latest, path)
+        self._queue.put((path, frames))
+        self.dumps += 1
+        return path
+
+    def _write_loop(self):
+        """后台写 pcap 文件"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, frames = item
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                write_pcap(path, frames, self.snaplen)
+                print(f"📦 已导出 {len(frames)} 个数据包: {path}")
+            except OSError as e:
+                print(f"⚠️ pcap 导出失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """等待已提交的导出写完"""
+        self._queue.join()
+
+    def remove(self, device_id: str):
+        """设备被淘汰时释放其缓冲区"""
+        with self._lock:
+            self._rings.pop(device_id, None)
+            self._last_dump.pop(device_id, None)
+
+    def stop(self):
+        """写完剩余的导出并停止写线程"""
+        self._queue.put(None)
+        self._writer.join()
+
+    @property
+    def nbytes(self) -> int:
+        """占用的内存字节数"""
+        with self._lock:
+            return sys.getsizeof(self._rings) + sum(ring.nbytes for ring in self._rings.values())
+
+    def get_status(self) -> Dict:
+        """获取状态"""
+        return {
+            "devices": len(self._rings),
+            "max_devices": self.max_rings,
+            "ring_bytes": self.ring_bytes,
+            "retention_seconds": self.retention,
+            "dumps": self.dumps
+        }
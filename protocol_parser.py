@@ -15,6 +15,7 @@ class ProtocolParser:
             25: "SMTP",
             53: "DNS",
             1883: "MQTT",
+            8883: "MQTTS",
             5683: "CoAP"
         }
         
@@ -0,0 +1,397 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+
+class Summary:
+    """一组窗口的累计统计，可以合并
+
+    每个特征只保存数量、和、平方和、最小值和最大值，加入一个窗口或合并两个汇总
+    都是 O(特征数)，与窗口数量无关；另外统计告警数量（按严重程度和类型）和最高分数。
+    """
+
+    __slots__ = ("windows", "total", "squares", "low", "high", "by_severity", "by_type", "max_score")
+
+    def __init__(self, n_features: int):
+        self.windows = 0
+        self.total = np.zeros(n_features)
+        self.squares = np.zeros(n_features)
+        self.low = np.full(n_features, np.inf)
+        self.high = np.full(n_features, -np.inf)
+        self.by_severity: Dict[str, int] = {}
+        self.by_type: Dict[str, int] = {}
+        self.max_score = 0.0
+
+    def add(self, vector: np.ndarray):
+        """加入一个窗口的特征向量"""
+        self.windows += 1
+        self.total += vector
+        self.squares += vector * vector
+        np.minimum(self.low, vector, out=self.low)
+        np.maximum(self.high, vector, out=self.high)
+
+    def add_alert(self, severity: str, alert_type: str, score: float):
+        """计入一条告警"""
+        self.by_severity[severity] = self.by_severity.get(severity, 0) + 1
+        self.by_type[alert_type] = self.by_type.get(alert_type, 0) + 1
+        self.max_score = max(self.max_score, score)
+
+    def merge(self, other: "Summary"):
+        """合并另一个汇总"""
+        self.windows += other.windows
+        self.total += other.total
+        self.squares += other.squares
+        np.minimum(self.low, other.low, out=self.low)
+        np.maximum(self.high, other.high, out=self.high)
+        for severity, count in other.by_severity.items():
+            self.by_severity[severity] = self.by_severity.get(severity, 0) + count
+        for alert_type, count in other.by_type.items():
+            self.by_type[alert_type] = self.by_type.get(alert_type, 0) + count
+        self.max_score = max(self.max_score, other.max_score)
+
+    def copy(self) -> "Summary":
+        summary = Summary(len(self.total))
+        summary.merge(self)
+        return summary
+
+    def to_dict(self, feature_names: List[str]) -> Dict:
+        """转换为报告中的字典（均值、标准差、最小值、最大值）"""
+        result = {
+            "windows": self.windows,
+            "alerts": sum(self.by_severity.values()),
+            "by_severity": dict(self.by_severity),
+            "by_type": dict(self.by_type),
+            "max_score": round(float(self.max_score), 4)
+        }
+        if self.windows:
+            mean = self.total / self.windows
+            std = np.sqrt(np.maximum(self.squares / self.windows - mean * mean, 0.0))
+            result["features"] = {
+                name: {"mean": round(float(mean[i]), 4), "std": round(float(std[i]), 4),
+                       "min": round(float(self.low[i]), 4), "max": round(float(self.high[i]), 4)}
+                for i, name in enumerate(feature_names)
+            }
+        return result
+
+
+class ReportEngine:
+    """增量报告引擎
+
+    窗口关闭和告警触发时更新当前小时的设备汇总和全体汇总（事件时间）。
+    窗口时间进入下一个小时时，上一小时的汇总合并到当天的汇总，连同设备汇总
+    一起交给后台写线程生成小时报告；跨天时同样生成日报告。日报告中的全体汇总
+    和逐小时趋势都是已经合并好的，生成时间与原始历史的长度无关。
+
+    报告按设备逐条流式写入临时文件，写完后原子替换，不在内存中拼出整个 JSON。
+    写报告时由 context_source(开始时间戳, 结束时间戳) 附加流量摘要和报告时段内的
+    警报汇总，由 device_source(设备ID) 附加每个设备的统计信息（都在写线程中调用）。
+    最近 history_hours 个小时和 history_days 天的全体汇总保留在内存中供查询。
+
+    汇总随检查点保存（get_state/set_state）；从检查点恢复时，检查点时间到恢复时间
+    之间没有计入的时段作为 gaps 写入当前小时和当天的报告。
+    """
+
+    def __init__(self, feature_names: List[str], output_dir: str = "reports",
+                 history_hours: int = 48, history_days: int = 31,
+                 context_source: Callable[[float, Optional[float]], Dict] = None,
+                 device_source: Callable[[str], Dict] = None):
+        self.feature_names = list(feature_names)
+        self.output_dir = output_dir
+        self.context_source = context_source
+        self.device_source = device_source
+        self.hourly = deque(maxlen=history_hours)  # (小时开始时间, 全体汇总)
+        self.daily = deque(maxlen=history_days)  # (日期开始时间, 全体汇总)
+        self.late_windows = 0
+        self.reports_written = 0
+        self._hour_start: Optional[datetime] = None
+        self._hour_begin = self._hour_end = float("-inf")  # 当前小时的时间戳范围
+        self._hour_fleet = Summary(len(self.feature_names))
+        self._hour_devices: Dict[str, Summary] = {}
+        self._day_fleet = Summary(len(self.feature_names))
+        self._day_devices: Dict[str, Summary] = {}
+        self._hour_gaps: List[Dict] = []  # 重启造成的未统计时段
+        self._day_gaps: List[Dict] = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="report-writer", daemon=True)
+        self._writer.start()
+
+    def observe_window(self, device_id: str, timestamp: float, stats: Dict):
+        """计入一个已关闭的设备窗口"""
+        vector = np.array([stats.get(name, 0.0) for name in self.feature_names], dtype=float)
+        with self._lock:
+            if timestamp >= self._hour_end:
+                self._roll(timestamp)
+            elif timestamp < self._hour_begin:
+                self.late_windows += 1  # 上一小时的迟到窗口计入当前小时
+            self._device(device_id).add(vector)
+            self._hour_fleet.add(vector)
+
+    def observe_alert(self, alert: Dict):
+        """计入一条告警（计入当前小时，不推进小时）"""
+        with self._lock:
+            if self._hour_start is None:
+                return
+            score = float(alert.get("anomaly_score") or 0.0)
+            self._device(alert["device_id"]).add_alert(alert["severity"], alert["alert_type"], score)
+            self._hour_fleet.add_alert(alert["severity"], alert["alert_type"], score)
+
+    def _device(self, device_id: str) -> Summary:
+        summary = self._hour_devices.get(device_id)
+        if summary is None:
+            summary = self._hour_devices[device_id] = Summary(len(self.feature_names))
+        return summary
+
+    def _roll(self, timestamp: float):
+        """结束当前小时（必要时结束当天），开始 timestamp 所在的小时"""
+        hour_start = datetime.fromtimestamp(timestamp).replace(minute=0, second=0, microsecond=0)
+        if self._hour_start is not None:
+            self._close_hour()
+            if hour_start.date() != self._hour_start.date():
+                self._close_day()
+        self._hour_start = hour_start
+        self._hour_begin = hour_start.timestamp()
+        self._hour_end = (hour_start + timedelta(hours=1)).timestamp()
+
+    def _close_hour(self, partial: bool = False):
+        """当前小时的汇总并入当天，提交小时报告"""
+        fleet, devices = self._hour_fleet, self._hour_devices
+        for device_id, summary in devices.items():
+            day = self._day_devices.get(device_id)
+            if day is None:
+                self._day_devices[device_id] = summary.copy()
+            else:
+                day.merge(summary)
+        self._day_fleet.merge(fleet)
+        if not partial:
+            self.hourly.append((self._hour_start, fleet))
+        self._submit("hour", self._hour_start, fleet, devices, partial=partial, gaps=self._hour_gaps)
+        self._hour_fleet = Summary(len(self.feature_names))
+        self._hour_devices = {}
+        self._hour_gaps = []
+
+    def _close_day(self, partial: bool = False):
+        """提交日报告（附当天逐小时的全体汇总）"""
+        day_start = self._hour_start.replace(hour=0)
+        trend = [(start, fleet) for start, fleet in self.hourly if start.date() == day_start.date()]
+        if not partial:
+            self.daily.append((day_start, self._day_fleet))
+        self._submit("day", day_start, self._day_fleet, self._day_devices, trend,
+                     partial=partial, gaps=self._day_gaps)
+        self._day_fleet = Summary(len(self.feature_names))
+        self._day_devices = {}
+        self._day_gaps = []
+
+    def _submit(self, period: str, start: datetime, fleet: Summary, devices: Dict[str, Summary],
+                trend: List = None, partial: bool = False, gaps: List[Dict] = None):
+        """把一份报告交给写线程（汇总对象交出后不再修改）"""
+        if period == "hour":
+            name = f"iot_report_hour_{start.strftime('%Y%m%d_%H')}"
+        else:
+            name = f"iot_report_day_{start.strftime('%Y%m%d')}"
+        if partial:
+            name += "_partial"
+        header = {"period": period, "start": start.isoformat(), "partial": partial}
+        if gaps:
+            header["gaps"] = list(gaps)
+        self._queue.put((os.path.join(self.output_dir, name + ".json"), header, fleet, devices, trend, None))
+
+    def request_report(self, header: Dict = None, on_done: Callable[[Optional[str], Optional[str]], None] = None):
+        """生成一份当前报告（当天截至目前的全体和设备汇总）
+
+        复制汇总和写文件都在写线程中进行，调用方立即返回；完成后在写线程中调用
+        on_done(文件路径, 错误信息)。
+        """
+        self._queue.put(("snapshot", header, on_done))
+
+    def get_state(self) -> Dict:
+        """导出检查点所需的汇总（复制，之后的更新不影响导出结果）"""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "hour_start": self._hour_start,
+                "hour_fleet": self._hour_fleet.copy(),
+                "hour_devices": {device_id: summary.copy() for device_id, summary in self._hour_devices.items()},
+                "day_fleet": self._day_fleet.copy(),
+                "day_devices": {device_id: summary.copy() for device_id, summary in self._day_devices.items()},
+                "hour_gaps": list(self._hour_gaps),
+                "day_gaps": list(self._day_gaps),
+                "hourly": list(self.hourly),
+                "daily": list(self.daily),
+                "late_windows": self.late_windows
+            }
+
+    def set_state(self, state: Dict):
+        """从检查点恢复汇总，并把检查点之后到现在的时段记为未统计"""
+        if len(state["hour_fleet"].total) != len(self.feature_names):
+            print("⚠️ 检查点中的报告汇总特征数不一致，已忽略")
+            return
+        with self._lock:
+            self._hour_start = state["hour_start"]
+            if self._hour_start is not None:
+                self._hour_begin = self._hour_start.timestamp()
+                self._hour_end = (self._hour_start + timedelta(hours=1)).timestamp()
+            self._hour_fleet = state["hour_fleet"]
+            self._hour_devices = state["hour_devices"]
+            self._day_fleet = state["day_fleet"]
+            self._day_devices = state["day_devices"]
+            self.hourly.extend(state["hourly"])
+            self.daily.extend(state["daily"])
+            self.late_windows = state["late_windows"]
+            gap = {"from": datetime.fromtimestamp(state["timestamp"]).isoformat(),
+                   "to": datetime.now().isoformat(), "reason": "restart"}
+            self._hour_gaps = state["hour_gaps"] + [gap]
+            self._day_gaps = state["day_gaps"] + [gap]
+
+    def _snapshot(self) -> tuple:
+        """当天截至目前的汇总（已结束的小时 + 当前小时）"""
+        with self._lock:
+            fleet = self._day_fleet.copy()
+            fleet.merge(self._hour_fleet)
+            devices = {device_id: summary.copy() for device_id, summary in self._day_devices.items()}
+            for device_id, summary in self._hour_devices.items():
+                if device_id in devices:
+                    devices[device_id].merge(summary)
+                else:
+                    devices[device_id] = summary.copy()
+            trend = list(self.hourly)
+            if self._hour_start is not None:
+                trend = [(start, summary) for start, summary in trend if start.date() == self._hour_start.date()]
+            gaps = self._day_gaps + [gap for gap in self._hour_gaps if gap not in self._day_gaps]
+            return fleet, devices, trend, gaps
+
+    def fleet_summary(self, period: str = "day") -> Dict:
+        """当前小时或当天截至目前的全体汇总（O(特征数)）"""
+        with self._lock:
+            if period == "hour":
+                fleet = self._hour_fleet
+                devices = len(self._hour_devices)
+            else:
+                fleet = self._day_fleet.copy()
+                fleet.merge(self._hour_fleet)
+                devices = len(self._day_devices.keys() | self._hour_devices.keys())
+            return {"devices": devices, **fleet.to_dict(self.feature_names)}
+
+    def _write_loop(self):
+        """后台写报告（单个报告出错时记录并继续，保证 flush 不会一直等待）"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            on_done = item[-1]
+            path = error = None
+            try:
+                if item[0] == "snapshot":
+                    _, header, _ = item
+                    fleet, devices, trend, gaps = self._snapshot()
+                    start = datetime.now()
+                    path = os.path.join(self.output_dir,
+                                        f"iot_security_report_{start.strftime('%Y%m%d_%H%M%S')}.json")
+                    header = {"period": "current", "start": start.isoformat(), **(header or {})}
+                    if gaps:
+                        header["gaps"] = gaps
+                else:
+                    path, header, fleet, devices, trend, _ = item
+                if self.context_source is not None:
+                    header = {**header, **self.context_source(*self._period_range(header))}
+                self._write(path, header, fleet, devices, trend)
+                self.reports_written += 1
+                print(f"📄 报告已生成: {path} ({len(devices)} 个设备)")
+            except Exception as e:
+                error = str(e)
+                print(f"⚠️ 报告写入失败: {e}")
+            finally:
+                self._queue.task_done()
+            if on_done is not None:
+                try:
+                    on_done(path, error)
+                except Exception as e:
+                    print(f"⚠️ 报告完成回调出错: {e}")
+
+    @staticmethod
+    def _period_range(header: Dict) -> tuple:
+        """报告覆盖的时间戳范围（当前报告为当天零点到现在）"""
+        start = datetime.fromisoformat(header["start"])
+        if header["period"] == "hour":
+            return start.timestamp(), (start + timedelta(hours=1)).timestamp()
+        if header["period"] == "day":
+            return start.timestamp(), (start + timedelta(days=1)).timestamp()
+        return start.replace(hour=0, minute=0, second=0, microsecond=0).timestamp(), None
+
+    def _write(self, path: str, header: Dict, fleet: Summary, devices: Dict[str, Summary], trend: List = None):
+        """写入临时文件后原子替换，失败时删除临时文件"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp = path + ".tmp"
+        try:
+            self._write_stream(temp, header, fleet, devices, trend)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        os.replace(temp, path)
+
+    def _write_stream(self, temp: str, header: Dict, fleet: Summary, devices: Dict[str, Summary],
+                      trend: List = None):
+        """逐个设备流式写出 JSON 报告"""
+        names = self.feature_names
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write("{\n")
+            for key, value in header.items():
+                f.write(f"  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False, default=str)},\n")
+            f.write(f'  "fleet": {json.dumps({"devices": len(devices), **fleet.to_dict(names)})},\n')
+            if trend is not None:
+                f.write('  "hourly": [')
+                f.write(",".join(f'\n    {json.dumps({"start": start.isoformat(), **summary.to_dict(names)})}'
+                                 for start, summary in trend))
+                f.write("\n  ],\n")
+            f.write('  "devices": {')
+            for i, (device_id, summary) in enumerate(devices.items()):
+                entry = summary.to_dict(names)
+                if self.device_source is not None:
+                    statistics = self.device_source(device_id)
+                    if statistics:
+                        entry["statistics"] = statistics
+                f.write(f'{"," if i else ""}\n    {json.dumps(device_id, ensure_ascii=False)}: '
+                        f'{json.dumps(entry, ensure_ascii=False, default=str)}')
+            f.write("\n  }\n}\n")
+
+    def flush(self):
+        """等待已提交的报告写完"""
+        self._queue.join()
+
+    def stop(self):
+        """写出当前小时和当天的部分报告，写完后停止写线程"""
+        with self._lock:
+            if self._hour_start is not None and self._hour_fleet.windows:
+                self._close_hour(partial=True)
+                self._close_day(partial=True)
+        self._queue.put(None)
+        self._writer.join()
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数"""
+        per_summary = 4 * len(self.feature_names) * 8 + 600
+        with self._lock:
+            summaries = (len(self._hour_devices) + len(self._day_devices) + 2
+                         + len(self.hourly) + len(self.daily))
+        return sys.getsizeof(self._hour_devices) + sys.getsizeof(self._day_devices) + summaries * per_summary
+
+    def get_status(self) -> Dict:
+        """获取状态"""
+        return {
+            "hour_start": self._hour_start.isoformat() if self._hour_start is not None else None,
+            "hour_devices": len(self._hour_devices),
+            "day_devices": len(self._day_devices),
+            "late_windows": self.late_windows,
+            "reports_written": self.reports_written,
+            "pending": self._queue.qsize()
+        }
@@ -0,0 +1,377 @@
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+ISOLATE = "isolate"
+RELEASE = "release"
+
+
+class ActionBackend:
+    """响应动作后端基类
+
+    execute 必须在 timeout 秒内返回，失败时抛出异常（由分发器重试）。
+    idempotency_key 在同一动作的所有重试中保持不变，后端可以据此去重。
+    """
+
+    def execute(self, action: str, device_id: str, params: Dict,
+                idempotency_key: str, timeout: float) -> Dict:
+        raise NotImplementedError
+
+
+class LogBackend(ActionBackend):
+    """只打印动作，不调用任何外部系统（默认后端）"""
+
+    def execute(self, action: str, device_id: str, params: Dict,
+                idempotency_key: str, timeout: float) -> Dict:
+        if action == ISOLATE:
+            print(f"⚠️ 自动响应: 设备 {device_id} 已被临时隔离")
+        elif action == RELEASE:
+            print(f"✅ 自动响应: 设备 {device_id} 已解除隔离")
+        return {"status": "ok"}
+
+
+class HttpBackend(ActionBackend):
+    """调用HTTP隔离接口：POST {base_url}/{action}，请求头带 Idempotency-Key"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    def execute(self, action: str, device_id: str, params: Dict,
+                idempotency_key: str, timeout: float) -> Dict:
+        body = json.dumps({"device_id": device_id, **params}, ensure_ascii=False, default=str)
+        request = urllib.request.Request(f"{self.base_url}/{action}", data=body.encode("utf-8"),
+                                         method="POST",
+                                         headers={"Content-Type": "application/json",
+                                                  "Idempotency-Key": idempotency_key})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else {}
+
+
+class _Task:
+    """一个待执行的动作（重试时复用同一个对象和幂等键）"""
+
+    __slots__ = ("action", "device_id", "params", "key", "attempts", "rollback_after")
+
+    def __init__(self, action: str, device_id: str, params: Dict, key: str, rollback_after: float):
+        self.action = action
+        self.device_id = device_id
+        self.params = params
+        self.key = key
+        self.attempts = 0
+        self.rollback_after = rollback_after
+
+
+class ActionDispatcher:
+    """自动响应动作分发器
+
+    检测线程只把动作放入有界队列，由固定数量的工作线程调用后端，慢请求或挂起的
+    请求不会阻塞检测。每次调用有超时，失败后按指数退避重试；同一设备同一动作在
+    执行中或已生效（已隔离）时重复提交会被忽略。隔离成功后按 rollback_after
+    自动解除隔离。重试和解除隔离由一个调度线程按时间触发。
+
+    指定 state_file 时，已隔离设备和解除隔离的到期时间在每次变化时原子写入该文件，
+    启动时读回并重新安排解除隔离（停止期间已到期的立即解除），进程重启不会让设备
+    一直处于隔离状态。
+    """
+
+    def __init__(self, backend: ActionBackend = None, workers: int = 4, timeout: float = 5.0,
+                 max_retries: int = 3, backoff: float = 1.0, rollback_after: float = 0,
+                 queue_size: int = 1000, on_result: Callable[[Dict], None] = None,
+                 state_file: str = None):
+        self.backend = backend or LogBackend()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rollback_after = rollback_after  # 0 表示不自动解除隔离
+        self.on_result = on_result
+
+        self.isolated: Dict[str, float] = {}  # 设备ID -> 隔离生效时间
+        self.releases: Dict[str, float] = {}  # 设备ID -> 自动解除隔离的时间
+        self.state_file = state_file
+        self.history = deque(maxlen=200)
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "retried": 0,
+                      "duplicates": 0, "dropped": 0}
+        self._pending = set()  # 执行中（含等待重试）的 (动作, 设备)
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._schedule = []  # (触发时间, 序号, 任务)
+        self._schedule_cond = threading.Condition(self._lock)
+        self._running = True
+        self._load_state()
+
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"response-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        self._scheduler = threading.Thread(target=self._scheduler_loop, name="response-scheduler", daemon=True)
+        for thread in self._workers:
+            thread.start()
+        self._scheduler.start()
+
+    def submit(self, action: str, device_id: str, params: Dict = None,
+               rollback_after: float = None) -> bool:
+        """提交一个动作（不阻塞），被忽略或队列已满时返回 False"""
+        with self._lock:
+            if not self._running:
+                return False
+            if (action, device_id) in self._pending or (action == ISOLATE and device_id in self.isolated):
+                self.stats["duplicates"] += 1
+                return False
+            if action == RELEASE and device_id not in self.isolated:
+                return False
+
+            key = f"{action}:{device_id}:{next(self._sequence)}"
+            task = _Task(action, device_id, params or {}, key,
+                         self.rollback_after if rollback_after is None else rollback_after)
+            try:
+                self._queue.put_nowait(task)
+            except queue.Full:
+                self.stats["dropped"] += 1
+                return False
+            self._pending.add((action, device_id))
+            self.stats["submitted"] += 1
+            return True
+
+    def _worker_loop(self):
+        """工作线程：执行动作"""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            self._execute(task)
+
+    def _execute(self, task: _Task):
+        """调用后端，处理成功、重试和最终失败"""
+        task.attempts += 1
+        try:
+            response = self.backend.execute(task.action, task.device_id, task.params,
+                                            task.key, self.timeout)
+        except Exception as e:
+            with self._lock:
+                if task.attempts <= self.max_retries and self._running:
+                    self.stats["retried"] += 1
+                    self._schedule_task(time.time() + self.backoff * 2 ** (task.attempts - 1), task)
+                    return
+                self._pending.discard((task.action, task.device_id))
+                self.stats["failed"] += 1
+            self._record(task, "failed", str(e))
+            return
+
+        with self._lock:
+            self._pending.discard((task.action, task.device_id))
+            self.stats["succeeded"] += 1
+            if task.action == ISOLATE:
+                self.isolated[task.device_id] = time.time()
+                if task.rollback_after:
+                    self._schedule_release(task.device_id, time.time() + task.rollback_after)
+            elif task.action == RELEASE:
+                self.isolated.pop(task.device_id, None)
+                self.releases.pop(task.device_id, None)
+            self._save_state()
+        self._record(task, "succeeded", response)
+
+    def _schedule_release(self, device_id: str, due: float):
+        """安排到期自动解除隔离（调用方持有锁）"""
+        release = _Task(RELEASE, device_id, {"reason": "rollback"},
+                        f"{RELEASE}:{device_id}:{next(self._sequence)}", 0)
+        self.releases[device_id] = due
+        self._pending.add((RELEASE, device_id))
+        self._schedule_task(due, release)
+
+    def _load_state(self):
+        """读取上次运行保存的隔离状态，重新安排解除隔离"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 隔离状态文件读取失败: {e}")
+            return
+        with self._lock:
+            self.isolated.update(state.get("isolated", {}))
+            for device_id, due in state.get("releases", {}).items():
+                if device_id in self.isolated:
+                    self._schedule_release(device_id, due)
+        if self.isolated:
+            print(f"♻️ 已恢复 {len(self.isolated)} 个隔离设备，其中 {len(self.releases)} 个将按时解除隔离")
+
+    def _save_state(self):
+        """原子写入隔离状态（调用方持有锁）"""
+        if not self.state_file:
+            return
+        temp = self.state_file + ".tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump({"isolated": self.isolated, "releases": self.releases}, f)
+            os.replace(temp, self.state_file)
+        except OSError as e:
+            print(f"⚠️ 隔离状态保存失败: {e}")
+
+    def _schedule_task(self, due: float, task: _Task):
+        """安排任务在指定时间进入队列（调用方持有锁）"""
+        heapq.heappush(self._schedule, (due, next(self._sequence), task))
+        self._schedule_cond.notify()
+
+    def _scheduler_loop(self):
+        """调度线程：到期的重试和解除隔离任务放回队列"""
+        with self._lock:
+            while self._running:
+                if not self._schedule:
+                    self._schedule_cond.wait()
+                    continue
+                due, _, task = self._schedule[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self._schedule_cond.wait(delay)
+                    continue
+                heapq.heappop(self._schedule)
+                try:
+                    self._queue.put_nowait(task)
+                except queue.Full:
+                    # 队列满时稍后再试，不丢弃重试和解除隔离
+                    heapq.heappush(self._schedule, (time.time() + 1.0, next(self._sequence), task))
+
+    def _record(self, task: _Task, status: str, detail):
+        """记录执行结果"""
+        result = {
+            "timestamp": time.time(),
+            "action": task.action,
+            "device_id": task.device_id,
+            "idempotency_key": task.key,
+            "attempts": task.attempts,
+            "status": status,
+            "detail": detail
+        }
+        self.history.append(result)
+        if self.on_result:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                print(f"响应结果处理错误: {e}")
+
+    def release(self, device_id: str) -> bool:
+        """手动解除隔离"""
+        return self.submit(RELEASE, device_id, {"reason": "manual"})
+
+    def stop(self, timeout: float = 5.0):
+        """停止分发器；已隔离的设备保持隔离
+
+        未到期的自动解除隔离保存在状态文件中，下次启动时重新安排；
+        没有配置状态文件时会被丢弃。
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            if self._schedule:
+                kept = "，解除隔离已保存，下次启动时恢复" if self.state_file and self.releases else ""
+                print(f"⚠️ 响应分发器停止时仍有 {len(self._schedule)} 个待执行的重试/解除隔离{kept}")
+            self._schedule.clear()
+            self._schedule_cond.notify_all()
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for thread in self._workers + [self._scheduler]:
+            thread.join(max(0.0, deadline - time.time()))
+
+    def get_status(self) -> Dict:
+        """获取分发器状态"""
+        with self._lock:
+            return {
+                **self.stats,
+                "queued": self._queue.qsize(),
+                "pending": len(self._pending),
+                "scheduled": len(self._schedule),
+                "isolated_devices": sorted(self.isolated),
+                "scheduled_releases": dict(self.releases)
+            }
+
+
+class ActionStubServer:
+    """本地HTTP隔离接口桩（用于测试 HttpBackend）
+
+    接受 POST /isolate 和 /release，按 Idempotency-Key 去重并记录收到的请求；
+    可以设置响应延迟和前若干次请求失败，用来验证超时和重试。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8099, delay: float = 0.0, fail_first: int = 0):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests = []
+        self.isolated = set()
+        self._seen_keys = set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, payload = stub._handle(self.path.strip("/"), body, self.headers.get("Idempotency-Key"))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def _handle(self, action: str, body: Dict, key: str):
+        """处理一个请求，返回 (HTTP状态码, 响应)"""
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.requests.append({"action": action, "key": key, **body})
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return 503, {"status": "error"}
+            if action not in (ISOLATE, RELEASE):
+                return 404, {"status": "unknown action"}
+            duplicate = key in self._seen_keys
+            self._seen_keys.add(key)
+            if action == ISOLATE:
+                self.isolated.add(body.get("device_id"))
+            else:
+                self.isolated.discard(body.get("device_id"))
+            return 200, {"status": "ok", "duplicate": duplicate}
+
+    def start(self):
+        """在后台线程中启动"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="action-stub", daemon=True)
+        self._thread.start()
+        print(f"🧪 响应接口桩: http://127.0.0.1:{self.port}/")
+
+    def stop(self):
+        """停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_dispatcher(security: Dict, on_result: Callable[[Dict], None] = None) -> ActionDispatcher:
+    """根据配置的 security 部分创建分发器"""
+    if security.get("response_backend") == "http":
+        backend = HttpBackend(security["response_url"])
+    else:
+        backend = LogBackend()
+    return ActionDispatcher(backend,
+                            workers=security.get("response_workers", 4),
+                            timeout=security.get("response_timeout", 5.0),
+                            max_retries=security.get("response_retries", 3),
+                            rollback_after=security.get("isolation_duration", 0),
+                            on_result=on_result,
+                            state_file=security.get("isolation_state_file"))
@@ -6,11 +6,12 @@
 
 import sys
 import os
+import importlib.util
 import tkinter as tk
 from tkinter import messagebox
 
 def check_dependencies():
-    """检查依赖库"""
+    """检查依赖库（只查找模块，不实际导入）"""
     required_modules = [
         'numpy', 'sklearn', 'matplotlib', 'tkinter'
     ]
@@ -18,9 +19,7 @@ def check_dependencies():
     missing_modules = []
     
     for module in required_modules:
-        try:
-            __import__(module)
-        except ImportError:
+        if importlib.util.find_spec(module) is None:
             missing_modules.append(module)
     
     if missing_modules:
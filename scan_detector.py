@@ -0,0 +1,181 @@
+import math
+import sys
+from collections import OrderedDict
+from typing import Dict, List
+from sketches import hash64
+from windowing import is_local_address
+
+# 三种行为：纵向扫描（同一来源的不同目标端口）、横向扫描（不同目标主机）、
+# 内网扩散（不同内网目标主机）
+SCAN_TYPES = ("vertical_scan", "horizontal_scan", "lateral_movement")
+_KNUTH = 2654435761
+# 刚达到阈值时的警报分数，低于默认隔离阈值 0.5：超过阈值两倍（冷却后仍在扫描）才会自动隔离
+SCORE_PER_THRESHOLD = 0.25
+
+
+class _SourceState:
+    """单个来源在滑动窗口内的位图
+
+    每个时间片三张位图（目标端口、目标主机、内网目标主机），位图用Python整数表示，
+    窗口内的不同值数量 = 各时间片按位或之后做线性计数，内存固定。
+    """
+
+    __slots__ = ("slot", "ports", "hosts", "internal", "last_alert")
+
+    def __init__(self, slots: int, slot: int):
+        self.slot = slot  # 当前时间片编号
+        self.ports = [0] * slots
+        self.hosts = [0] * slots
+        self.internal = [0] * slots
+        self.last_alert: Dict[str, float] = {}
+
+
+def linear_count(bitmap: int, bits: int) -> int:
+    """线性计数：由位图中为0的位数估计不同值数量"""
+    zeros = bits - bin(bitmap).count("1")
+    if zeros == 0:
+        return int(bits * math.log(bits))
+    return int(round(bits * math.log(bits / zeros)))
+
+
+class ScanDetector:
+    """端口扫描和内网横向移动的流式检测
+
+    对每个内网来源维护 window 秒的滑动窗口（切成 slots 个时间片），统计不同目标端口、
+    不同目标主机和不同内网目标主机的数量。每个数据包只更新当前时间片的位图
+    （O(1)），只有出现新值时才合并窗口重新计数；超过阈值时返回发现结果，
+    同一来源同一类型在 cooldown 秒内只报告一次。来源数超过 max_sources 时
+    淘汰最久未活动的来源，总内存有上限。
+    """
+
+    def __init__(self, window: float = 10.0, slots: int = 5, port_threshold: int = 100,
+                 host_threshold: int = 50, internal_host_threshold: int = 20,
+                 cooldown: float = 60.0, max_sources: int = 10000, bitmap_bits: int = 1024):
+        if bitmap_bits & (bitmap_bits - 1):
+            raise ValueError(f"位图大小必须是2的幂: {bitmap_bits}")
+        self.window = window
+        self.slots = slots
+        self.slot_length = window / slots
+        self.thresholds = {
+            "vertical_scan": port_threshold,
+            "horizontal_scan": host_threshold,
+            "lateral_movement": internal_host_threshold
+        }
+        self.cooldown = cooldown
+        self.max_sources = max_sources
+        self.bitmap_bits = bitmap_bits
+        self._shift = 32 - (bitmap_bits.bit_length() - 1)
+        self._mask = bitmap_bits - 1
+        self._sources: "OrderedDict[str, _SourceState]" = OrderedDict()
+        self.detections = 0
+
+    def observe(self, packet_info: Dict) -> List[Dict]:
+        """处理一个数据包，返回新的发现结果（通常为空列表）"""
+        src_ip = packet_info.get("src_ip")
+        dst_ip = packet_info.get("dst_ip")
+        if not src_ip or not dst_ip or not is_local_address(src_ip):
+            return []
+
+        ts = packet_info["timestamp"]
+        slot = int(ts // self.slot_length)
+        state = self._sources.get(src_ip)
+        if state is None:
+            state = self._sources[src_ip] = _SourceState(self.slots, slot)
+            if len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+        else:
+            self._sources.move_to_end(src_ip)
+            if slot > state.slot:
+                self._advance(state, slot)
+            elif slot < state.slot - self.slots + 1:
+                return []  # 早于整个窗口的乱序包
+
+        index = slot % self.slots
+        changed = False
+
+        dst_port = packet_info.get("dst_port")
+        if dst_port is not None:
+            bit = 1 << (((dst_port * _KNUTH) & 0xFFFFFFFF) >> self._shift)
+            if not state.ports[index] & bit:
+                state.ports[index] |= bit
+                changed = True
+
+        bit = 1 << (hash64(dst_ip) & self._mask)
+        if not state.hosts[index] & bit:
+            state.hosts[index] |= bit
+            changed = True
+        # 内网位图单独判断：外网地址先占用同一位时内网地址仍要计数
+        if not state.internal[index] & bit and is_local_address(dst_ip):
+            state.internal[index] |= bit
+            changed = True
+
+        if not changed:
+            return []
+        return self._check(src_ip, state, ts)
+
+    def _advance(self, state: _SourceState, slot: int):
+        """滑动到新的时间片，清空已移出窗口的时间片"""
+        for expired in range(state.slot + 1, min(slot, state.slot + self.slots) + 1):
+            index = expired % self.slots
+            state.ports[index] = 0
+            state.hosts[index] = 0
+            state.internal[index] = 0
+        state.slot = slot
+
+    def _counts(self, state: _SourceState) -> Dict[str, int]:
+        """窗口内各类不同值数量"""
+        ports = hosts = internal = 0
+        for i in range(self.slots):
+            ports |= state.ports[i]
+            hosts |= state.hosts[i]
+            internal |= state.internal[i]
+        return {
+            "vertical_scan": linear_count(ports, self.bitmap_bits),
+            "horizontal_scan": linear_count(hosts, self.bitmap_bits),
+            "lateral_movement": linear_count(internal, self.bitmap_bits)
+        }
+
+    def _check(self, src_ip: str, state: _SourceState, ts: float) -> List[Dict]:
+        """检查阈值，返回冷却期之外的发现结果"""
+        counts = self._counts(state)
+        findings = []
+        for scan_type in SCAN_TYPES:
+            count = counts[scan_type]
+            threshold = self.thresholds[scan_type]
+            if count < threshold:
+                continue
+            last = state.last_alert.get(scan_type)
+            if last is not None and ts - last < self.cooldown:
+                continue
+            state.last_alert[scan_type] = ts
+            self.detections += 1
+            findings.append({
+                "source_ip": src_ip,
+                "scan_type": scan_type,
+                "distinct_ports": counts["vertical_scan"],
+                "distinct_hosts": counts["horizontal_scan"],
+                "internal_hosts": counts["lateral_movement"],
+                "threshold": threshold,
+                "window_seconds": self.window,
+                "score": min(1.0, SCORE_PER_THRESHOLD * count / threshold)
+            })
+        return findings
+
+    def forget(self, src_ip: str):
+        """删除一个来源的状态"""
+        self._sources.pop(src_ip, None)
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数"""
+        per_source = 3 * self.slots * (self.bitmap_bits // 8 + 40) + 300
+        return sys.getsizeof(self._sources) + len(self._sources) * per_source
+
+    def get_status(self) -> Dict:
+        """获取检测器状态"""
+        return {
+            "tracked_sources": len(self._sources),
+            "detections": self.detections,
+            "window_seconds": self.window,
+            "thresholds": dict(self.thresholds)
+        }
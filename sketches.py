@@ -0,0 +1,528 @@
+import hashlib
+import heapq
+import struct
+import sys
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# 所有草图都使用与进程无关的稳定哈希（内置 hash() 每个进程的种子不同），
+# 这样不同采集器生成的草图可以直接合并
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_PROTOCOL_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP"}
+
+
+@lru_cache(maxsize=65536)
+def hash64(value: str) -> int:
+    """64位稳定哈希"""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _pack_str(value: str) -> bytes:
+    data = value.encode("utf-8")[:65535]
+    return _U16.pack(len(data)) + data
+
+
+def _unpack_str(buffer: memoryview, offset: int) -> Tuple[str, int]:
+    (length,) = _U16.unpack_from(buffer, offset)
+    start = offset + _U16.size
+    if start + length > len(buffer):
+        raise ValueError("草图数据不完整")
+    return bytes(buffer[start:start + length]).decode("utf-8"), start + length
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计
+
+    基数较小时直接保存哈希值（精确计数），超过 SPARSE_LIMIT 后转换为
+    2^precision 个寄存器，内存固定为 2^precision 字节，标准误差约 1.04/sqrt(2^precision)。
+    合并即寄存器逐个取最大值，可以跨窗口、跨采集器合并。
+    """
+
+    __slots__ = ("precision", "_sparse", "_registers")
+
+    SPARSE_LIMIT = 32
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"HyperLogLog 精度必须在 4-16 之间: {precision}")
+        self.precision = precision
+        self._sparse = set()
+        self._registers: Optional[bytearray] = None
+
+    def add(self, value: str):
+        """加入一个元素"""
+        self.add_hash(hash64(value))
+
+    def add_hash(self, h: int):
+        """加入一个已计算好的64位哈希"""
+        if self._registers is None:
+            self._sparse.add(h)
+            if len(self._sparse) > self.SPARSE_LIMIT:
+                self._densify()
+            return
+
+        index = h >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def _densify(self):
+        """从精确模式切换到寄存器模式"""
+        hashes = self._sparse
+        self._sparse = None
+        self._registers = bytearray(1 << self.precision)
+        for h in hashes:
+            self.add_hash(h)
+
+    def merge(self, other: "HyperLogLog"):
+        """合并另一个 HyperLogLog（精度必须相同）"""
+        if other.precision != self.precision:
+            raise ValueError(f"HyperLogLog 精度不一致: {self.precision} != {other.precision}")
+        if other._registers is None:
+            for h in other._sparse:
+                self.add_hash(h)
+            return
+        if self._registers is None:
+            self._densify()
+        merged = np.maximum(np.frombuffer(self._registers, dtype=np.uint8),
+                            np.frombuffer(other._registers, dtype=np.uint8))
+        self._registers[:] = merged.tobytes()
+
+    def copy(self) -> "HyperLogLog":
+        """复制"""
+        clone = HyperLogLog(self.precision)
+        if self._registers is None:
+            clone._sparse = set(self._sparse)
+        else:
+            clone._sparse = None
+            clone._registers = bytearray(self._registers)
+        return clone
+
+    def count(self) -> int:
+        """估计不同元素的数量"""
+        if self._registers is None:
+            return len(self._sparse)
+
+        m = len(self._registers)
+        registers = np.frombuffer(self._registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+
+        # 小基数时使用线性计数修正
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self) -> int:
+        return self.count()
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数（精确模式下每个哈希约为一个整数对象加一个集合槽位）"""
+        if self._registers is None:
+            return 64 + sys.getsizeof(self._sparse) + 32 * len(self._sparse)
+        return 64 + sys.getsizeof(self._registers)
+
+    def to_bytes(self) -> bytes:
+        """序列化"""
+        if self._registers is None:
+            hashes = np.array(sorted(self._sparse), dtype=">u8")
+            return _U8.pack(self.precision) + _U8.pack(0) + _U32.pack(len(hashes)) + hashes.tobytes()
+        return _U8.pack(self.precision) + _U8.pack(1) + bytes(self._registers)
+
+    @classmethod
+    def from_bytes(cls, buffer: memoryview, offset: int = 0) -> Tuple["HyperLogLog", int]:
+        """反序列化，返回 (对象, 结束偏移量)"""
+        if offset + 2 > len(buffer):
+            raise ValueError("草图数据不完整")
+        precision, dense = buffer[offset], buffer[offset + 1]
+        hll = cls(precision)
+        offset += 2
+        if dense:
+            size = 1 << precision
+            if offset + size > len(buffer):
+                raise ValueError("草图数据不完整")
+            hll._sparse = None
+            hll._registers = bytearray(buffer[offset:offset + size])
+            return hll, offset + size
+
+        (count,) = _U32.unpack_from(buffer, offset)
+        offset += _U32.size
+        hashes = np.frombuffer(buffer, dtype=">u8", count=count, offset=offset)
+        for h in hashes.tolist():
+            hll.add_hash(h)
+        return hll, offset + count * 8
+
+
+class CountMinSketch:
+    """Count-Min 频率估计
+
+    depth 行 width 列的计数矩阵，估计值只会偏大，误差不超过总数的 e/width
+    （概率 1 - e^-depth）。同尺寸的草图直接按元素相加即可合并。
+    """
+
+    __slots__ = ("width", "depth", "total", "_table")
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        if width <= 0 or depth <= 0 or width * depth > (1 << 24):
+            raise ValueError(f"Count-Min 尺寸无效: {depth}x{width}")
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        # 用 array 保存计数，逐个更新比 numpy 标量索引快得多；合并时再借用 numpy
+        self._table = array("q", bytes(8 * width * depth))
+
+    def _indexes(self, h: int):
+        """双重哈希生成每一行的列号"""
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, key: str, count: int = 1):
+        """累加一个键的计数（每包调用，展开 _indexes 以减少开销）"""
+        h = hash64(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        table, width = self._table, self.width
+        for row in range(self.depth):
+            table[row * width + (h1 + row * h2) % width] += count
+        self.total += count
+
+    def estimate(self, key: str) -> int:
+        """估计一个键的计数（上界）"""
+        table = self._table
+        return min(table[index] for index in self._indexes(hash64(key)))
+
+    def merge(self, other: "CountMinSketch"):
+        """合并另一个同尺寸的草图"""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError(f"Count-Min 尺寸不一致: {self.depth}x{self.width} != {other.depth}x{other.width}")
+        table = np.frombuffer(self._table, dtype=np.int64)
+        table += np.frombuffer(other._table, dtype=np.int64)
+        self.total += other.total
+
+    def to_bytes(self) -> bytes:
+        """序列化"""
+        table = np.frombuffer(self._table, dtype=np.int64).astype(">i8")
+        return _U16.pack(self.depth) + _U32.pack(self.width) + _U64.pack(self.total) + table.tobytes()
+
+    @classmethod
+    def from_bytes(cls, buffer: memoryview, offset: int = 0) -> Tuple["CountMinSketch", int]:
+        """反序列化，返回 (对象, 结束偏移量)"""
+        (depth,) = _U16.unpack_from(buffer, offset)
+        (width,) = _U32.unpack_from(buffer, offset + 2)
+        (total,) = _U64.unpack_from(buffer, offset + 6)
+        offset += 14
+        sketch = cls(width, depth)
+        sketch.total = total
+        values = np.frombuffer(buffer, dtype=">i8", count=width * depth, offset=offset)
+        np.frombuffer(sketch._table, dtype=np.int64)[:] = values
+        return sketch, offset + width * depth * 8
+
+
+class SpaceSaving:
+    """Space-Saving 高频项（Top-K）
+
+    最多保留 capacity 个计数器；新键在计数器已满时替换计数最小的键，
+    并继承其计数作为误差上界。最小值用惰性小顶堆维护：计数增加时不更新堆，
+    取最小值时再修正过期的堆顶，每次替换为 O(log capacity)。
+    """
+
+    __slots__ = ("capacity", "counters", "_heap")
+
+    def __init__(self, capacity: int = 50):
+        if not 0 < capacity <= 10000:
+            raise ValueError(f"Space-Saving 容量无效: {capacity}")
+        self.capacity = capacity
+        self.counters: Dict[str, List[int]] = {}  # 键 -> [计数, 误差]
+        self._heap: List[Tuple[int, str]] = []  # 每个键一项，堆中计数不大于实际计数
+
+    def add(self, key: str, count: int = 1):
+        """累加一个键的计数"""
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+        else:
+            floor, victim = self._min()
+            del self.counters[victim]
+            self.counters[key] = [floor + count, floor]
+            heapq.heapreplace(self._heap, (floor + count, key))
+
+    def _min(self) -> Tuple[int, str]:
+        """修正过期的堆顶，返回计数最小的 (计数, 键)"""
+        heap, counters = self._heap, self.counters
+        while True:
+            count, key = heap[0]
+            actual = counters[key][0]
+            if count == actual:
+                return count, key
+            heapq.heapreplace(heap, (actual, key))
+
+    def _floor(self) -> int:
+        """未被跟踪的键计数的上界"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return self._min()[0]
+
+    def merge(self, other: "SpaceSaving"):
+        """合并另一个摘要：缺失的键按对方的最小计数补足，再保留最大的 capacity 个"""
+        self_floor, other_floor = self._floor(), other._floor()
+        merged = {}
+        for key in self.counters.keys() | other.counters.keys():
+            mine = self.counters.get(key, [self_floor, self_floor])
+            theirs = other.counters.get(key, [other_floor, other_floor])
+            merged[key] = [mine[0] + theirs[0], mine[1] + theirs[1]]
+        top = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(top)
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        """按当前计数重建堆"""
+        self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, n: int = None) -> List[Tuple[str, int, int]]:
+        """按计数从大到小返回 (键, 计数, 误差)"""
+        items = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in items[:n]]
+
+    def to_bytes(self) -> bytes:
+        """序列化"""
+        parts = [_U16.pack(self.capacity), _U32.pack(len(self.counters))]
+        for key, (count, error) in self.counters.items():
+            parts.append(_pack_str(key))
+            parts.append(_U64.pack(count) + _U64.pack(error))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buffer: memoryview, offset: int = 0) -> Tuple["SpaceSaving", int]:
+        """反序列化，返回 (对象, 结束偏移量)"""
+        (capacity,) = _U16.unpack_from(buffer, offset)
+        (count,) = _U32.unpack_from(buffer, offset + 2)
+        offset += 6
+        summary = cls(capacity)
+        if count > capacity:
+            raise ValueError(f"Space-Saving 计数器数量超出容量: {count}")
+        for _ in range(count):
+            key, offset = _unpack_str(buffer, offset)
+            (value,) = _U64.unpack_from(buffer, offset)
+            (error,) = _U64.unpack_from(buffer, offset + 8)
+            offset += 16
+            summary.counters[key] = [value, error]
+        summary._rebuild_heap()
+        return summary, offset
+
+
+class HeavyHitters:
+    """Top-K 统计：Space-Saving 决定哪些键是高频项，Count-Min 收紧其计数估计"""
+
+    __slots__ = ("cms", "space_saving")
+
+    def __init__(self, top_k: int = 20, width: int = 2048, depth: int = 4):
+        self.cms = CountMinSketch(width, depth)
+        # 多保留一些候选，减少真正的 Top-K 被挤出的概率
+        self.space_saving = SpaceSaving(top_k * 2)
+
+    def add(self, key: str, count: int = 1):
+        """累加一个键的计数"""
+        self.cms.add(key, count)
+        self.space_saving.add(key, count)
+
+    def merge(self, other: "HeavyHitters"):
+        """合并另一份统计"""
+        self.cms.merge(other.cms)
+        self.space_saving.merge(other.space_saving)
+
+    def top(self, n: int) -> List[Dict]:
+        """返回前 n 个高频项；两种估计都是上界，取较小者"""
+        result = [{"key": key, "count": min(count, self.cms.estimate(key))}
+                  for key, count, _ in self.space_saving.top()]
+        result.sort(key=lambda item: item["count"], reverse=True)
+        return result[:n]
+
+    def to_bytes(self) -> bytes:
+        """序列化"""
+        return self.cms.to_bytes() + self.space_saving.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, buffer: memoryview, offset: int = 0) -> Tuple["HeavyHitters", int]:
+        """反序列化，返回 (对象, 结束偏移量)"""
+        hitters = cls.__new__(cls)
+        hitters.cms, offset = CountMinSketch.from_bytes(buffer, offset)
+        hitters.space_saving, offset = SpaceSaving.from_bytes(buffer, offset)
+        return hitters, offset
+
+
+class TrafficSketches:
+    """由抓包结果更新的流量草图
+
+    全局：目标地址、协议/端口、发送方的 Top-K（Count-Min + Space-Saving），
+    以及不同目标地址数（HyperLogLog）。每个设备：不同目标地址数和不同目标端口数
+    （HyperLogLog）。内存与流量规模无关，所有部分都可以合并。
+    """
+
+    def __init__(self, top_k: int = 20, precision: int = 12, device_precision: int = 10,
+                 cms_width: int = 2048, cms_depth: int = 4):
+        self.top_k = top_k
+        self.precision = precision
+        self.device_precision = device_precision
+        self.packets = 0
+        self.bytes = 0
+        self.destinations = HeavyHitters(top_k, cms_width, cms_depth)
+        self.protocols = HeavyHitters(top_k, cms_width, cms_depth)
+        self.talkers = HeavyHitters(top_k, cms_width, cms_depth)
+        self.distinct_destinations = HyperLogLog(precision)
+        self.devices: Dict[str, Tuple[HyperLogLog, HyperLogLog]] = {}  # 设备 -> (目标地址, 目标端口)
+
+    def empty_like(self) -> "TrafficSketches":
+        """创建参数相同的空草图"""
+        return TrafficSketches(self.top_k, self.precision, self.device_precision,
+                               self.destinations.cms.width, self.destinations.cms.depth)
+
+    def _device(self, device_id: str) -> Tuple[HyperLogLog, HyperLogLog]:
+        """获取（必要时创建）设备的草图"""
+        sketches = self.devices.get(device_id)
+        if sketches is None:
+            sketches = self.devices[device_id] = (HyperLogLog(self.device_precision),
+                                                  HyperLogLog(self.device_precision))
+        return sketches
+
+    def add_packet(self, packet_info: Dict, src_device: str = None):
+        """用一个数据包更新草图"""
+        length = packet_info.get("length", 0)
+        src_ip = packet_info.get("src_ip")
+        dst_ip = packet_info.get("dst_ip")
+        dst_port = packet_info.get("dst_port")
+        protocol = packet_info.get("protocol")
+
+        self.packets += 1
+        self.bytes += length
+        if src_ip:
+            self.talkers.add(src_ip, length)
+        if dst_ip:
+            self.destinations.add(dst_ip)
+            self.distinct_destinations.add(dst_ip)
+
+        protocol_name = _PROTOCOL_NAMES.get(protocol, str(protocol))
+        self.protocols.add(f"{protocol_name}/{dst_port}" if dst_port is not None else protocol_name)
+
+        if src_device is not None:
+            destinations, ports = self._device(src_device)
+            if dst_ip:
+                destinations.add(dst_ip)
+            if dst_port is not None:
+                ports.add(str(dst_port))
+
+    def remove_device(self, device_id: str):
+        """设备被淘汰时释放其草图"""
+        self.devices.pop(device_id, None)
+
+    def device_nbytes(self, device_id: str) -> int:
+        """单个设备草图的内存字节数"""
+        sketches = self.devices.get(device_id)
+        if sketches is None:
+            return 0
+        return sketches[0].nbytes + sketches[1].nbytes
+
+    def export_device(self, device_id: str) -> Optional[Tuple[bytes, bytes]]:
+        """取出并删除单个设备的草图（序列化后用于溢出到磁盘）"""
+        sketches = self.devices.pop(device_id, None)
+        if sketches is None:
+            return None
+        return sketches[0].to_bytes(), sketches[1].to_bytes()
+
+    def import_device(self, device_id: str, data: Tuple[bytes, bytes]):
+        """合并 export_device 取出的设备草图"""
+        mine = self._device(device_id)
+        mine[0].merge(HyperLogLog.from_bytes(memoryview(data[0]))[0])
+        mine[1].merge(HyperLogLog.from_bytes(memoryview(data[1]))[0])
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数"""
+        fixed = sum(len(hitters.cms._table) * 8 + len(hitters.space_saving.counters) * 200
+                    for hitters in (self.destinations, self.protocols, self.talkers))
+        devices = sys.getsizeof(self.devices) + sum(100 + destinations.nbytes + ports.nbytes
+                                                    for destinations, ports in self.devices.values())
+        return fixed + self.distinct_destinations.nbytes + devices
+
+    def device_cardinality(self, device_id: str) -> Dict:
+        """单个设备的不同目标地址数和端口数"""
+        sketches = self.devices.get(device_id)
+        if sketches is None:
+            return {}
+        return {"distinct_destinations": sketches[0].count(), "distinct_ports": sketches[1].count()}
+
+    def merge(self, other: "TrafficSketches", device_prefix: str = ""):
+        """合并另一份草图；device_prefix 用于给远端设备加命名空间"""
+        self.packets += other.packets
+        self.bytes += other.bytes
+        self.destinations.merge(other.destinations)
+        self.protocols.merge(other.protocols)
+        self.talkers.merge(other.talkers)
+        self.distinct_destinations.merge(other.distinct_destinations)
+        for device_id, (destinations, ports) in other.devices.items():
+            mine = self._device(device_prefix + device_id)
+            mine[0].merge(destinations)
+            mine[1].merge(ports)
+
+    def summary(self, n: int = None) -> Dict:
+        """全局流量摘要"""
+        n = n or self.top_k
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "distinct_destinations": self.distinct_destinations.count(),
+            "top_destinations": self.destinations.top(n),
+            "top_protocols": self.protocols.top(n),
+            "top_talkers": self.talkers.top(n)
+        }
+
+    def to_bytes(self) -> bytes:
+        """序列化（用于采集器向汇聚节点发送）"""
+        parts = [_U16.pack(self.top_k), _U64.pack(self.packets), _U64.pack(self.bytes),
+                 self.destinations.to_bytes(), self.protocols.to_bytes(), self.talkers.to_bytes(),
+                 self.distinct_destinations.to_bytes(), _U32.pack(len(self.devices))]
+        for device_id, (destinations, ports) in self.devices.items():
+            parts.append(_pack_str(device_id))
+            parts.append(destinations.to_bytes())
+            parts.append(ports.to_bytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TrafficSketches":
+        """反序列化"""
+        buffer = memoryview(data)
+        sketches = cls.__new__(cls)
+        (sketches.top_k,) = _U16.unpack_from(buffer, 0)
+        (sketches.packets,) = _U64.unpack_from(buffer, 2)
+        (sketches.bytes,) = _U64.unpack_from(buffer, 10)
+        offset = 18
+        sketches.destinations, offset = HeavyHitters.from_bytes(buffer, offset)
+        sketches.protocols, offset = HeavyHitters.from_bytes(buffer, offset)
+        sketches.talkers, offset = HeavyHitters.from_bytes(buffer, offset)
+        sketches.distinct_destinations, offset = HyperLogLog.from_bytes(buffer, offset)
+        sketches.precision = sketches.distinct_destinations.precision
+        sketches.device_precision = 10
+        sketches.devices = {}
+
+        (count,) = _U32.unpack_from(buffer, offset)
+        offset += _U32.size
+        for _ in range(count):
+            device_id, offset = _unpack_str(buffer, offset)
+            destinations, offset = HyperLogLog.from_bytes(buffer, offset)
+            ports, offset = HyperLogLog.from_bytes(buffer, offset)
+            sketches.devices[device_id] = (destinations, ports)
+            sketches.device_precision = destinations.precision
+        return sketches
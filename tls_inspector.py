@@ -0,0 +1,215 @@
+import hashlib
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from frame_decoder import TCP, transport_payload
+
+_U16 = struct.Struct(">H")
+_TLS_HANDSHAKE = 0x16
+_CLIENT_HELLO = 0x01
+_MAX_HELLO = 16384  # 单个 ClientHello 最多缓存的字节数
+_DONE = None  # 流已检查完毕的标记
+
+
+def _is_grease(value: int) -> bool:
+    """GREASE 保留值（0x0a0a, 0x1a1a, ...），计算JA3时忽略"""
+    return (value & 0x0F0F) == 0x0A0A and (value >> 8) == (value & 0xFF)
+
+
+def _u16_list(data: memoryview) -> List[int]:
+    return [value for (value,) in struct.iter_unpack(">H", data[:len(data) & ~1]) if not _is_grease(value)]
+
+
+def parse_client_hello(data: bytes) -> Optional[Dict]:
+    """解析TLS记录中的 ClientHello，返回 SNI、JA3 字符串和 JA3 哈希；不是 ClientHello 时返回 None"""
+    view = memoryview(data)
+    try:
+        if view[0] != _TLS_HANDSHAKE or view[5] != _CLIENT_HELLO:
+            return None
+        offset = 9
+        (version,) = _U16.unpack_from(view, offset)
+        offset += 2 + 32
+        offset += 1 + view[offset]  # session id
+
+        (length,) = _U16.unpack_from(view, offset)
+        ciphers = _u16_list(view[offset + 2:offset + 2 + length])
+        offset += 2 + length
+        offset += 1 + view[offset]  # 压缩方法
+
+        extensions, groups, point_formats = [], [], []
+        sni = None
+        end = len(view)
+        if offset + 2 <= end:
+            end = min(end, offset + 2 + _U16.unpack_from(view, offset)[0])
+            offset += 2
+        while offset + 4 <= end:
+            ext_type, ext_length = struct.unpack_from(">HH", view, offset)
+            body = view[offset + 4:offset + 4 + ext_length]
+            offset += 4 + ext_length
+            if _is_grease(ext_type):
+                continue
+            extensions.append(ext_type)
+            if ext_type == 0 and len(body) >= 5 and body[2] == 0:
+                (name_length,) = _U16.unpack_from(body, 3)
+                sni = bytes(body[5:5 + name_length]).decode("ascii", "replace")
+            elif ext_type == 10 and len(body) >= 2:
+                groups = _u16_list(body[2:2 + _U16.unpack_from(body, 0)[0]])
+            elif ext_type == 11 and len(body) >= 1:
+                point_formats = list(body[1:1 + body[0]])
+    except (IndexError, struct.error):
+        return None
+
+    ja3 = ",".join([str(version), "-".join(map(str, ciphers)), "-".join(map(str, extensions)),
+                    "-".join(map(str, groups)), "-".join(map(str, point_formats))])
+    return {"sni": sni, "ja3": ja3, "ja3_hash": hashlib.md5(ja3.encode("ascii")).hexdigest()}
+
+
+class TLSInspector:
+    """TLS ClientHello 指纹（JA3）和 SNI 提取
+
+    只检查每个TCP流的前 max_packets 个数据包：找到 ClientHello（跨多个报文段时
+    先拼接）或检查数满后，流被标记为已完成，之后的数据包只做一次字典查找。
+    流表按插入顺序淘汰，总数不超过 max_flows。
+
+    每个设备保存一个已知正常指纹的LRU集合（最多 fingerprints_per_device 个）：
+    设备首次出现 ClientHello 后的 learning_period 秒内直接学习，之后出现的新指纹
+    返回发现结果并加入集合。
+    """
+
+    def __init__(self, max_packets: int = 4, max_flows: int = 65536,
+                 fingerprints_per_device: int = 16, learning_period: float = 3600.0,
+                 max_devices: int = 50000):
+        self.max_packets = max_packets
+        self.max_flows = max_flows
+        self.fingerprints_per_device = fingerprints_per_device
+        self.learning_period = learning_period
+        self.max_devices = max_devices
+        # 流 -> [剩余检查包数, 未拼接完的 ClientHello]，检查完毕后为 _DONE
+        self._flows: "OrderedDict[tuple, Optional[list]]" = OrderedDict()
+        self._devices: "OrderedDict[str, Dict]" = OrderedDict()
+        self.inspected_packets = 0
+        self.client_hellos = 0
+
+    def observe(self, packet_info: Dict, device_id: Optional[str]) -> Optional[Dict]:
+        """处理一个数据包，设备出现新指纹时返回发现结果"""
+        if packet_info.get("protocol") != TCP:
+            return None
+        key = (packet_info.get("src_ip"), packet_info.get("src_port"),
+               packet_info.get("dst_ip"), packet_info.get("dst_port"))
+        state = self._flows.get(key, 0)
+        if state is _DONE:
+            return None
+
+        if state == 0:
+            state = self._flows[key] = [self.max_packets, None]
+            if len(self._flows) > self.max_flows:
+                self._flows.popitem(last=False)
+
+        state[0] -= 1
+        self.inspected_packets += 1
+        hello = self._collect(state, packet_info.get("raw"))
+        if hello is None:
+            if state[0] <= 0:
+                self._flows[key] = _DONE
+            return None
+
+        self._flows[key] = _DONE
+        result = parse_client_hello(hello)
+        if result is None or device_id is None:
+            return None
+        self.client_hellos += 1
+        return self._record(device_id, result, packet_info)
+
+    @staticmethod
+    def _collect(state: list, frame: Optional[bytes]) -> Optional[bytes]:
+        """拼接 ClientHello，完整时返回其TLS记录"""
+        if not frame:
+            return None
+        payload = transport_payload(frame, TCP)
+        if not payload:
+            return None
+
+        buffer = state[1]
+        if buffer is None:
+            if len(payload) < 6 or payload[0] != _TLS_HANDSHAKE or payload[5] != _CLIENT_HELLO:
+                return None
+            buffer = state[1] = bytearray(payload)
+        else:
+            buffer.extend(payload[:_MAX_HELLO - len(buffer)])
+
+        record_length = 5 + _U16.unpack_from(buffer, 3)[0]
+        if len(buffer) >= min(record_length, _MAX_HELLO):
+            return bytes(buffer[:record_length])
+        if state[0] <= 0:
+            return bytes(buffer)  # 检查数用完时解析已收到的部分
+        return None
+
+    def _record(self, device_id: str, result: Dict, packet_info: Dict) -> Optional[Dict]:
+        """更新设备指纹集合，学习期之后出现新指纹时返回发现结果"""
+        timestamp = packet_info["timestamp"]
+        device = self._devices.get(device_id)
+        if device is None:
+            device = self._devices[device_id] = {"first_seen": timestamp,
+                                                 "fingerprints": OrderedDict(),
+                                                 "sni": OrderedDict()}
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+
+        if result["sni"]:
+            device["sni"][result["sni"]] = timestamp
+            device["sni"].move_to_end(result["sni"])
+            if len(device["sni"]) > self.fingerprints_per_device:
+                device["sni"].popitem(last=False)
+
+        fingerprints = device["fingerprints"]
+        ja3_hash = result["ja3_hash"]
+        if ja3_hash in fingerprints:
+            fingerprints.move_to_end(ja3_hash)
+            return None
+
+        learning = timestamp - device["first_seen"] < self.learning_period
+        fingerprints[ja3_hash] = result["sni"]
+        if len(fingerprints) > self.fingerprints_per_device:
+            fingerprints.popitem(last=False)
+        if learning:
+            return None
+
+        return {
+            "ja3_hash": ja3_hash,
+            "ja3": result["ja3"],
+            "sni": result["sni"],
+            "dst_ip": packet_info.get("dst_ip"),
+            "dst_port": packet_info.get("dst_port"),
+            "known_fingerprints": len(fingerprints) - 1
+        }
+
+    def device_summary(self, device_id: str) -> Dict:
+        """单个设备的已知指纹和最近的SNI"""
+        device = self._devices.get(device_id)
+        if device is None:
+            return {}
+        return {"tls_fingerprints": list(device["fingerprints"]),
+                "tls_sni": list(reversed(device["sni"]))}
+
+    def remove_device(self, device_id: str):
+        """设备被淘汰时释放其指纹集合"""
+        self._devices.pop(device_id, None)
+
+    @property
+    def nbytes(self) -> int:
+        """估计占用的内存字节数"""
+        return (sys.getsizeof(self._flows) + len(self._flows) * 250
+                + sys.getsizeof(self._devices)
+                + sum(600 + 150 * (len(d["fingerprints"]) + len(d["sni"])) for d in self._devices.values()))
+
+    def get_status(self) -> Dict:
+        """获取状态"""
+        return {
+            "tracked_flows": len(self._flows),
+            "devices": len(self._devices),
+            "inspected_packets": self.inspected_packets,
+            "client_hellos": self.client_hellos
+        }
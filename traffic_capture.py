@@ -1,53 +1,88 @@
-import scapy.all as scapy
+import importlib.util
 import threading
 import time
 from collections import defaultdict
-from datetime import datetime
 from typing import Dict, Callable
 
 class TrafficCapture:
     """网络流量采集模块"""
     
-    def __init__(self, interface: str = None):
+    def __init__(self, interface: str = None, keep_raw: bool = False):
         self.interface = interface
+        self.keep_raw = keep_raw  # 在 packet_info["raw"] 中附带原始帧（供告警时导出pcap）
         self.running = False
         self.packet_callback = None
         self.capture_thread = None
+        self._layers = None  # (IP, TCP, UDP, Ether)，抓包线程启动时加载
+        self._started = threading.Event()  # 抓包已开始或已失败
+        self.error = None  # 抓包线程中的错误
+        
+    def start_capture(self, callback: Callable, timeout: float = 30.0):
+        """开始抓包，等待抓包线程真正开始监听
+
+        没有权限、网卡不可用等错误发生在抓包线程中，这里会等待并重新抛出，
+        调用方可以据此退回到模拟数据。scapy 在抓包线程中才导入，这里先确认已安装。
+        """
+        if importlib.util.find_spec("scapy") is None:
+            raise ImportError("未安装 scapy，无法抓包")
         
-    def start_capture(self, callback: Callable):
-        """开始抓包"""
         self.packet_callback = callback
         self.running = True
+        self.error = None
+        self._started.clear()
         
         self.capture_thread = threading.Thread(target=self._capture_loop)
         self.capture_thread.daemon = True
         self.capture_thread.start()
         
+        if not self._started.wait(timeout):
+            self.running = False
+            raise RuntimeError(f"抓包在 {timeout:.0f} 秒内未能开始")
+        if self.error is not None:
+            self.running = False
+            raise RuntimeError(f"抓包启动失败: {self.error}")
+        
     def _capture_loop(self):
         """抓包循环"""
         try:
-            scapy.sniff(
+            # scapy 加载较慢，放在抓包线程中导入，且只导入用到的层，不加载 scapy.all
+            from scapy.layers.inet import IP, TCP, UDP
+            from scapy.layers.l2 import Ether
+            from scapy.sendrecv import sniff
+            self._layers = (IP, TCP, UDP, Ether)
+            
+            sniff(
                 iface=self.interface,
                 prn=self._process_packet,
-                stop_filter=lambda x: not self.running
+                stop_filter=lambda x: not self.running,
+                started_callback=self._started.set
             )
         except Exception as e:
+            self.error = e
             print(f"抓包错误: {e}")
+        finally:
+            self._started.set()
             
     def _process_packet(self, packet):
         """处理数据包"""
         if self.packet_callback:
+            IP, TCP, UDP, Ether = self._layers
             packet_info = {
-                "timestamp": datetime.now(),
-                "src_ip": packet[scapy.IP].src if scapy.IP in packet else None,
-                "dst_ip": packet[scapy.IP].dst if scapy.IP in packet else None,
-                "protocol": packet[scapy.IP].proto if scapy.IP in packet else None,
+                "timestamp": float(packet.time),  # 使用抓包时间戳（事件时间）
+                "src_ip": packet[IP].src if IP in packet else None,
+                "dst_ip": packet[IP].dst if IP in packet else None,
+                "protocol": packet[IP].proto if IP in packet else None,
+                "src_mac": packet[Ether].src if Ether in packet else None,
+                "dst_mac": packet[Ether].dst if Ether in packet else None,
                 "length": len(packet),
-                "src_port": packet[scapy.TCP].sport if scapy.TCP in packet else 
-                           (packet[scapy.UDP].sport if scapy.UDP in packet else None),
-                "dst_port": packet[scapy.TCP].dport if scapy.TCP in packet else 
-                           (packet[scapy.UDP].dport if scapy.UDP in packet else None)
+                "src_port": packet[TCP].sport if TCP in packet else 
+                           (packet[UDP].sport if UDP in packet else None),
+                "dst_port": packet[TCP].dport if TCP in packet else 
+                           (packet[UDP].dport if UDP in packet else None)
             }
+            if self.keep_raw:
+                # 抓包得到的原始字节，不重新序列化
+                packet_info["raw"] = getattr(packet, "original", None) or bytes(packet)
             self.packet_callback(packet_info)
             
     def stop_capture(self):
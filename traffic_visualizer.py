@@ -1,55 +1,236 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-from datetime import datetime, timedelta
-from typing import Dict, List
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional, Sequence, Tuple
+import matplotlib.style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 
+TIMELINE_FIGSIZE = (12, 6)
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """最大三角形三桶（LTTB）降采样，返回保留点的下标
+
+    保留首尾两点，其余点均分为 threshold-2 个桶，每个桶选出与前一个已选点和
+    下一个桶平均点构成三角形面积最大的点，峰值和突变因此不会被平均掉。
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一个桶的平均点（最后一个桶之后是末尾点）
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def _safe_filename(name: str) -> str:
+    """设备ID转换为文件名（采集器命名空间中含有 /）"""
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class _TimelineRenderer:
+    """批量渲染设备流量时间线
+
+    整个批次只创建一个 Figure（Agg 画布，不依赖显示器），每个设备只替换曲线数据
+    后重新保存，省去反复创建图形和布局计算的开销。
+    """
+
+    def __init__(self, dpi: int = 100):
+        self.figure = Figure(figsize=TIMELINE_FIGSIZE, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.max_points = int(TIMELINE_FIGSIZE[0] * dpi)  # 每个像素列最多一个点
+        self.ax = self.figure.add_subplot(111)
+        placeholder = [datetime.now()]
+        self.sent_line, = self.ax.plot(placeholder, [0], label="发送字节", color="blue")
+        self.received_line, = self.ax.plot(placeholder, [0], label="接收字节", color="red")
+        self.ax.set_xlabel("时间")
+        self.ax.set_ylabel("字节数")
+        self.ax.legend(loc="upper right")
+        self.ax.tick_params(axis="x", labelrotation=45)
+        self.figure.tight_layout()
+
+    def _series(self, timestamps: np.ndarray, values: np.ndarray):
+        """降采样到像素宽度并转换时间轴"""
+        index = lttb_downsample(timestamps, values, self.max_points)
+        return [datetime.fromtimestamp(ts) for ts in timestamps[index].tolist()], values[index]
+
+    def render(self, device_id: str, timestamps: np.ndarray, bytes_sent: np.ndarray,
+               bytes_received: np.ndarray, path: str):
+        """渲染单个设备并保存"""
+        self.sent_line.set_data(*self._series(timestamps, bytes_sent))
+        self.received_line.set_data(*self._series(timestamps, bytes_received))
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set_title(f"设备 {device_id} 流量时间线")
+        self.figure.savefig(path)
+
+
+def _render_timeline_batch(jobs: List[Tuple], dpi: int) -> List[str]:
+    """渲染一批设备时间线（进程池任务，必须是模块级函数）"""
+    renderer = _TimelineRenderer(dpi)
+    paths = []
+    for device_id, timestamps, bytes_sent, bytes_received, path in jobs:
+        renderer.render(device_id, timestamps, bytes_sent, bytes_received, path)
+        paths.append(path)
+    return paths
+
+
 class TrafficVisualizer:
-    """流量可视化模块"""
-    
-    def __init__(self):
-        plt.style.use('seaborn-v0_8')
+    """流量可视化模块
+
+    headless=True 时所有图表都渲染到 Agg 画布并保存为文件（PNG/SVG），
+    不需要显示器也不会阻塞；否则使用 pyplot 弹出窗口显示。
+    """
+        
+    def __init__(self, headless: bool = False, output_dir: str = "charts",
+                 image_format: str = "png", dpi: int = 100, render_workers: int = 0):
+        self.headless = headless
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.dpi = dpi
+        self.render_workers = render_workers  # 0 表示按CPU数量自动选择
+        matplotlib.style.use('seaborn-v0_8')
+        
+    def _figure(self, figsize: Tuple[float, float]):
+        """创建图形：无界面模式下不经过 pyplot，避免全局状态和显示依赖"""
+        if self.headless:
+            figure = Figure(figsize=figsize, dpi=self.dpi)
+            FigureCanvasAgg(figure)
+            return figure
+        import matplotlib.pyplot as plt  # 只有弹窗显示时才需要 pyplot 和图形界面后端
+        return plt.figure(figsize=figsize)
+        
+    def _finish(self, figure, name: str, filename: str = None) -> Optional[str]:
+        """保存或显示图形，保存时返回文件路径"""
+        figure.tight_layout()
+        if filename is None and not self.headless:
+            import matplotlib.pyplot as plt
+            plt.show()
+            return None
         
-    def plot_traffic_timeline(self, traffic_data: Dict, device_id: str):
-        """绘制流量时间线"""
+        if filename is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            filename = os.path.join(self.output_dir, f"{_safe_filename(name)}.{self.image_format}")
+        figure.savefig(filename)
+        if not self.headless:
+            import matplotlib.pyplot as plt
+            plt.close(figure)
+        return filename
+        
+    @staticmethod
+    def _timeline_arrays(records) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """历史窗口转换为时间戳和收发字节数组"""
+        count = len(records)
+        timestamps = np.fromiter((d["timestamp"] for d in records), dtype=float, count=count)
+        bytes_sent = np.fromiter((d["bytes_sent"] for d in records), dtype=float, count=count)
+        bytes_received = np.fromiter((d["bytes_received"] for d in records), dtype=float, count=count)
+        return timestamps, bytes_sent, bytes_received
+        
+    def plot_traffic_timeline(self, traffic_data: Dict, device_id: str, filename: str = None) -> Optional[str]:
+        """绘制流量时间线（长序列按图宽做LTTB降采样）"""
         if device_id not in traffic_data:
             print(f"设备 {device_id} 无数据")
-            return
-            
-        data = list(traffic_data[device_id])
+            return None
+        
+        data = traffic_data[device_id]
         if not data:
-            return
-            
-        timestamps = [d["timestamp"] for d in data]
-        bytes_sent = [d["bytes_sent"] for d in data]
-        bytes_received = [d["bytes_received"] for d in data]
-        
-        plt.figure(figsize=(12, 6))
-        plt.plot(timestamps, bytes_sent, label="发送字节", color="blue")
-        plt.plot(timestamps, bytes_received, label="接收字节", color="red")
-        plt.title(f"设备 {device_id} 流量时间线")
-        plt.xlabel("时间")
-        plt.ylabel("字节数")
-        plt.legend()
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.show()
-        
-    def plot_device_comparison(self, traffic_data: Dict):
+            return None
+        
+        timestamps, bytes_sent, bytes_received = self._timeline_arrays(data)
+        max_points = int(TIMELINE_FIGSIZE[0] * self.dpi)
+        
+        figure = self._figure(TIMELINE_FIGSIZE)
+        ax = figure.add_subplot(111)
+        for values, label, color in ((bytes_sent, "发送字节", "blue"),
+                                     (bytes_received, "接收字节", "red")):
+            index = lttb_downsample(timestamps, values, max_points)
+            ax.plot([datetime.fromtimestamp(ts) for ts in timestamps[index].tolist()], values[index],
+                    label=label, color=color)
+        ax.set_title(f"设备 {device_id} 流量时间线")
+        ax.set_xlabel("时间")
+        ax.set_ylabel("字节数")
+        ax.legend()
+        ax.tick_params(axis="x", labelrotation=45)
+        return self._finish(figure, f"timeline_{device_id}", filename)
+        
+    def render_device_timelines(self, traffic_data: Dict, device_ids: Sequence[str] = None,
+                                output_dir: str = None, image_format: str = None,
+                                workers: int = None) -> List[str]:
+        """批量把设备时间线渲染为图片文件，返回文件路径列表
+
+        数据在主进程中转换为紧凑的数组，渲染按设备分块交给进程池；
+        每个进程在整个分块中复用同一个图形。workers=1 时在当前进程中渲染。
+        子进程用 spawn 方式启动：运行中的系统有多个后台线程，fork 可能继承被持有的锁。
+        """
+        output_dir = output_dir or self.output_dir
+        image_format = image_format or self.image_format
+        workers = workers or self.render_workers or os.cpu_count() or 1
+        os.makedirs(output_dir, exist_ok=True)
+        
+        jobs = []
+        for device_id in (device_ids if device_ids is not None else list(traffic_data.keys())):
+            data = traffic_data.get(device_id)
+            if not data:
+                continue
+            path = os.path.join(output_dir, f"timeline_{_safe_filename(device_id)}.{image_format}")
+            jobs.append((device_id, *self._timeline_arrays(data), path))
+        
+        if not jobs:
+            return []
+        
+        workers = min(workers, len(jobs))
+        if workers == 1:
+            return _render_timeline_batch(jobs, self.dpi)
+        
+        # 每个进程分几块，避免块大小不均时部分进程空闲
+        chunk_size = max(1, len(jobs) // (workers * 4))
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        paths = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for chunk_paths in pool.map(_render_timeline_batch, chunks, [self.dpi] * len(chunks)):
+                paths.extend(chunk_paths)
+        return paths
+        
+    def plot_device_comparison(self, traffic_data: Dict, filename: str = None) -> Optional[str]:
         """绘制设备流量对比"""
         device_stats = {}
         
         for device_id, data in traffic_data.items():
             if data:
-                recent_data = list(data)[-10:]  # 最近10条记录
+                # 只从尾部取最近10条记录，不复制整个历史
+                recent_data = list(islice(reversed(data), 10))
                 avg_sent = np.mean([d["bytes_sent"] for d in recent_data])
                 avg_received = np.mean([d["bytes_received"] for d in recent_data])
                 device_stats[device_id] = {"sent": avg_sent, "received": avg_received}
         
         if not device_stats:
             print("无设备数据")
-            return
-            
+            return None
+        
         devices = list(device_stats.keys())
         sent_values = [device_stats[d]["sent"] for d in devices]
         received_values = [device_stats[d]["received"] for d in devices]
@@ -57,38 +238,39 @@ class TrafficVisualizer:
         x = np.arange(len(devices))
         width = 0.35
         
-        plt.figure(figsize=(10, 6))
-        plt.bar(x - width/2, sent_values, width, label="平均发送", color="skyblue")
-        plt.bar(x + width/2, received_values, width, label="平均接收", color="lightcoral")
+        figure = self._figure((10, 6))
+        ax = figure.add_subplot(111)
+        ax.bar(x - width/2, sent_values, width, label="平均发送", color="skyblue")
+        ax.bar(x + width/2, received_values, width, label="平均接收", color="lightcoral")
         
-        plt.title("设备流量对比")
-        plt.xlabel("设备ID")
-        plt.ylabel("平均字节数")
-        plt.xticks(x, devices, rotation=45)
-        plt.legend()
-        plt.tight_layout()
-        plt.show()
+        ax.set_title("设备流量对比")
+        ax.set_xlabel("设备ID")
+        ax.set_ylabel("平均字节数")
+        ax.set_xticks(x)
+        ax.set_xticklabels(devices, rotation=45)
+        ax.legend()
+        return self._finish(figure, "device_comparison", filename)
         
-    def plot_anomaly_detection(self, anomaly_scores: Dict):
+    def plot_anomaly_detection(self, anomaly_scores: Dict, filename: str = None) -> Optional[str]:
         """绘制异常检测结果"""
         devices = list(anomaly_scores.keys())
         scores = list(anomaly_scores.values())
         
         colors = ['red' if score > 0.1 else 'green' for score in scores]
         
-        plt.figure(figsize=(10, 6))
-        bars = plt.bar(devices, scores, color=colors)
-        plt.axhline(y=0.1, color='red', linestyle='--', label='异常阈值')
-        plt.title("设备异常检测分数")
-        plt.xlabel("设备ID")
-        plt.ylabel("异常分数")
-        plt.xticks(rotation=45)
-        plt.legend()
+        figure = self._figure((10, 6))
+        ax = figure.add_subplot(111)
+        bars = ax.bar(devices, scores, color=colors)
+        ax.axhline(y=0.1, color='red', linestyle='--', label='异常阈值')
+        ax.set_title("设备异常检测分数")
+        ax.set_xlabel("设备ID")
+        ax.set_ylabel("异常分数")
+        ax.tick_params(axis="x", labelrotation=45)
+        ax.legend()
         
         # 添加数值标签
         for bar, score in zip(bars, scores):
-            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.01,
+            ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.01,
                     f'{score:.3f}', ha='center', va='bottom')
         
-        plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        return self._finish(figure, "anomaly_scores", filename)
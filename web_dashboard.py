@@ -0,0 +1,278 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Dict, Optional
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>物联网安全监控面板</title>
+<style>
+body { font-family: Arial, sans-serif; margin: 20px; background: #f0f0f0; color: #2c3e50; }
+h1 { background: #2c3e50; color: white; padding: 12px; margin: 0 0 12px 0; font-size: 20px; }
+#system { margin-bottom: 12px; }
+table { border-collapse: collapse; width: 100%; background: white; }
+th, td { border: 1px solid #ddd; padding: 6px; text-align: left; font-size: 13px; }
+th { background: #ecf0f1; }
+</style>
+</head>
+<body>
+<h1>🛡️ 物联网安全监控面板</h1>
+<div id="system">连接中...</div>
+<table>
+<thead><tr><th>设备</th><th>记录数</th><th>平均发送</th><th>平均接收</th><th>最大连接</th><th>最后活动</th><th>模型</th></tr></thead>
+<tbody id="devices"></tbody>
+</table>
+<script>
+const devices = {};
+const esc = v => String(v).replace(/[&<>"']/g, c => `&#${c.charCodeAt(0)};`);
+function render() {
+  const rows = Object.keys(devices).sort().map(id => {
+    const d = devices[id];
+    return `<tr><td>${esc(id)}</td><td>${d.total_records}</td><td>${d.avg_bytes_sent.toFixed(1)}</td>` +
+           `<td>${d.avg_bytes_received.toFixed(1)}</td><td>${d.max_connections}</td>` +
+           `<td>${esc(d.last_seen)}</td><td>${d.has_model ? "✅" : "⏳"}</td></tr>`;
+  });
+  document.getElementById("devices").innerHTML = rows.join("");
+}
+function apply(view) {
+  if (view.system) {
+    const s = view.system;
+    document.getElementById("system").textContent =
+      `监控设备: ${s.monitored_devices} | 已知设备: ${s.known_devices} | 模型: ${s.trained_models} | 阈值: ${s.alert_threshold} | 版本: ${view.version}`;
+  }
+  for (const [id, d] of Object.entries(view.devices || {})) devices[id] = d;
+  for (const id of view.removed || []) delete devices[id];
+  render();
+}
+const source = new EventSource("/events");
+source.addEventListener("snapshot", e => { for (const id in devices) delete devices[id]; apply(JSON.parse(e.data)); });
+source.addEventListener("delta", e => apply(JSON.parse(e.data)));
+</script>
+</body>
+</html>
+"""
+
+
+class DashboardModel:
+    """服务端面板视图模型
+
+    每个刷新周期只计算一次：通过设备注册表的版本号只重新计算有变化的设备，
+    再和上一版视图比较得到增量。增量序列化一次后由所有连接共享，
+    因此观看者数量增加时计算成本基本不变。
+    """
+
+    def __init__(self, monitor, max_devices: int = 500, history: int = 100):
+        self.monitor = monitor
+        self.max_devices = max_devices
+        self.version = 0
+        self.devices: Dict[str, Dict] = {}
+        self.system: Dict = {}
+        self.snapshot_json = json.dumps({"version": 0, "system": {}, "devices": {}})
+        self.deltas = deque(maxlen=history)  # (版本号, 序列化后的增量)
+        self._registry_version = 0
+
+    def refresh(self) -> bool:
+        """重新计算并发布视图模型（单线程使用），有变化时返回 True"""
+        update = self.compute()
+        if update is None:
+            return False
+        self.publish(update)
+        return True
+
+    def compute(self) -> Optional[tuple]:
+        """计算下一版视图，不修改已发布的状态；没有变化时返回 None
+
+        注册表、设备统计和系统状态在监控锁内复制，比较和序列化在锁外进行。
+        可以在线程池中调用，结果交给 publish() 在读取视图的线程中发布。
+        """
+        with self.monitor._lock:
+            changes = self.monitor.get_device_changes(self._registry_version)
+            current_ids = self.monitor._get_active_devices(self.max_devices)
+            current_set = set(current_ids)
+            if changes["full_resync"]:
+                candidates = current_ids
+            else:
+                # 新进入显示范围的设备也需要计算
+                candidates = [d for d in changes["changed"] if d in current_set]
+                candidates.extend(d for d in current_ids if d not in self.devices)
+            views = {device_id: self._device_view(device_id) for device_id in candidates}
+            system = self.monitor.get_system_status()
+        self._registry_version = changes["version"]
+
+        updated = {device_id: view for device_id, view in views.items()
+                   if view and view != self.devices.get(device_id)}
+        removed = [d for d in self.devices if d not in current_set]
+
+        system_changed = system != self.system
+        if not updated and not removed and not system_changed:
+            return None
+
+        devices = {d: view for d, view in self.devices.items() if d in current_set}
+        devices.update(updated)
+        version = self.version + 1
+
+        delta = {"version": version, "devices": updated, "removed": removed}
+        if system_changed:
+            delta["system"] = system
+        delta_json = json.dumps(delta, ensure_ascii=False, default=str)
+        snapshot_json = json.dumps({"version": version, "system": system, "devices": devices},
+                                   ensure_ascii=False, default=str)
+        return version, devices, system, delta_json, snapshot_json
+
+    def publish(self, update: tuple):
+        """同时发布版本号、增量和快照（与 SSE 连接在同一线程中调用）"""
+        version, devices, system, delta_json, snapshot_json = update
+        self.devices = devices
+        self.system = system
+        self.deltas.append((version, delta_json))
+        self.snapshot_json = snapshot_json
+        self.version = version
+
+    def _device_view(self, device_id: str) -> Optional[Dict]:
+        """单个设备的视图数据"""
+        stats = self.monitor.get_device_statistics(device_id)
+        if not stats:
+            return None
+        return {
+            "total_records": stats["total_records"],
+            "avg_bytes_sent": round(float(stats["avg_bytes_sent"]), 1),
+            "avg_bytes_received": round(float(stats["avg_bytes_received"]), 1),
+            "max_connections": stats["max_connections"],
+            "last_seen": stats["last_seen"],
+            "has_model": device_id in self.monitor.baseline_models or self.monitor.cohorts.has_model(device_id)
+        }
+
+    def deltas_since(self, version: int):
+        """返回某版本之后的增量；落后太多时返回 None（需要重新发送快照）"""
+        if not self.deltas or version >= self.version:
+            return []
+        if self.deltas[0][0] > version + 1:
+            return None
+        return [payload for v, payload in self.deltas if v > version]
+
+
+class WebDashboardServer:
+    """无界面的HTTP面板服务（运行在 AsyncRuntime 的事件循环上）
+
+    /             面板页面
+    /api/snapshot 当前完整视图（JSON）
+    /events       SSE 流：先发送快照，之后只推送增量
+    """
+
+    def __init__(self, monitor, host: str = "127.0.0.1", port: int = 8080,
+                 refresh_interval: float = 2.0, max_devices: int = 500,
+                 heartbeat_interval: float = 15.0):
+        self.model = DashboardModel(monitor, max_devices)
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.clients = 0
+        self.runtime = None
+        self.server = None
+        self._published: Optional[asyncio.Event] = None
+
+    def start(self, runtime):
+        """启动HTTP服务和视图刷新任务"""
+        self.runtime = runtime
+        runtime.run_coroutine(self._serve()).result()
+        runtime.schedule_periodic("web.refresh", self.refresh_interval, self._refresh, run_immediately=True)
+
+    async def _serve(self):
+        self._published = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        sockname = self.server.sockets[0].getsockname()
+        self.port = sockname[1]
+        print(f"🌐 Web面板: http://{sockname[0]}:{sockname[1]}/")
+
+    async def _refresh(self):
+        """在线程池中计算视图（等待监控锁时不阻塞事件循环），在事件循环中发布并唤醒所有SSE连接"""
+        update = await asyncio.get_running_loop().run_in_executor(None, self.model.compute)
+        if update is not None:
+            self.model.publish(update)
+            published, self._published = self._published, asyncio.Event()
+            published.set()
+
+    async def _handle(self, reader, writer):
+        """处理一个HTTP请求"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while True:
+                header = await asyncio.wait_for(reader.readline(), 10)
+                if header in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", b"")
+                return
+
+            path = parts[1].split("?", 1)[0]
+            if path == "/":
+                await self._respond(writer, "200 OK", "text/html; charset=utf-8",
+                                    DASHBOARD_HTML.encode("utf-8"))
+            elif path == "/api/snapshot":
+                await self._respond(writer, "200 OK", "application/json; charset=utf-8",
+                                    self.model.snapshot_json.encode("utf-8"))
+            elif path == "/events":
+                await self._stream_events(writer)
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", b"not found")
+        except (asyncio.TimeoutError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status: str, content_type: str, body: bytes):
+        """发送完整响应"""
+        writer.write((f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _stream_events(self, writer):
+        """SSE推送：快照 + 增量"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+        self.clients += 1
+        try:
+            version = self.model.version
+            writer.write(f"event: snapshot\ndata: {self.model.snapshot_json}\n\n".encode("utf-8"))
+            await writer.drain()
+
+            while True:
+                if self.model.version == version:
+                    try:
+                        await asyncio.wait_for(self._published.wait(), self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        writer.write(b": heartbeat\n\n")
+                        await writer.drain()
+                        continue
+
+                deltas = self.model.deltas_since(version)
+                if deltas is None:
+                    writer.write(f"event: snapshot\ndata: {self.model.snapshot_json}\n\n".encode("utf-8"))
+                else:
+                    for payload in deltas:
+                        writer.write(f"event: delta\ndata: {payload}\n\n".encode("utf-8"))
+                version = self.model.version
+                await writer.drain()
+        finally:
+            self.clients -= 1
+
+    def stop(self):
+        """关闭监听端口（需在运行时停止之前调用）"""
+        if self.server and self.runtime.running:
+            self.runtime.call_soon(self.server.close)
+
+    def get_status(self) -> Dict:
+        """获取面板服务状态"""
+        return {
+            "listen": f"{self.host}:{self.port}",
+            "clients": self.clients,
+            "view_version": self.model.version,
+            "timestamp": time.time()
+        }
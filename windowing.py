@@ -0,0 +1,345 @@
+import ipaddress
+import math
+import sys
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from sketches import HyperLogLog
+
+# 窗格中的连接数/目标数用 HyperLogLog 估计，数量较少时仍是精确值
+PANE_HLL_PRECISION = 10
+
+# 发送包大小直方图的分箱上界（字节），最后一箱为大于最后一个上界的包
+SIZE_BIN_EDGES = (64, 128, 256, 512, 1024)
+SIZE_FEATURES = ["size_0_64", "size_64_128", "size_128_256",
+                 "size_256_512", "size_512_1024", "size_1024_plus"]
+
+# 周期性检测：每个窗口按时间切成的发包计数片数（FFT 长度）
+PERIOD_BINS = 64
+
+# 由数据包增量计算的设备行为特征（均针对设备发出的数据包）
+BEHAVIOR_FEATURES = ["iat_mean", "iat_variance", *SIZE_FEATURES,
+                     "dominant_period", "periodicity_strength"]
+
+
+@lru_cache(maxsize=65536)
+def is_local_address(ip: str) -> bool:
+    """判断IP是否为内网地址（IoT设备通常位于内网）"""
+    try:
+        return ipaddress.ip_address(ip).is_private
+    except ValueError:
+        return False
+
+
+def default_device_resolver(packet_info: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """默认设备识别：以内网IP作为设备ID，返回 (发送方设备, 接收方设备)"""
+    src_ip = packet_info.get("src_ip")
+    dst_ip = packet_info.get("dst_ip")
+    src_device = src_ip if src_ip and is_local_address(src_ip) else None
+    dst_device = dst_ip if dst_ip and is_local_address(dst_ip) else None
+    return src_device, dst_device
+
+
+def periodicity(series: np.ndarray, window_size: float) -> Tuple[np.ndarray, np.ndarray]:
+    """对每行发包计数序列做FFT，返回 (主周期秒数, 周期强度)
+
+    所有设备一次批量计算。信标类流量是脉冲串，功率分散在基频和各次谐波上，
+    因此按"基频及其谐波的平均功率"选择基频（相差一成以内取频率最低的），
+    强度为基频及其谐波的功率占总功率（不含直流分量）的比例，
+    严格周期的信标接近1；没有波动的行周期和强度都为0。
+    """
+    if series.size == 0:
+        return np.zeros(len(series)), np.zeros(len(series))
+    centered = series - series.mean(axis=1, keepdims=True)
+    power = np.abs(np.fft.rfft(centered, axis=1)[:, 1:]) ** 2
+    harmonics = _harmonic_mask(power.shape[1])
+    score = power @ harmonics.T / harmonics.sum(axis=1)
+    fundamental = np.argmax(score >= 0.9 * score.max(axis=1, keepdims=True), axis=1)
+    total = power.sum(axis=1)
+    has_signal = total > 1e-12
+    strength = np.where(has_signal, (power * harmonics[fundamental]).sum(axis=1) / np.where(has_signal, total, 1.0), 0.0)
+    period = np.where(has_signal, window_size / (fundamental + 1), 0.0)
+    return period, strength
+
+
+@lru_cache(maxsize=8)
+def _harmonic_mask(n: int) -> np.ndarray:
+    """谐波掩码：第 f 行标记频率 f+1 的所有整数倍"""
+    frequencies = np.arange(1, n + 1)
+    return (frequencies[None, :] % frequencies[:, None] == 0).astype(float)
+
+
+class _PaneStats:
+    """单个窗格内单个设备的聚合数据"""
+
+    __slots__ = ("bytes_sent", "bytes_received", "packets_sent", "packets_received",
+                 "connections", "destinations", "iat_count", "iat_sum", "iat_sq_sum",
+                 "size_hist", "arrivals")
+
+    def __init__(self, bins_per_pane: int = 1):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.connections = HyperLogLog(PANE_HLL_PRECISION)
+        self.destinations = HyperLogLog(PANE_HLL_PRECISION)
+        # 发包间隔的计数/和/平方和，可以跨窗格直接相加
+        self.iat_count = 0
+        self.iat_sum = 0.0
+        self.iat_sq_sum = 0.0
+        self.size_hist = [0] * (len(SIZE_BIN_EDGES) + 1)
+        self.arrivals = [0] * bins_per_pane  # 窗格内每个时间片的发包数
+
+
+class WindowManager:
+    """基于事件时间的滚动/滑动窗口管理
+
+    窗口由数据包自身的时间戳（浮点epoch秒）驱动，而不是墙上时钟。
+    滑动窗口按步长切成窗格（pane），每个数据包只更新一个窗格，窗口关闭时
+    再合并其覆盖的窗格，因此每包开销为O(1)。水位线 = 最大事件时间 - 允许延迟，
+    水位线越过窗口结束时间时窗口关闭；早于已关闭边界的迟到数据包会被丢弃并计数。
+    window_size == slide 时即为滚动窗口。
+
+    每个设备发出的数据包还会增量更新行为特征（每包O(1)）：发包间隔的均值/方差、
+    包大小直方图，以及按时间片计数的发包序列；窗口关闭时对所有设备的序列
+    批量做FFT得到主周期和周期强度。
+    """
+
+    def __init__(self, window_size: float = 60.0, slide: float = None,
+                 allowed_lateness: float = 2.0,
+                 on_close: Callable[[float, Dict[str, Dict]], None] = None,
+                 device_resolver: Callable = None):
+        slide = slide or window_size
+        if slide <= 0 or window_size < slide:
+            raise ValueError("窗口长度必须不小于滑动步长且步长大于0")
+        if abs(window_size / slide - round(window_size / slide)) > 1e-9:
+            raise ValueError("窗口长度必须是滑动步长的整数倍")
+
+        self.window_size = float(window_size)
+        self.slide = float(slide)
+        self.panes_per_window = int(round(window_size / slide))
+        self.allowed_lateness = float(allowed_lateness)
+        self.on_close = on_close
+        self.device_resolver = device_resolver or default_device_resolver
+
+        # 每个窗格切成的时间片数，整个窗口共 bins_per_pane * panes_per_window 片
+        self.bins_per_pane = max(1, int(round(PERIOD_BINS / self.panes_per_window)))
+        self.bin_width = self.slide / self.bins_per_pane
+
+        self._panes: Dict[int, Dict[str, _PaneStats]] = {}
+        self._last_sent: Dict[str, float] = {}  # 设备最近一次发包的事件时间
+        self._closed_until = None  # 已关闭窗口的结束边界
+        self.max_event_time = None
+        self._last_arrival = None  # 最近一次收到数据包的处理时间
+        self.late_packets = 0
+        self.total_packets = 0
+        self.closed_windows = 0
+
+    @property
+    def watermark(self) -> Optional[float]:
+        """当前水位线"""
+        if self.max_event_time is None:
+            return None
+        return self.max_event_time - self.allowed_lateness
+
+    def add_packet(self, packet_info: Dict, arrival_time: float = None):
+        """加入一个数据包，可能触发窗口关闭"""
+        ts = packet_info["timestamp"]
+        self.total_packets += 1
+
+        if self._closed_until is None:
+            self._closed_until = math.floor(ts / self.slide) * self.slide
+        elif ts < self._closed_until:
+            self.late_packets += 1
+            return
+
+        src_device, dst_device = self.device_resolver(packet_info)
+        if src_device is None and dst_device is None:
+            self._advance_event_time(ts, arrival_time)
+            return
+
+        pane_index = int(ts // self.slide)
+        pane = self._panes.get(pane_index)
+        if pane is None:
+            pane = self._panes[pane_index] = {}
+
+        length = packet_info.get("length", 0)
+        dst_ip = packet_info.get("dst_ip")
+        src_ip = packet_info.get("src_ip")
+
+        if src_device is not None:
+            stats = pane.get(src_device)
+            if stats is None:
+                stats = pane[src_device] = _PaneStats(self.bins_per_pane)
+            stats.bytes_sent += length
+            stats.packets_sent += 1
+            stats.connections.add(f"{dst_ip}|{packet_info.get('dst_port')}|{packet_info.get('protocol')}")
+            stats.destinations.add(str(dst_ip))
+
+            # 行为特征：乱序到达的包不计入发包间隔
+            last = self._last_sent.get(src_device)
+            if last is None or ts >= last:
+                if last is not None:
+                    interval = ts - last
+                    stats.iat_count += 1
+                    stats.iat_sum += interval
+                    stats.iat_sq_sum += interval * interval
+                self._last_sent[src_device] = ts
+            stats.size_hist[bisect_right(SIZE_BIN_EDGES, length)] += 1
+            slot = int((ts - pane_index * self.slide) / self.bin_width)
+            stats.arrivals[min(slot, self.bins_per_pane - 1)] += 1
+
+        if dst_device is not None:
+            stats = pane.get(dst_device)
+            if stats is None:
+                stats = pane[dst_device] = _PaneStats(self.bins_per_pane)
+            stats.bytes_received += length
+            stats.packets_received += 1
+            stats.connections.add(f"{src_ip}|{packet_info.get('src_port')}|{packet_info.get('protocol')}")
+
+        self._advance_event_time(ts, arrival_time)
+
+    def _advance_event_time(self, ts: float, arrival_time: float = None):
+        """更新最大事件时间并推进水位线"""
+        if arrival_time is not None:
+            self._last_arrival = arrival_time
+        if self.max_event_time is None or ts > self.max_event_time:
+            self.max_event_time = ts
+            self.advance(self.watermark)
+
+    def advance(self, watermark: float):
+        """关闭所有结束时间不晚于水位线的窗口"""
+        if watermark is None or self._closed_until is None:
+            return
+
+        while self._closed_until + self.slide <= watermark:
+            if not self._panes:
+                # 没有待处理数据，直接跳到水位线
+                self._closed_until = math.floor(watermark / self.slide) * self.slide
+                break
+
+            # 跳过中间没有任何数据的窗口
+            first_end = (min(self._panes) + 1) * self.slide
+            if first_end > self._closed_until + self.slide:
+                self._closed_until = min(first_end, math.floor(watermark / self.slide) * self.slide + self.slide) - self.slide
+                if self._closed_until + self.slide > watermark:
+                    break
+
+            window_end = self._closed_until + self.slide
+            self._emit(window_end)
+            self._closed_until = window_end
+
+    def advance_idle(self, now: float):
+        """流量中断时按处理时间推进水位线，避免窗口一直不关闭"""
+        if self._last_arrival is None or self.max_event_time is None:
+            return
+        idle = now - self._last_arrival
+        if idle > self.allowed_lateness:
+            self.advance(self.max_event_time + idle - self.allowed_lateness)
+
+    def forget_device(self, device_id: str):
+        """设备被淘汰时释放其发包时间记录"""
+        self._last_sent.pop(device_id, None)
+
+    def flush(self):
+        """关闭所有未关闭的窗口（回放结束时使用）"""
+        if self._panes:
+            self.advance((max(self._panes) + self.panes_per_window) * self.slide)
+
+    def _emit(self, window_end: float):
+        """合并窗格并输出一个窗口的统计结果"""
+        last_pane = int(round(window_end / self.slide)) - 1
+        first_pane = last_pane - self.panes_per_window + 1
+
+        merged: Dict[str, Dict] = {}
+        connections: Dict[str, HyperLogLog] = {}
+        destinations: Dict[str, HyperLogLog] = {}
+        behavior: Dict[str, List] = {}  # 设备 -> [间隔计数, 间隔和, 间隔平方和, 大小直方图, 发包序列]
+        for position, index in enumerate(range(first_pane, last_pane + 1)):
+            pane = self._panes.get(index)
+            if not pane:
+                continue
+            offset = position * self.bins_per_pane
+            for device_id, stats in pane.items():
+                record = merged.get(device_id)
+                if record is None:
+                    record = merged[device_id] = {
+                        "bytes_sent": 0, "bytes_received": 0,
+                        "packets_sent": 0, "packets_received": 0
+                    }
+                    connections[device_id] = HyperLogLog(PANE_HLL_PRECISION)
+                    destinations[device_id] = HyperLogLog(PANE_HLL_PRECISION)
+                    behavior[device_id] = [0, 0.0, 0.0, [0] * (len(SIZE_BIN_EDGES) + 1),
+                                           [0] * (self.bins_per_pane * self.panes_per_window)]
+                record["bytes_sent"] += stats.bytes_sent
+                record["bytes_received"] += stats.bytes_received
+                record["packets_sent"] += stats.packets_sent
+                record["packets_received"] += stats.packets_received
+                connections[device_id].merge(stats.connections)
+                destinations[device_id].merge(stats.destinations)
+                if stats.packets_sent:
+                    acc = behavior[device_id]
+                    acc[0] += stats.iat_count
+                    acc[1] += stats.iat_sum
+                    acc[2] += stats.iat_sq_sum
+                    acc[3] = [a + b for a, b in zip(acc[3], stats.size_hist)]
+                    acc[4][offset:offset + self.bins_per_pane] = stats.arrivals
+
+        # 丢弃不再被任何未关闭窗口覆盖的窗格
+        for index in [i for i in self._panes if i <= first_pane]:
+            del self._panes[index]
+
+        if not merged:
+            return
+
+        for device_id, record in merged.items():
+            record["connection_count"] = connections[device_id].count()
+            record["unique_destinations"] = destinations[device_id].count()
+        self._add_behavior_features(merged, behavior)
+
+        self.closed_windows += 1
+        if self.on_close:
+            self.on_close(window_end, merged)
+
+    def _add_behavior_features(self, merged: Dict[str, Dict], behavior: Dict[str, List]):
+        """由合并后的累加量计算行为特征，周期性对所有设备批量计算"""
+        device_ids = list(merged)
+        series = np.array([behavior[d][4] for d in device_ids], dtype=float)
+        periods, strengths = periodicity(series.reshape(len(device_ids), -1), self.window_size)
+
+        for i, device_id in enumerate(device_ids):
+            record = merged[device_id]
+            count, total, sq_total, size_hist, _ = behavior[device_id]
+            mean = total / count if count else 0.0
+            record["iat_mean"] = mean
+            record["iat_variance"] = max(sq_total / count - mean * mean, 0.0) if count else 0.0
+            sent = record["packets_sent"]
+            for name, bin_count in zip(SIZE_FEATURES, size_hist):
+                record[name] = bin_count / sent if sent else 0.0
+            record["dominant_period"] = float(periods[i])
+            record["periodicity_strength"] = float(strengths[i])
+
+    @property
+    def nbytes(self) -> int:
+        """估计未关闭窗格占用的内存字节数"""
+        total = sys.getsizeof(self._panes) + sys.getsizeof(self._last_sent) + len(self._last_sent) * 100
+        for pane in self._panes.values():
+            total += sys.getsizeof(pane)
+            for stats in pane.values():
+                total += (200 + 8 * (len(stats.size_hist) + len(stats.arrivals))
+                          + stats.connections.nbytes + stats.destinations.nbytes)
+        return total
+
+    def get_status(self) -> Dict:
+        """获取窗口状态"""
+        return {
+            "window_size": self.window_size,
+            "slide": self.slide,
+            "allowed_lateness": self.allowed_lateness,
+            "watermark": self.watermark,
+            "open_panes": len(self._panes),
+            "closed_windows": self.closed_windows,
+            "total_packets": self.total_packets,
+            "late_packets": self.late_packets
+        }